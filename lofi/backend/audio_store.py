@@ -0,0 +1,256 @@
+import mmap
+import os
+import re
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import NamedTuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+CHUNK_SIZE = 256 * 1024
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+CONTENT_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+VARIANT_HEADER = 'x-audio-variant'
+
+class AudioFile(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    mtime_ns: int
+    etag: str
+    last_modified: str
+
+class AudioLibrary:
+    def __init__(self, directory, extensions=('.mp3',), rescan_interval=30.0, etag_suffix=''):
+        """
+        In-memory index of the servable files in a directory.
+
+        A lookup costs one stat of the named file, so a file rewritten under the
+        same name gets a fresh size and ETag and a deleted one is dropped. An
+        unknown name triggers a rescan at most once per rescan_interval so newly
+        downloaded tracks show up.
+
+        :param directory: Directory holding the audio files
+        :param extensions: File extensions to index
+        :param rescan_interval: Minimum seconds between rescans triggered by misses
+        :param etag_suffix: Appended to every ETag, so transcoded variants of a file never share its validator
+        """
+        self.directory = directory
+        self.extensions = tuple(extensions)
+        self.rescan_interval = rescan_interval
+        self.etag_suffix = etag_suffix
+        self._files = {}
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        """
+        Rebuild the filename index from the directory listing.
+        """
+        files = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith(self.extensions):
+                continue
+            files[entry.name] = self._entry(entry.name, entry.path, entry.stat())
+        self._files = files
+        self._scanned_at = time.monotonic()
+
+    def _entry(self, name, path, stat):
+        stem = os.path.splitext(name)[0]
+        # Content-addressed files already carry a strong validator in their name
+        if CONTENT_HASH_PATTERN.match(stem):
+            etag = f'"{stem}{self.etag_suffix}"'
+        else:
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{self.etag_suffix}"'
+        return AudioFile(
+            path=path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            mtime_ns=stat.st_mtime_ns,
+            etag=etag,
+            last_modified=formatdate(stat.st_mtime, usegmt=True)
+        )
+
+    def get(self, filename):
+        """
+        Look up a file by name.
+
+        :param filename: Bare file name (no directories)
+        :return: AudioFile or None if it is not in the library
+        """
+        entry = self._files.get(filename)
+        if entry is None:
+            if time.monotonic() - self._scanned_at >= self.rescan_interval:
+                with self._lock:
+                    if time.monotonic() - self._scanned_at >= self.rescan_interval:
+                        self.scan()
+                entry = self._files.get(filename)
+            return entry
+        try:
+            stat = os.stat(entry.path)
+        except FileNotFoundError:
+            self._files.pop(filename, None)
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            # Rewritten in place since it was indexed
+            entry = self._files[filename] = self._entry(filename, entry.path, stat)
+        return entry
+
+    def __contains__(self, filename):
+        return filename in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+class ZeroCopyFileResponse(Response):
+    def __init__(self, path, start, length, status_code=200, headers=None, media_type=None):
+        """
+        Send a byte range of a file without buffering it in Python.
+
+        Uses the ASGI http.response.zerocopy extension (sendfile) when the
+        server offers it, and otherwise streams slices of a memory map.
+
+        :param path: File to send
+        :param start: Offset of the first byte
+        :param length: Number of bytes to send
+        """
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = length
+        self.raw_headers = [
+            (name, value) for name, value in self.raw_headers if name != b'content-length'
+        ] + [(b'content-length', str(length).encode('latin-1'))]
+
+    async def __call__(self, scope, receive, send):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            await Response(status_code=404)(scope, receive, send)
+            return
+
+        with f:
+            await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+            if scope.get('method') == 'HEAD' or self.length == 0:
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+
+            if 'http.response.zerocopy' in scope.get('extensions', {}):
+                await send({
+                    'type': 'http.response.zerocopy',
+                    'file': f,
+                    'offset': self.start,
+                    'count': self.length,
+                    'more_body': False
+                })
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                end = self.start + self.length
+                for offset in range(self.start, end, CHUNK_SIZE):
+                    chunk_end = min(offset + CHUNK_SIZE, end)
+                    await send({
+                        'type': 'http.response.body',
+                        'body': mapped[offset:chunk_end],
+                        'more_body': chunk_end < end
+                    })
+
+def requested_variant(request: Request, save_data_variant=None):
+    """
+    Variant a client asked for: the variant query parameter, then the
+    X-Audio-Variant header, then Save-Data: on (mapped to save_data_variant).
+
+    :return: Variant name, or None for the original file
+    """
+    name = request.query_params.get('variant') or request.headers.get(VARIANT_HEADER)
+    if not name and save_data_variant and request.headers.get('save-data', '').strip().lower() == 'on':
+        name = save_data_variant
+    return None if not name or name == 'original' else name
+
+def _parse_range(header, size):
+    """
+    Parse a single-range Range header.
+
+    :return: (start, end) inclusive, None to ignore the header, or False if unsatisfiable
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(0) == 'bytes=-':
+        # Malformed or multi-range requests are answered with the full body
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or (last and int(last) < start):
+            return False
+    else:
+        suffix = int(last)
+        if suffix == 0:
+            return False
+        start = max(size - suffix, 0)
+        end = size - 1
+    return start, end
+
+def _not_modified_since(header, entry):
+    try:
+        return int(entry.mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def file_response(request: Request, entry: AudioFile, media_type, headers=None):
+    """
+    Build a conditional, range-aware response for a library file.
+
+    Handles If-None-Match / If-Modified-Since (304), Range with If-Range (206)
+    and unsatisfiable ranges (416).
+
+    :param request: Incoming request
+    :param entry: AudioFile from an AudioLibrary
+    :param media_type: Content type of the file
+    :param headers: Extra response headers
+    :return: Response
+    """
+    base_headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': entry.etag,
+        'Last-Modified': entry.last_modified,
+        **(headers or {})
+    }
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' in tags or entry.etag in tags or f'W/{entry.etag}' in tags:
+            return Response(status_code=304, headers=base_headers)
+    elif 'if-modified-since' in request.headers and _not_modified_since(request.headers['if-modified-since'], entry):
+        return Response(status_code=304, headers=base_headers)
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and if_range and if_range not in (entry.etag, entry.last_modified):
+        # The client's copy is stale, so it gets the whole (new) file
+        range_header = None
+
+    byte_range = _parse_range(range_header, entry.size) if range_header else None
+    if byte_range is False:
+        return Response(
+            status_code=416,
+            headers={**base_headers, 'Content-Range': f'bytes */{entry.size}'}
+        )
+    if byte_range is None:
+        return ZeroCopyFileResponse(entry.path, 0, entry.size, headers=base_headers, media_type=media_type)
+
+    start, end = byte_range
+    return ZeroCopyFileResponse(
+        entry.path, start, end - start + 1,
+        status_code=206,
+        headers={**base_headers, 'Content-Range': f'bytes {start}-{end}/{entry.size}'},
+        media_type=media_type
+    )
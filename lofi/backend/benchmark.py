@@ -0,0 +1,755 @@
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import chromadb
+
+from .query import AudioQueryManager, ChromaSearchBackend, NumpySearchBackend
+from .ivf import IVFIndex
+from .embeddings import (BACKENDS, CALIBRATION_TEXTS, EMBEDDING_MODEL_NAME, embedding_error,
+                         load_embedding_model, model_threads)
+
+EMBEDDING_DIM = 384
+
+def _rss_bytes():
+    """
+    Current resident set size of this process (Linux), or 0 if unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def _percentiles(samples):
+    """
+    Summarize latency samples (seconds) as milliseconds.
+    """
+    samples_ms = np.asarray(samples) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'p99_ms': float(np.percentile(samples_ms, 99)),
+        'mean_ms': float(samples_ms.mean())
+    }
+
+def synthetic_embeddings(n, dim=EMBEDDING_DIM, seed=0):
+    """
+    Random unit vectors standing in for MiniLM prompt embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+def clustered_embeddings(n, dim=EMBEDDING_DIM, n_topics=200, spread=0.6, seed=0):
+    """
+    Unit vectors drawn around random topic centres.
+
+    Real prompt embeddings cluster by theme; uniform random vectors have no
+    structure and make any partitioned index look worse than it is.
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+    noise = rng.standard_normal((n, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+    embeddings = topics[rng.integers(0, n_topics, n)] + noise
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32)
+
+class HashEmbedder:
+    """
+    Deterministic stand-in for the sentence transformer.
+
+    Each text maps to a fixed random unit vector seeded by its hash, so
+    benchmarks measure our code paths rather than model inference.
+    """
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.calls = 0
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=False, **kwargs):
+        self.calls += 1
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dim)
+            embeddings[i] = vector / np.linalg.norm(vector)
+        return embeddings[0] if single else embeddings
+
+def build_synthetic_collection(db_path, n, dim=EMBEDDING_DIM, seed=0, batch_size=5000, audio_dir='/audio'):
+    """
+    Create a persistent Chroma collection filled with synthetic tracks.
+
+    :return: Tuple of (collection, embeddings)
+    """
+    embeddings = synthetic_embeddings(n, dim, seed)
+    client = chromadb.PersistentClient(path=db_path)
+    collection = client.get_or_create_collection(name='audio')
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        collection.add(
+            ids=[f'track-{i}' for i in range(start, stop)],
+            embeddings=embeddings[start:stop].tolist(),
+            metadatas=[
+                {
+                    'prompt': f'synthetic lo-fi prompt {i}',
+                    'audio_url': f'https://example.invalid/audio/{i}.mp3',
+                    'local_audio_path': os.path.join(audio_dir, f'track-{i}.mp3')
+                }
+                for i in range(start, stop)
+            ]
+        )
+    return collection, embeddings
+
+def _time_queries(backend, queries, n_results):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.search([query], n_results)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def _time_calls(fn, args):
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def bench_search_backends(sizes=(1000, 5000, 20000), n_queries=200, n_results=5,
+                          dtypes=('float32', 'float16', 'int8')):
+    """
+    Compare Chroma and in-memory NumPy search latency and memory.
+
+    Memory for Chroma is the RSS growth from opening the persisted collection
+    and running the first query; for NumPy it is the matrix size.
+
+    :return: List of result dictionaries, one per (size, backend)
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as db_path:
+            build_synthetic_collection(db_path, size)
+            queries = synthetic_embeddings(n_queries, seed=size + 1)
+
+            # Reopen so the measured RSS covers loading the persisted index
+            rss_before = _rss_bytes()
+            collection = chromadb.PersistentClient(path=db_path).get_collection(name='audio')
+            chroma = ChromaSearchBackend(collection)
+            chroma.search([queries[0]], n_results)
+            chroma_rss = _rss_bytes() - rss_before
+            results.append({
+                'size': size,
+                'backend': 'chroma',
+                'memory_bytes': chroma_rss,
+                **_percentiles(_time_queries(chroma, queries, n_results))
+            })
+
+            for dtype in dtypes:
+                start = time.perf_counter()
+                backend = NumpySearchBackend(collection, dtype=dtype)
+                load_seconds = time.perf_counter() - start
+                results.append({
+                    'size': size,
+                    'backend': f'numpy-{dtype}',
+                    'memory_bytes': backend.nbytes,
+                    'load_seconds': load_seconds,
+                    **_percentiles(_time_queries(backend, queries, n_results))
+                })
+    return results
+
+def bench_ann(sizes=(10000, 100000), n_queries=200, n_results=10, probes=(1, 2, 4, 8, 16, 32), n_lists=None):
+    """
+    Recall@k and latency of the IVF index against exact float32 search.
+
+    Queries are perturbed copies of catalog vectors, like a prompt that is
+    close to but not identical to stored ones.
+
+    :return: List of result dictionaries, one per (size, n_probe), plus an exact baseline per size
+    """
+    results = []
+    for size in sizes:
+        embeddings = clustered_embeddings(size, seed=size)
+        ids = [f'track-{i}' for i in range(size)]
+        rng = np.random.default_rng(size + 1)
+        noise = rng.standard_normal((n_queries, embeddings.shape[1])).astype(np.float32)
+        queries = embeddings[rng.integers(0, size, n_queries)] + np.float32(0.02) * noise
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        exact_samples = []
+        truth = []
+        for query in queries:
+            start = time.perf_counter()
+            scores = embeddings @ query
+            top = np.argpartition(-scores, n_results - 1)[:n_results]
+            exact_samples.append(time.perf_counter() - start)
+            truth.append({ids[i] for i in top})
+        results.append({
+            'size': size,
+            'backend': 'exact-float32',
+            'memory_bytes': embeddings.nbytes,
+            'recall': 1.0,
+            **_percentiles(exact_samples)
+        })
+
+        start = time.perf_counter()
+        index = IVFIndex.build(ids, embeddings, n_lists=n_lists)
+        build_seconds = time.perf_counter() - start
+        for n_probe in probes:
+            if n_probe > index.n_lists:
+                continue
+            samples = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                rows, _ = index.search([query], n_results, n_probe=n_probe)[0]
+                samples.append(time.perf_counter() - start)
+                hits += len(expected & {index.ids[row] for row in rows})
+            results.append({
+                'size': size,
+                'backend': 'ivf-int8',
+                'n_lists': index.n_lists,
+                'n_probe': n_probe,
+                'build_seconds': build_seconds,
+                'memory_bytes': index.nbytes,
+                'recall': hits / (n_results * len(queries)),
+                **_percentiles(samples)
+            })
+    return results
+
+def bench_semantic_search(sizes=(1000, 5000, 20000), n_queries=200, n_results=5,
+                          backends=('chroma', 'numpy')):
+    """
+    End-to-end AudioQueryManager.semantic_search latency with a stubbed embedder.
+
+    Cold queries are all distinct, so each one is embedded and searched; the
+    cached pass repeats them and measures the result-cache hit path.
+
+    :return: List of result dictionaries, one per (size, backend)
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as db_path:
+            build_synthetic_collection(db_path, size)
+            queries = [f'benchmark query {i}' for i in range(n_queries)]
+            for backend in backends:
+                manager = AudioQueryManager(
+                    db_path=db_path, embedding_model=HashEmbedder(),
+                    result_cache_size=n_queries, search_backend=backend
+                )
+                cold = _time_calls(lambda query: manager.semantic_search(query, n_results), queries)
+                cached = _time_calls(lambda query: manager.semantic_search(query, n_results), queries)
+                results.append({
+                    'size': size,
+                    'backend': backend,
+                    **_percentiles(cold),
+                    'cached_p50_ms': _percentiles(cached)['p50_ms']
+                })
+    return results
+
+def bench_contains_filter(sizes=(1000, 5000, 20000), n_queries=100, n_results=50):
+    """
+    Cost of $contains filters on the indexed prompt field and on an unindexed field.
+
+    The unindexed field falls back to fetching and scanning the whole collection.
+
+    :return: List of result dictionaries, one per (size, field)
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as db_path:
+            build_synthetic_collection(db_path, size)
+            manager = AudioQueryManager(db_path=db_path, embedding_model=HashEmbedder())
+            rng = random.Random(size)
+            terms = [str(rng.randrange(size)) for _ in range(n_queries)]
+            for field in ('prompt', 'audio_url'):
+                samples = _time_calls(lambda term: manager._manual_contains_filter(field, term, n_results), terms)
+                results.append({
+                    'size': size,
+                    'field': field,
+                    'indexed': field == manager.text_index.field,
+                    **_percentiles(samples)
+                })
+    return results
+
+class _DatasetHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type):
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out on a stalled response and hung up
+            pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        server = self.server
+        with server.rng_lock:
+            roll = server.rng.random()
+        if roll < server.failure_rate:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if roll < server.failure_rate + server.stall_rate:
+            # Hang past the client's read timeout
+            time.sleep(server.stall_seconds)
+        if parts.path == '/rows':
+            params = parse_qs(parts.query)
+            offset = int(params['offset'][0])
+            length = int(params['length'][0])
+            rows = [
+                {
+                    'row_idx': i,
+                    'row': {
+                        'id': f'row-{i}',
+                        'prompt': f'synthetic lo-fi prompt {i}',
+                        'audio': [{'src': f'{server.audio_url}/audio/{i}.mp3', 'type': 'audio/mpeg'}]
+                    },
+                    'truncated_cells': []
+                }
+                for i in range(offset, min(offset + length, server.num_rows))
+            ]
+            self._send(json.dumps({'rows': rows, 'num_rows_total': server.num_rows}).encode('utf-8'), 'application/json')
+        elif parts.path.startswith('/audio/'):
+            # Unique bytes per row so content-addressed files do not collapse
+            self._send(parts.path.encode('utf-8') + server.audio_payload, 'audio/mpeg')
+        else:
+            self.send_error(404)
+
+class FakeDatasetServer:
+    """
+    Local stand-in for the datasets-server /rows endpoint and the audio CDN.
+
+    failure_rate and stall_rate inject 503 responses and responses delayed by
+    stall_seconds; audio_url points the rows' audio at another host, e.g. one
+    that is down.
+    """
+    def __init__(self, num_rows=1000, audio_bytes=64 * 1024, failure_rate=0.0, stall_rate=0.0,
+                 stall_seconds=5.0, audio_url=None, seed=0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _DatasetHandler)
+        self.server.daemon_threads = True
+        self.server.num_rows = num_rows
+        self.server.audio_payload = os.urandom(audio_bytes)
+        self.server.failure_rate = failure_rate
+        self.server.stall_rate = stall_rate
+        self.server.stall_seconds = stall_seconds
+        self.server.rng = random.Random(seed)
+        self.server.rng_lock = threading.Lock()
+        self.server.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.server.audio_url = audio_url or self.server.url
+        self.url = self.server.url
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+def bench_ingestion(num_rows=1000, batch_size=64, workers=8, audio_bytes=64 * 1024):
+    """
+    Ingestion throughput (rows/s) from a local fake dataset server into Chroma.
+
+    :return: Result dictionary with overall and per-stage throughput
+    """
+    from .download import audio_download_upstream, iter_dataset_rows, populate_chromadb
+
+    with FakeDatasetServer(num_rows, audio_bytes) as server, tempfile.TemporaryDirectory() as work_dir:
+        collection = chromadb.PersistentClient(path=os.path.join(work_dir, 'db')).get_or_create_collection(name='audio')
+        upstream = audio_download_upstream(pool_size=workers)
+        start = time.perf_counter()
+        try:
+            rows = iter_dataset_rows(server_url=server.url)
+            stats = populate_chromadb(
+                rows, HashEmbedder(), collection,
+                output_dir=os.path.join(work_dir, 'audio'),
+                max_workers=workers, batch_size=batch_size, upstream=upstream
+            )
+        finally:
+            upstream.close()
+        elapsed = time.perf_counter() - start
+        return {
+            'rows': collection.count(),
+            'batch_size': batch_size,
+            'workers': workers,
+            'seconds': elapsed,
+            'rows_per_second': collection.count() / elapsed,
+            'stages': {name: stage.rows_per_second for name, stage in stats.items()}
+        }
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def bench_upstream_faults(num_rows=300, failure_rate=0.2, stall_rate=0.02, workers=8, read_timeout=0.5):
+    """
+    Ingestion through the upstream clients while the fake servers misbehave.
+
+    'flaky' injects 503s and stalled responses into both the rows and audio
+    endpoints: retries should absorb them. 'down' points every audio URL at a
+    closed port: the circuit breaker should open and fail the remaining
+    downloads fast instead of retrying each one.
+
+    :return: List of result dictionaries per scenario
+    """
+    from .download import iter_dataset_rows, populate_chromadb
+    from .upstream import UPSTREAM_REJECTED, UPSTREAM_RETRIES, Upstream
+
+    scenarios = {
+        'flaky': {'failure_rate': failure_rate, 'stall_rate': stall_rate},
+        'down': {'audio_url': f'http://127.0.0.1:{_unused_port()}'},
+    }
+    results = []
+    for name, faults in scenarios.items():
+        with FakeDatasetServer(num_rows, 4096, stall_seconds=read_timeout * 4, **faults) as server, \
+                tempfile.TemporaryDirectory() as work_dir:
+            collection = chromadb.PersistentClient(path=os.path.join(work_dir, 'db')).get_or_create_collection(name='audio')
+            # Short timeouts and backoff so the run takes seconds, not minutes
+            settings = {'connect_timeout': read_timeout, 'read_timeout': read_timeout, 'backoff': 0.05,
+                        'max_backoff': 0.5, 'reset_timeout': 5.0}
+            rows_upstream = Upstream(f'bench-{name}-rows', pool_size=2, max_retries=5, **settings)
+            audio_upstream = Upstream(f'bench-{name}-audio', pool_size=workers, max_retries=3, **settings)
+            start = time.perf_counter()
+            try:
+                populate_chromadb(
+                    iter_dataset_rows(server_url=server.url, upstream=rows_upstream), HashEmbedder(), collection,
+                    output_dir=os.path.join(work_dir, 'audio'), max_workers=workers, upstream=audio_upstream
+                )
+            finally:
+                rows_upstream.close()
+                audio_upstream.close()
+            results.append({
+                'scenario': name,
+                'rows': num_rows,
+                'downloaded': len([f for f in os.listdir(os.path.join(work_dir, 'audio')) if f.endswith('.mp3')]),
+                'seconds': time.perf_counter() - start,
+                'rows_retries': UPSTREAM_RETRIES.value(rows_upstream.name, 'rows'),
+                'audio_retries': UPSTREAM_RETRIES.value(audio_upstream.name, 'download'),
+                'audio_rejected': UPSTREAM_REJECTED.value(audio_upstream.name, 'download'),
+                'audio_circuit': audio_upstream.breaker.state
+            })
+    return results
+
+def _http_worker(base_url, make_request, n_requests, seed):
+    """
+    Issue requests over one keep-alive connection.
+
+    :param make_request: Callable taking a random.Random and returning (method, path, body, headers)
+    :return: Tuple of (bytes received, per-request latencies, error count)
+    """
+    parts = urlsplit(base_url)
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    received = 0
+    latencies = []
+    errors = 0
+    for _ in range(n_requests):
+        method, path, body, headers = make_request(rng)
+        start = time.perf_counter()
+        try:
+            connection.request(method, f'{parts.path}{path}', body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+            if response.status not in (200, 206):
+                errors += 1
+            received += len(payload)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    return received, latencies, errors
+
+def _run_load(base_url, make_request, concurrency, requests_per_client):
+    """
+    Run _http_worker at each concurrency level and summarize throughput.
+    """
+    results = []
+    for clients in concurrency:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            outcomes = list(executor.map(
+                lambda seed: _http_worker(base_url, make_request, requests_per_client, seed),
+                range(clients)
+            ))
+        elapsed = time.perf_counter() - start
+        received = sum(outcome[0] for outcome in outcomes)
+        latencies = [latency for outcome in outcomes for latency in outcome[1]]
+        results.append({
+            'clients': clients,
+            'requests': len(latencies),
+            'errors': sum(outcome[2] for outcome in outcomes),
+            'requests_per_second': len(latencies) / elapsed,
+            'megabytes_per_second': received / elapsed / 1e6,
+            **_percentiles(latencies)
+        })
+    return results
+
+def _audio_request(filenames, range_fraction):
+    def make_request(rng):
+        headers = {}
+        if rng.random() < range_fraction:
+            # Emulate a player seeking into the middle of the track
+            headers['Range'] = f'bytes={rng.randrange(0, 512 * 1024)}-'
+        return 'GET', f'/api/audio/{rng.choice(filenames)}', None, headers
+    return make_request
+
+def _music_request(n_prompts):
+    def make_request(rng):
+        body = json.dumps({'prompt': f'benchmark prompt {rng.randrange(n_prompts)}'})
+        return 'POST', '/api/generate-music', body, {'Content-Type': 'application/json'}
+    return make_request
+
+def bench_audio_streaming(base_url, filenames, concurrency=(1, 8, 32), requests_per_client=20, range_fraction=0.5):
+    """
+    Measure /api/audio throughput against a running server.
+
+    :param base_url: Server root, e.g. http://127.0.0.1:8000
+    :param filenames: Audio file names to request
+    :param concurrency: Numbers of concurrent clients to test
+    :param requests_per_client: Requests issued by each client
+    :param range_fraction: Share of requests that ask for a byte range
+    :return: List of result dictionaries, one per concurrency level
+    """
+    return _run_load(base_url, _audio_request(filenames, range_fraction), concurrency, requests_per_client)
+
+def bench_endpoints(num_tracks=2000, audio_files=32, audio_bytes=1024 * 1024, concurrency=(1, 8, 32),
+                    requests_per_client=20, n_prompts=500):
+    """
+    In-process server load test of /api/audio and /api/generate-music.
+
+    The app runs under uvicorn with a synthetic collection, synthetic audio
+    files and the hash embedder, so only our serving path is measured.
+
+    :param n_prompts: Distinct prompts sent to /api/generate-music; repeats hit the result cache
+    :return: Dictionary of per-endpoint result lists
+    """
+    import uvicorn
+    from . import main as server
+    from .audio_store import AudioLibrary
+    from .lazy import LazyComponent
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, 'db')
+        audio_dir = os.path.join(work_dir, 'audio')
+        os.makedirs(audio_dir)
+        build_synthetic_collection(db_path, num_tracks, audio_dir=audio_dir)
+        filenames = [f'track-{i}.mp3' for i in range(audio_files)]
+        for filename in filenames:
+            with open(os.path.join(audio_dir, filename), 'wb') as f:
+                f.write(os.urandom(audio_bytes))
+
+        server.audio_query_manager = LazyComponent("audio_query_manager", lambda: AudioQueryManager(
+            db_path=db_path, embedding_model=HashEmbedder(),
+            search_backend=os.getenv("SEARCH_BACKEND", "chroma")
+        ))
+        server.audio_library = AudioLibrary(audio_dir)
+        server.audio_query_manager.get()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', 0))
+        base_url = f'http://127.0.0.1:{sock.getsockname()[1]}'
+        uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, log_level='warning', access_log=False))
+        thread = threading.Thread(target=uvicorn_server.run, kwargs={'sockets': [sock]}, daemon=True)
+        thread.start()
+        try:
+            while not uvicorn_server.started:
+                time.sleep(0.01)
+            return {
+                'audio': _run_load(base_url, _audio_request(filenames, 0.5), concurrency, requests_per_client),
+                'generate_music': _run_load(base_url, _music_request(n_prompts), concurrency, requests_per_client)
+            }
+        finally:
+            uvicorn_server.should_exit = True
+            thread.join()
+            sock.close()
+
+def _prompt_batch(batch_size, rng):
+    """Catalog-style prompts of mixed length, built from the calibration texts"""
+    texts = CALIBRATION_TEXTS
+    return [
+        ', '.join(texts[j] for j in rng.choice(len(texts), rng.integers(1, 4), replace=False))
+        for _ in range(batch_size)
+    ]
+
+def bench_embeddings(backends=BACKENDS, batch_sizes=(1, 8, 64), threads=(None,), repeats=20,
+                     model_name=EMBEDDING_MODEL_NAME):
+    """
+    Encode latency of the embedding backends, and how far each drifts from the reference.
+
+    Needs the model files (downloaded from the hub on first use). Backends
+    that cannot be loaded here are reported with their error.
+
+    :param backends: Names accepted by embeddings.load_embedding_model
+    :param batch_sizes: Texts per encode call
+    :param threads: Thread counts to try (None keeps each backend's default)
+    :param repeats: Timed encode calls per batch size
+    :return: List of result dictionaries, one per (backend, threads, batch size)
+    """
+    results = []
+    reference = None
+    for backend in backends:
+        for thread_count in threads:
+            try:
+                model = load_embedding_model(backend, model_name, threads=thread_count, verify=False)
+            except Exception as e:
+                results.append({'backend': backend, 'threads': thread_count, 'error': str(e)})
+                continue
+            if reference is None:
+                reference = model
+            error = embedding_error(model, reference)
+            rng = np.random.default_rng(0)
+            for batch_size in batch_sizes:
+                batches = [_prompt_batch(batch_size, rng) for _ in range(repeats + 2)]
+                # Warm-up calls are not timed
+                _time_calls(lambda batch: model.encode(batch, batch_size=batch_size), batches[:2])
+                samples = _time_calls(lambda batch: model.encode(batch, batch_size=batch_size), batches[2:])
+                results.append({
+                    'backend': backend,
+                    'threads': model_threads(model),
+                    'batch_size': batch_size,
+                    'max_error': error,
+                    'texts_per_second': batch_size * len(samples) / sum(samples),
+                    **_percentiles(samples)
+                })
+    return results
+
+def _environment():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'chromadb': chromadb.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lofi search and serving paths.")
+    parser.add_argument("--output", default=None, help="Also write the JSON results to this file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search_parser = subparsers.add_parser("search", help="Compare search backends")
+    search_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000], help="Collection sizes")
+    search_parser.add_argument("--queries", type=int, default=200, help="Queries per measurement")
+    search_parser.add_argument("--n-results", type=int, default=5, help="Top-k per query")
+
+    ann_parser = subparsers.add_parser("ann", help="IVF recall vs latency against exact search")
+    ann_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Catalog sizes")
+    ann_parser.add_argument("--queries", type=int, default=200, help="Queries per measurement")
+    ann_parser.add_argument("--n-results", type=int, default=10, help="k for recall@k")
+    ann_parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="n_probe values")
+    ann_parser.add_argument("--lists", type=int, default=None, help="Number of inverted lists")
+
+    semantic_parser = subparsers.add_parser("semantic", help="semantic_search latency with a stubbed embedder")
+    semantic_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000], help="Collection sizes")
+    semantic_parser.add_argument("--queries", type=int, default=200, help="Queries per measurement")
+
+    contains_parser = subparsers.add_parser("contains", help="$contains filter cost, indexed vs scanned")
+    contains_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000], help="Collection sizes")
+    contains_parser.add_argument("--queries", type=int, default=100, help="Queries per measurement")
+
+    ingest_parser = subparsers.add_parser("ingest", help="Ingestion rows/s from a fake dataset server")
+    ingest_parser.add_argument("--rows", type=int, default=1000, help="Rows served")
+    ingest_parser.add_argument("--batch-size", type=int, default=64, help="Rows embedded and written per batch")
+    ingest_parser.add_argument("--workers", type=int, default=8, help="Concurrent downloads")
+
+    faults_parser = subparsers.add_parser("faults", help="Ingestion against flaky and unreachable fake upstreams")
+    faults_parser.add_argument("--rows", type=int, default=300, help="Rows served")
+    faults_parser.add_argument("--failure-rate", type=float, default=0.2, help="Share of requests answered with 503")
+    faults_parser.add_argument("--stall-rate", type=float, default=0.02, help="Share of requests that hang")
+    faults_parser.add_argument("--workers", type=int, default=8, help="Concurrent downloads")
+
+    endpoints_parser = subparsers.add_parser("endpoints", help="Load test /api/audio and /api/generate-music in-process")
+    endpoints_parser.add_argument("--tracks", type=int, default=2000, help="Synthetic collection size")
+    endpoints_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent clients")
+    endpoints_parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+
+    embed_parser = subparsers.add_parser("embed", help="Encode latency per embedding backend (needs the model files)")
+    embed_parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    embed_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 64], help="Texts per encode call")
+    embed_parser.add_argument("--threads", type=int, nargs="+", default=[None], help="Inference thread counts")
+    embed_parser.add_argument("--repeats", type=int, default=20, help="Timed calls per batch size")
+
+    subparsers.add_parser("all", help="Run the offline suite with small defaults")
+
+    audio_parser = subparsers.add_parser("audio", help="Load test /api/audio on a running server")
+    audio_parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server root URL")
+    audio_parser.add_argument("--audio-dir", default="downloaded_audio", help="Directory to pick file names from")
+    audio_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent clients")
+    audio_parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+    audio_parser.add_argument("--range-fraction", type=float, default=0.5, help="Share of ranged requests")
+    args = parser.parse_args()
+
+    if args.command == "search":
+        results = bench_search_backends(args.sizes, args.queries, args.n_results)
+    elif args.command == "ann":
+        results = bench_ann(args.sizes, args.queries, args.n_results, args.probes, args.lists)
+    elif args.command == "semantic":
+        results = bench_semantic_search(args.sizes, args.queries)
+    elif args.command == "contains":
+        results = bench_contains_filter(args.sizes, args.queries)
+    elif args.command == "ingest":
+        results = bench_ingestion(args.rows, args.batch_size, args.workers)
+    elif args.command == "faults":
+        results = bench_upstream_faults(args.rows, args.failure_rate, args.stall_rate, args.workers)
+    elif args.command == "endpoints":
+        results = bench_endpoints(args.tracks, concurrency=args.concurrency, requests_per_client=args.requests)
+    elif args.command == "embed":
+        results = bench_embeddings(args.backends, args.batch_sizes, args.threads, args.repeats)
+    elif args.command == "all":
+        results = {
+            'search': bench_search_backends(sizes=(1000, 10000)),
+            'ann': bench_ann(sizes=(10000, 50000)),
+            'semantic': bench_semantic_search(sizes=(1000, 10000)),
+            'contains': bench_contains_filter(sizes=(1000, 10000)),
+            'ingest': bench_ingestion(),
+            'endpoints': bench_endpoints()
+        }
+    else:
+        filenames = [name for name in os.listdir(args.audio_dir) if name.endswith('.mp3')]
+        results = bench_audio_streaming(args.url, filenames, args.concurrency, args.requests, args.range_fraction)
+
+    report = {'command': args.command, 'environment': _environment(), 'results': results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
+
+# Usage (from the lofi/ directory):
+# python -m backend.benchmark search --sizes 1000 10000
+# python -m backend.benchmark --output bench.json all
+# python -m backend.benchmark faults --failure-rate 0.3
+# python -m backend.benchmark embed --backends torch onnx-int8 --threads 1 2 4
+# python -m backend.benchmark audio --url http://127.0.0.1:8000 --concurrency 1 16 64
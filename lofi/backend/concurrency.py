@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import record_stage
+
+class PoolSaturatedError(Exception):
+    """
+    Raised when a bounded pool has no free worker or queue slot.
+    """
+
+class BoundedExecutor:
+    def __init__(self, name, max_workers, max_queue):
+        """
+        Thread pool that rejects work instead of queueing it without limit.
+
+        :param name: Pool name, used for thread names and stats
+        :param max_workers: Number of worker threads
+        :param max_queue: Number of tasks allowed to wait for a free worker
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'queued': 0, 'running': 0, 'completed': 0, 'rejected': 0, 'cancelled': 0})
+
+    def submit(self, endpoint, fn, *args, **kwargs):
+        """
+        Schedule fn on the pool on behalf of an endpoint.
+
+        :param endpoint: Label used for per-endpoint queue-depth stats
+        :return: concurrent.futures.Future for the result
+        :raises PoolSaturatedError: If all workers and queue slots are taken
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats[endpoint]['rejected'] += 1
+            raise PoolSaturatedError(f"{self.name} pool is at capacity")
+
+        with self._lock:
+            self._stats[endpoint]['queued'] += 1
+        submitted = time.perf_counter()
+
+        def run():
+            record_stage(f'{self.name}_queue', time.perf_counter() - submitted)
+            with self._lock:
+                self._stats[endpoint]['queued'] -= 1
+                self._stats[endpoint]['running'] += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._stats[endpoint]['running'] -= 1
+                    self._stats[endpoint]['completed'] += 1
+                self._slots.release()
+
+        def release_if_cancelled(future):
+            # A task cancelled while still queued never reaches run(), so its slot is given back here
+            if future.cancelled():
+                with self._lock:
+                    self._stats[endpoint]['queued'] -= 1
+                    self._stats[endpoint]['cancelled'] += 1
+                self._slots.release()
+
+        try:
+            # Run in a copy of the caller's context so request tracing follows the task
+            future = self._executor.submit(contextvars.copy_context().run, run)
+        except Exception:
+            with self._lock:
+                self._stats[endpoint]['queued'] -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(release_if_cancelled)
+        return future
+
+    async def run(self, endpoint, fn, *args, **kwargs):
+        """
+        Await fn on the pool without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(endpoint, fn, *args, **kwargs))
+
+    def stats(self):
+        """
+        Snapshot of pool limits and per-endpoint queue depth.
+        """
+        with self._lock:
+            endpoints = {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'endpoints': endpoints
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -1,42 +1,127 @@
 import os
+import json
+import argparse
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
 import chromadb
-from sentence_transformers import SentenceTransformer
-import uuid
 
-def download_audio_file(audio_url, output_dir='downloaded_audio'):
+from .embeddings import EMBEDDING_MODEL_NAME
+from .shared import bump_catalog_version
+from .upstream import CircuitOpenError, Upstream
+
+DEFAULT_AUDIO_DIR = 'downloaded_audio'
+MANIFEST_FILENAME = 'manifest.json'
+CATALOG_MANIFEST_FILENAME = 'catalog_manifest.json'
+DEFAULT_BATCH_SIZE = 64
+DATASETS_SERVER_URL = os.getenv("DATASETS_SERVER_URL", "https://datasets-server.huggingface.co")
+# The datasets-server /rows endpoint returns at most 100 rows per request
+MAX_PAGE_SIZE = 100
+
+# One pooled client per upstream: explicit timeouts, jittered retries and a circuit breaker each
+datasets_upstream = Upstream(
+    'datasets-server', pool_size=4, read_timeout=60.0, max_retries=5, backoff=1.0
+)
+
+def audio_download_upstream(pool_size=16):
+    """
+    Client for audio file downloads; pool_size also bounds the downloads in flight.
+    """
+    return Upstream('audio-download', pool_size=pool_size, read_timeout=60.0, max_retries=2, backoff=1.0)
+
+audio_upstream = audio_download_upstream()
+
+_manifest_lock = threading.Lock()
+
+def load_manifest(output_dir=DEFAULT_AUDIO_DIR):
+    """
+    Load the row id -> audio file manifest for a download directory.
+    
+    :param output_dir: Directory holding downloaded audio files
+    :return: Dictionary mapping row ids to manifest entries
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(manifest, output_dir=DEFAULT_AUDIO_DIR):
+    """
+    Atomically write the manifest so an interrupted run never leaves it half-written.
+    
+    :param manifest: Dictionary mapping row ids to manifest entries
+    :param output_dir: Directory holding downloaded audio files
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with _manifest_lock:
+        fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, os.path.join(output_dir, MANIFEST_FILENAME))
+
+def _download_to_file(audio_url, output_dir, upstream):
+    """
+    One download attempt: stream the file to disk while hashing it.
+    
+    :return: Absolute path of the content-addressed file
+    """
+    tmp_path = None
+    try:
+        with upstream.send('GET', audio_url, stream=True) as response:
+            file_extension = os.path.splitext(audio_url.split('?')[0])[-1] or '.mp3'
+            
+            # Stream to a temporary file while hashing the content
+            digest = hashlib.sha256()
+            fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    digest.update(chunk)
+                    f.write(chunk)
+        
+        filename = os.path.join(output_dir, f'{digest.hexdigest()}{file_extension}')
+        if os.path.exists(filename):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, filename)
+        tmp_path = None
+        return os.path.abspath(filename)
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def download_audio_file(audio_url, output_dir=DEFAULT_AUDIO_DIR, upstream=None):
     """
     Download an audio file and return its local path.
     
+    Files are content-addressed: the name is the SHA-256 of the bytes, so the
+    same track downloaded twice ends up as a single file on disk. A download
+    that fails part-way, including a stalled body, is retried from the start.
+    
     :param audio_url: URL of the audio file
     :param output_dir: Directory to save downloaded audio files
+    :param upstream: Upstream client to download through (defaults to audio_upstream)
     :return: Local file path or None if download fails
     """
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
+    upstream = upstream or audio_upstream
     
     try:
-        # Send a GET request to download the audio file
-        response = requests.get(audio_url, stream=True)
-        response.raise_for_status()
-        
-        # Generate a unique filename
-        file_extension = os.path.splitext(audio_url.split('?')[0])[-1] or '.mp3'
-        filename = os.path.join(output_dir, f'{uuid.uuid4()}{file_extension}')
-        
-        # Write the audio file
-        with open(filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
+        # Retry around the whole transfer, not just the response headers
+        filename = upstream.call('download', _download_to_file, audio_url, output_dir, upstream)
         print(f"Successfully downloaded: {filename}")
-        return os.path.abspath(filename)  # Return absolute path
+        return filename
     
     except Exception as e:
         print(f"Error downloading audio from {audio_url}: {e}")
         return None
 
-def fetch_huggingface_dataset(dataset='vikhyatk/lofi', split='train', offset=305, length=100):
+def fetch_huggingface_dataset(dataset='vikhyatk/lofi', split='train', offset=305, length=100, upstream=None):
     """
     Fetch dataset rows from Hugging Face Datasets Server.
     
@@ -44,9 +129,10 @@ def fetch_huggingface_dataset(dataset='vikhyatk/lofi', split='train', offset=305
     :param split: Dataset split to fetch
     :param offset: Starting index
     :param length: Number of rows to fetch
+    :param upstream: Upstream client to fetch through (defaults to datasets_upstream)
     :return: JSON response containing dataset rows
     """
-    url = "https://datasets-server.huggingface.co/rows"
+    url = f"{DATASETS_SERVER_URL}/rows"
     params = {
         "dataset": dataset,
         "config": "default",
@@ -55,69 +141,529 @@ def fetch_huggingface_dataset(dataset='vikhyatk/lofi', split='train', offset=305
         "length": length
     }
 
-    response = requests.get(url, params=params)
-
-    if response.status_code == 200:
+    try:
+        response = (upstream or datasets_upstream).get(url, 'rows', params=params)
         return response.json()
-    else:
-        print(f"Error: {response.status_code}, {response.text}")
+    except (requests.RequestException, CircuitOpenError) as e:
+        print(f"Error: {e}")
         return None
 
-def populate_chromadb(dataset_data, embedding_model, collection):
+def _load_checkpoint(checkpoint_path, dataset, split):
+    """
+    Read the saved row offset for a dataset split.
+    
+    :return: Offset to resume from, 0 when there is no matching checkpoint
+    """
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return 0
+    if checkpoint.get("dataset") != dataset or checkpoint.get("split") != split:
+        return 0
+    return checkpoint.get("offset", 0)
+
+def _save_checkpoint(checkpoint_path, dataset, split, offset):
+    """
+    Atomically record the row offset to resume a dataset split from.
+    """
+    directory = os.path.dirname(os.path.abspath(checkpoint_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({"dataset": dataset, "split": split, "offset": offset}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+class DatasetCheckpoint:
+    """
+    Resume cursor for a dataset split that only moves past rows known to be stored.
+    
+    iter_dataset_rows records the offset of every row it yields; the pipeline
+    reports rows back with mark_done once they are written (or skipped as
+    already stored). The saved offset is the end of the contiguous run of done
+    rows, so rows still in flight, buffered or in a failed batch are read again
+    on resume.
+    """
+    def __init__(self, path, dataset='vikhyatk/lofi', split='train'):
+        self.path = path
+        self.dataset = dataset
+        self.split = split
+        self.offset = _load_checkpoint(path, dataset, split)
+        # Row id -> offsets handed out and not yet done (a list in case ids repeat)
+        self._pending = {}
+        # Done offsets past self.offset, waiting for the gap before them to close
+        self._done = set()
+        self._lock = threading.Lock()
+    
+    def track(self, row, offset):
+        with self._lock:
+            self._pending.setdefault(row["id"], []).append(offset)
+    
+    def mark_done(self, rows):
+        """
+        Record rows as stored and save the cursor if it moved.
+        """
+        with self._lock:
+            for row in rows:
+                offsets = self._pending.get(row["id"])
+                if not offsets:
+                    continue
+                self._done.add(offsets.pop(0))
+                if not offsets:
+                    del self._pending[row["id"]]
+            start = self.offset
+            while self.offset in self._done:
+                self._done.remove(self.offset)
+                self.offset += 1
+            if self.offset != start:
+                _save_checkpoint(self.path, self.dataset, self.split, self.offset)
+
+def iter_dataset_rows(dataset='vikhyatk/lofi', split='train', page_size=MAX_PAGE_SIZE,
+                      offset=None, checkpoint=None, upstream=None,
+                      max_retries=None, server_url=None):
+    """
+    Stream every row of a dataset split from the datasets-server /rows endpoint.
+    
+    Pages are requested one at a time and yielded row by row, so only a single
+    page is ever held in memory. When a DatasetCheckpoint is given, reading
+    starts from its cursor and every yielded row is tracked by it; the cursor
+    only advances as the consumer marks rows done.
+    
+    :param dataset: Name of the dataset
+    :param split: Dataset split to fetch
+    :param page_size: Number of rows per request (at most 100)
+    :param offset: Starting index; defaults to the checkpoint, or 0
+    :param checkpoint: Optional DatasetCheckpoint for the same dataset and split
+    :param upstream: Upstream client to fetch through (defaults to datasets_upstream)
+    :param max_retries: Retries per page before giving up (defaults to the upstream's)
+    :param server_url: Datasets server root; defaults to DATASETS_SERVER_URL
+    :return: Generator of row dictionaries
+    """
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    if offset is None:
+        offset = checkpoint.offset if checkpoint else 0
+    
+    url = f"{server_url or DATASETS_SERVER_URL}/rows"
+    upstream = upstream or datasets_upstream
+    total = None
+    
+    while total is None or offset < total:
+        params = {
+            "dataset": dataset,
+            "config": "default",
+            "split": split,
+            "offset": offset,
+            "length": page_size
+        }
+        page = upstream.get(url, 'rows', params=params, max_retries=max_retries).json()
+        total = page.get("num_rows_total", 0)
+        rows = page.get("rows", [])
+        if not rows:
+            break
+        
+        for i, row_data in enumerate(rows):
+            if checkpoint:
+                checkpoint.track(row_data["row"], offset + i)
+            yield row_data["row"]
+        
+        offset += len(rows)
+
+def _existing_ids(collection, row_ids):
+    """
+    Return the subset of row ids that are already stored in the collection.
+    
+    :param collection: ChromaDB collection
+    :param row_ids: Candidate row ids
+    :return: Set of ids already present
+    """
+    if not row_ids:
+        return set()
+    return set(collection.get(ids=list(row_ids), include=[])['ids'])
+
+def _skip_stored_rows(rows, collection, counters, chunk_size=MAX_PAGE_SIZE, on_skipped=None):
+    """
+    Lazily drop rows whose ids are already in the collection.
+    
+    Ids are looked up one chunk at a time so the row stream is never materialized.
+    
+    :param rows: Iterable of dataset rows
+    :param collection: ChromaDB collection
+    :param counters: Dictionary whose "skipped" entry is incremented per dropped row
+    :param chunk_size: Number of rows checked per collection lookup
+    :param on_skipped: Optional callback receiving the dropped rows of every chunk
+    """
+    chunk = []
+    
+    def drain(chunk):
+        already_stored = _existing_ids(collection, [row["id"] for row in chunk])
+        counters["skipped"] += len(already_stored)
+        if on_skipped and already_stored:
+            on_skipped([row for row in chunk if row["id"] in already_stored])
+        return [row for row in chunk if row["id"] not in already_stored]
+    
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from drain(chunk)
+            chunk = []
+    if chunk:
+        yield from drain(chunk)
+
+def _local_audio_for(row_id, manifest, output_dir):
+    """
+    Look up an already-downloaded audio file for a row.
+    
+    :return: Absolute path if the manifest entry points at an existing file, else None
+    """
+    entry = manifest.get(row_id)
+    if not entry:
+        return None
+    path = os.path.join(output_dir, entry['file'])
+    return os.path.abspath(path) if os.path.exists(path) else None
+
+def _fetch_row_audio(row, manifest, output_dir, upstream):
+    """
+    Resolve the local audio path for a row, downloading only when needed.
+    
+    :return: Tuple of (row, local path or None)
+    """
+    local_path = _local_audio_for(row["id"], manifest, output_dir)
+    if local_path:
+        return row, local_path
+    
+    audio_url = row["audio"][0]["src"] if row["audio"] else None
+    if not audio_url:
+        return row, None
+    
+    local_path = download_audio_file(audio_url, output_dir=output_dir, upstream=upstream)
+    if local_path:
+        filename = os.path.basename(local_path)
+        # Under the lock save_manifest holds, so a concurrent save never sees the dict change size
+        with _manifest_lock:
+            manifest[row["id"]] = {
+                "file": filename,
+                "sha256": os.path.splitext(filename)[0]
+            }
+    return row, local_path
+
+def _bounded_map(executor, fn, items, max_in_flight):
+    """
+    Map fn over items on an executor, keeping at most max_in_flight tasks queued.
+    
+    Results are yielded in completion order so slow downloads do not hold back
+    the rest of the pipeline.
+    """
+    in_flight = set()
+    for item in items:
+        in_flight.add(executor.submit(fn, item))
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while in_flight:
+        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+class StageStats:
+    """
+    Row and wall-time counters for one stage of the ingestion pipeline.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.seconds = 0.0
+    
+    def record(self, rows, seconds):
+        self.rows += rows
+        self.seconds += seconds
+    
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+    
+    def __str__(self):
+        return f"{self.name}: {self.rows} rows in {self.seconds:.2f}s ({self.rows_per_second:.1f} rows/s)"
+
+def _write_batch(batch, embedding_model, collection, stats, on_written=None):
+    """
+    Embed a batch of rows with one encode call and store them with one upsert.
+    
+    :param batch: List of (row, local audio path) tuples
+    :param embedding_model: Sentence Transformer model for generating embeddings
+    :param collection: ChromaDB collection to populate
+    :param stats: Dictionary of StageStats keyed by stage name
+    :param on_written: Optional callback receiving the rows once the upsert succeeded
+    """
+    ids = []
+    prompts = []
+    metadatas = []
+    for row, local_audio_path in batch:
+        # Prepare metadata
+        metadata = {
+            "prompt": row["prompt"],
+            "audio_url": row["audio"][0]["src"] if row["audio"] else None
+        }
+        if local_audio_path:
+            metadata["local_audio_path"] = local_audio_path
+        ids.append(row["id"])
+        prompts.append(row["prompt"])
+        metadatas.append(metadata)
+    
+    # Generate embeddings for the whole batch at once
+    start = time.perf_counter()
+    embeddings = embedding_model.encode(prompts, batch_size=len(prompts))
+    stats["embed"].record(len(batch), time.perf_counter() - start)
+    
+    # Write the batch to ChromaDB in a single call
+    start = time.perf_counter()
+    collection.upsert(
+        ids=ids,
+        embeddings=embeddings.tolist(),
+        metadatas=metadatas
+    )
+    stats["write"].record(len(batch), time.perf_counter() - start)
+    if on_written:
+        on_written([row for row, _ in batch])
+
+def populate_chromadb(dataset_data, embedding_model, collection,
+                      output_dir=DEFAULT_AUDIO_DIR, max_workers=8,
+                      batch_size=DEFAULT_BATCH_SIZE, skip_stored=True, on_batch_written=None,
+                      on_rows_skipped=None, upstream=None, db_path=None):
     """
     Populate ChromaDB with dataset rows, downloading audio files.
     
-    :param dataset_data: JSON data from Hugging Face Datasets Server
+    Downloads run on a bounded thread pool sharing one pooled upstream client.
+    Finished rows are gathered into batches that are embedded with a single
+    encode call and written with a single upsert.
+    The run is resumable: rows already in the collection are skipped, and rows
+    whose audio is recorded in the download manifest are not fetched again.
+    Rows whose audio could not be downloaded are not written, so the next run
+    retries them; the manifest is saved after every batch. With db_path, a
+    new catalog version is published once rows were written, so running
+    servers reload.
+    
+    Rows are consumed lazily, so dataset_data can be the row generator from
+    iter_dataset_rows and memory use stays flat regardless of the split size.
+    
+    :param dataset_data: JSON data from Hugging Face Datasets Server, or an iterable of rows
     :param embedding_model: Sentence Transformer model for generating embeddings
     :param collection: ChromaDB collection to populate
+    :param output_dir: Directory to save downloaded audio files
+    :param max_workers: Number of concurrent downloads
+    :param batch_size: Number of rows embedded and written per batch
+    :param skip_stored: Drop rows whose ids are already in the collection; disable to overwrite them
+    :param on_batch_written: Optional callback receiving the rows of every successfully written batch
+    :param on_rows_skipped: Optional callback receiving rows dropped as already stored
+    :param upstream: Upstream client for the downloads (defaults to audio_upstream)
+    :param db_path: ChromaDB directory whose catalog version file is bumped after the run
+    :return: Dictionary of StageStats for the fetch, embed and write stages
     """
     # Tracks rows processed
     processed_rows = 0
     failed_rows = 0
+    stats = {name: StageStats(name) for name in ("fetch", "embed", "write")}
     
-    for row_data in dataset_data["rows"]:
-        row = row_data["row"]
-        row_id = row["id"]
-        
-        # Get audio URL and prompt
-        audio_url = row["audio"][0]["src"] if row["audio"] else None
-        prompt_text = row["prompt"]
-        
+    counters = {"skipped": 0}
+    failed_downloads = 0
+    
+    if isinstance(dataset_data, dict):
+        rows = (row_data["row"] for row_data in dataset_data["rows"])
+    else:
+        rows = dataset_data
+    pending = _skip_stored_rows(rows, collection, counters, on_skipped=on_rows_skipped) if skip_stored else rows
+    
+    manifest = load_manifest(output_dir)
+    upstream = upstream or audio_upstream
+    
+    def fetch(row):
+        return _fetch_row_audio(row, manifest, output_dir, upstream)
+    
+    def flush(batch):
+        nonlocal processed_rows, failed_rows, flush_seconds
+        start = time.perf_counter()
         try:
-            # Generate embedding
-            embedding = embedding_model.encode(prompt_text).tolist()
-            
-            # Prepare metadata
-            metadata = {
-                "prompt": prompt_text,
-                "audio_url": audio_url
-            }
-            
-            # Try to download audio file and add local path
-            if audio_url:
-                local_audio_path = download_audio_file(audio_url)
-                if local_audio_path:
-                    metadata["local_audio_path"] = local_audio_path
-            
-            # Add data to ChromaDB
-            collection.add(
-                ids=[row_id],
-                embeddings=[embedding],
-                metadatas=[metadata]
-            )
-            
-            processed_rows += 1
-        
+            _write_batch(batch, embedding_model, collection, stats, on_batch_written)
+            processed_rows += len(batch)
         except Exception as e:
-            print(f"Error processing row {row_id}: {e}")
-            failed_rows += 1
+            print(f"Error processing batch starting at row {batch[0][0]['id']}: {e}")
+            failed_rows += len(batch)
+        # Keep the downloads made so far even if the process is killed later
+        save_manifest(manifest, output_dir)
+        flush_seconds += time.perf_counter() - start
+    
+    batch = []
+    fetch_start = time.perf_counter()
+    flush_seconds = 0.0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for fetched in _bounded_map(executor, fetch, pending, max_workers * 2):
+                # Fetch throughput is measured over the wall time downloads are in progress,
+                # minus the embed and write time of batches flushed on this thread
+                stats["fetch"].rows += 1
+                stats["fetch"].seconds = time.perf_counter() - fetch_start - flush_seconds
+                
+                row, local_path = fetched
+                if local_path is None and row["audio"]:
+                    # Stored without audio, the row would count as done and never be fetched again
+                    failed_downloads += 1
+                    continue
+                batch.append(fetched)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+        if batch:
+            flush(batch)
+    finally:
+        save_manifest(manifest, output_dir)
+        if db_path and processed_rows:
+            bump_catalog_version(db_path, collection=collection.name, rows=collection.count())
     
     print(f"Processed {processed_rows} rows successfully")
+    print(f"Skipped {counters['skipped']} rows already in the collection")
     print(f"Failed to process {failed_rows} rows")
+    print(f"Failed to download audio for {failed_downloads} rows (retried on the next run)")
+    for stage in stats.values():
+        print(stage)
+    return stats
+
+def _audio_source(row):
+    """
+    Stable identity of a row's audio: the URL without its signed, expiring query string.
+    """
+    audio_url = row["audio"][0]["src"] if row["audio"] else None
+    return audio_url.split('?')[0] if audio_url else None
+
+def row_content_hash(row):
+    """
+    SHA-256 over the fields that end up in the collection for a row.
+    """
+    digest = hashlib.sha256()
+    digest.update(row["prompt"].encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((_audio_source(row) or '').encode('utf-8'))
+    return digest.hexdigest()
+
+def load_catalog_manifest(db_path):
+    """
+    Load the id -> {hash, model, audio} manifest of the last catalog sync.
+    
+    :param db_path: ChromaDB directory the manifest belongs to
+    :return: Dictionary with "generation" and "rows" entries
+    """
+    try:
+        with open(os.path.join(db_path, CATALOG_MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"generation": 0, "rows": {}}
+
+def save_catalog_manifest(catalog, db_path):
+    """
+    Atomically write the catalog manifest.
+    """
+    os.makedirs(db_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=db_path, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(catalog, f, sort_keys=True)
+    os.replace(tmp_path, os.path.join(db_path, CATALOG_MANIFEST_FILENAME))
+
+def sync_catalog(rows, embedding_model, collection, db_path="./chroma_db",
+                 model_name=EMBEDDING_MODEL_NAME, output_dir=DEFAULT_AUDIO_DIR,
+                 max_workers=8, batch_size=DEFAULT_BATCH_SIZE, delete_chunk_size=1000, upstream=None):
+    """
+    Bring the collection in line with the upstream dataset, touching only what changed.
+    
+    Every upstream row is hashed and compared with the catalog manifest; rows
+    that are new, whose prompt or audio changed, or that were embedded with a
+    different model are re-embedded and upserted. Once the whole split has
+    been read, ids that are no longer upstream are deleted. The manifest only
+    records rows whose batch was written, so an interrupted sync resumes where
+    it failed, and deletions only happen after a complete pass.
+    
+    When anything changed, the catalog version file next to the database is
+    bumped so running servers swap in the new index.
+    
+    :param rows: Iterable of dataset rows, e.g. from iter_dataset_rows
+    :param embedding_model: Sentence Transformer model for generating embeddings
+    :param collection: ChromaDB collection to update
+    :param db_path: ChromaDB directory holding the catalog manifest and version file
+    :param model_name: Embedding model identifier recorded per row
+    :param output_dir: Directory to save downloaded audio files
+    :param max_workers: Number of concurrent downloads
+    :param batch_size: Number of rows embedded and written per batch
+    :param delete_chunk_size: Ids removed per delete call
+    :param upstream: Upstream client for the downloads (defaults to audio_upstream)
+    :return: Dictionary with upserted, unchanged, deleted and failed counts
+    """
+    catalog = load_catalog_manifest(db_path)
+    entries = catalog["rows"]
+    audio_manifest = load_manifest(output_dir)
+    seen = set()
+    pending_entries = {}
+    counters = {"upserted": 0, "unchanged": 0, "deleted": 0, "failed": 0}
+    
+    def changed_rows():
+        for row in rows:
+            seen.add(row["id"])
+            entry = {"hash": row_content_hash(row), "model": model_name, "audio": _audio_source(row)}
+            previous = entries.get(row["id"])
+            if previous == entry:
+                counters["unchanged"] += 1
+                continue
+            if previous and previous.get("audio") != entry["audio"]:
+                # Fetch the new audio instead of reusing the file downloaded for the old one
+                audio_manifest.pop(row["id"], None)
+            pending_entries[row["id"]] = entry
+            yield row
+    
+    def record(written):
+        for row in written:
+            entries[row["id"]] = pending_entries.pop(row["id"])
+        counters["upserted"] += len(written)
+    
+    save_manifest(audio_manifest, output_dir)
+    try:
+        populate_chromadb(
+            changed_rows(), embedding_model, collection,
+            output_dir=output_dir, max_workers=max_workers, batch_size=batch_size,
+            skip_stored=False, on_batch_written=record, upstream=upstream
+        )
+        counters["failed"] = len(pending_entries)
+        
+        # Rows stored by earlier full ingests have no manifest entry, so diff against the collection too
+        removed = sorted((set(entries) | set(collection.get(include=[])['ids'])) - seen)
+        for start in range(0, len(removed), delete_chunk_size):
+            chunk = removed[start:start + delete_chunk_size]
+            collection.delete(ids=chunk)
+            for row_id in chunk:
+                entries.pop(row_id, None)
+            counters["deleted"] += len(chunk)
+    finally:
+        if counters["upserted"] or counters["deleted"]:
+            catalog["generation"] = bump_catalog_version(
+                db_path, collection=collection.name, model=model_name, rows=len(entries)
+            )
+        save_catalog_manifest(catalog, db_path)
+    
+    print(f"Catalog sync: {counters['upserted']} upserted, {counters['unchanged']} unchanged, "
+          f"{counters['deleted']} deleted, {counters['failed']} failed")
+    return counters
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest the lofi dataset into ChromaDB.")
+    parser.add_argument("--dataset", default="vikhyatk/lofi", help="Hugging Face dataset name")
+    parser.add_argument("--split", default="train", help="Dataset split to ingest")
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_SIZE, help="Rows fetched per request")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent audio downloads")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows embedded and written per batch")
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.json", help="Cursor file used to resume")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first row")
+    parser.add_argument("--sync", action="store_true",
+                        help="Diff the whole split against the catalog manifest: upsert new or changed rows, delete removed ones")
+    parser.add_argument("--db-path", default="./chroma_db", help="ChromaDB directory")
+    args = parser.parse_args()
+    
     # Initialize ChromaDB client
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
+    chroma_client = chromadb.PersistentClient(path=args.db_path)
     
     # Create or get collection (clear existing data)
     # try:
@@ -127,16 +673,49 @@ def main():
     collection = chroma_client.get_or_create_collection(name="audio")
     
     # Load embedding model
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+    from .embeddings import get_embedding_model
+    embedding_model = get_embedding_model(EMBEDDING_MODEL_NAME)
     
-    # Fetch dataset
-    dataset_data = fetch_huggingface_dataset()
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
     
-    if dataset_data:
-        # Populate ChromaDB
-        populate_chromadb(dataset_data, embedding_model, collection)
-    else:
-        print("Failed to fetch dataset")
+    # A sync must see every row to find deletions, so it never resumes mid-split
+    checkpoint = None if args.sync else DatasetCheckpoint(args.checkpoint, args.dataset, args.split)
+    
+    # Size the download pool to the worker count so no download waits for a connection
+    upstream = audio_download_upstream(pool_size=max(args.workers, 1))
+    try:
+        # Stream the dataset page by page straight into the pipeline
+        rows = iter_dataset_rows(
+            dataset=args.dataset,
+            split=args.split,
+            page_size=args.page_size,
+            offset=0 if args.sync else None,
+            checkpoint=checkpoint
+        )
+        if args.sync:
+            sync_catalog(
+                rows, embedding_model, collection,
+                db_path=args.db_path,
+                max_workers=args.workers,
+                batch_size=args.batch_size,
+                upstream=upstream
+            )
+        else:
+            # The cursor follows the rows actually stored, never a failed batch
+            populate_chromadb(
+                rows, embedding_model, collection,
+                max_workers=args.workers,
+                batch_size=args.batch_size,
+                on_batch_written=checkpoint.mark_done,
+                on_rows_skipped=checkpoint.mark_done,
+                upstream=upstream,
+                db_path=args.db_path
+            )
+    except (requests.RequestException, CircuitOpenError) as e:
+        print(f"Failed to fetch dataset: {e}")
+    finally:
+        upstream.close()
 
 if __name__ == '__main__':
     main()
@@ -144,9 +723,18 @@ if __name__ == '__main__':
 # Dependencies:
 # pip install requests chromadb sentence-transformers
 
+# Usage (from the lofi/ directory; the backend modules import each other as a package,
+# so the script runs as a module rather than as python download.py):
+# python -m backend.download --workers 16
+# python -m backend.download --sync
+
 """
 Updated script to ensure:
 1. Audio files are downloaded
 2. Absolute paths are stored
 3. Collection is recreated to avoid conflicts
+4. Downloads run concurrently over pooled connections with timeouts, retries and a circuit breaker
+5. Re-runs skip rows already ingested; audio is stored by content hash
+6. The full split is streamed page by page from a checkpointed cursor
+7. --sync upserts only new or changed rows, deletes removed ones and bumps the catalog version
 """
\ No newline at end of file
@@ -0,0 +1,246 @@
+import logging
+import os
+import platform
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+MAX_SEQ_LENGTH = 256
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+# Largest accepted 1 - cosine(optimized, reference) over the calibration prompts
+DEFAULT_TOLERANCE = 0.02
+
+# Short prompts in the style of the catalog, used to check an optimized model against the reference
+CALIBRATION_TEXTS = (
+    "rainy night in a quiet cafe",
+    "chill lofi beats to study to",
+    "warm vinyl crackle with soft piano",
+    "sunset drive along the coast, mellow guitar",
+    "late night coding session, jazzy chords and slow drums",
+    "snow falling outside a cozy cabin",
+    "upbeat morning coffee groove",
+    "melancholic synth pads and tape hiss",
+    "lo-fi hip hop with a dusty boom bap beat and muted trumpet samples",
+    "calm",
+    "a long walk through the city after the rain, neon lights reflecting on wet streets",
+    "focus",
+)
+
+def model_repo(model_name):
+    """Hub repository of a sentence-transformers model name"""
+    return model_name if '/' in model_name else f"sentence-transformers/{model_name}"
+
+def default_threads():
+    """
+    Intra-op threads for one encode call.
+
+    Small models stop scaling after a few threads, and the request and
+    download pools need cores too.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(4, cpus))
+
+def _cpu_flags():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def quantized_onnx_file():
+    """
+    The int8 export in the model repository best suited to this CPU.
+    """
+    if platform.machine().lower() in ('arm64', 'aarch64'):
+        return 'onnx/model_qint8_arm64.onnx'
+    flags = _cpu_flags()
+    if 'avx512_vnni' in flags:
+        return 'onnx/model_qint8_avx512_vnni.onnx'
+    if 'avx512f' in flags:
+        return 'onnx/model_qint8_avx512.onnx'
+    return 'onnx/model_quint8_avx2.onnx'
+
+class OnnxEmbedder:
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, file_name='onnx/model.onnx', threads=None,
+                 max_seq_length=MAX_SEQ_LENGTH):
+        """
+        Sentence embeddings from an exported ONNX graph, without torch.
+
+        Mirrors the sentence-transformers pipeline of MiniLM-style models:
+        tokenize, run the transformer, mean-pool over the attention mask and
+        L2-normalize. Usable wherever a SentenceTransformer is.
+
+        :param model_name: Model name or hub repository holding tokenizer.json and the ONNX exports
+        :param file_name: Graph to run, e.g. onnx/model.onnx or one of the int8 exports
+        :param threads: Intra-op threads (defaults to default_threads())
+        :param max_seq_length: Tokens kept per text
+        """
+        import onnxruntime
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        repo = model_repo(model_name)
+        self.model_name = model_name
+        self.file_name = file_name
+        self.threads = threads or default_threads()
+
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(repo, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            hf_hub_download(repo, file_name), options, providers=['CPUExecutionProvider']
+        )
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+    def _run(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        inputs = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: value for name, value in inputs.items() if name in self._input_names})[0]
+        mask = inputs['attention_mask'][:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        # Batch texts of similar length together so little time goes to padding
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        batch_size = max(1, batch_size or len(texts))
+        batches = [order[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        outputs = [self._run([texts[i] for i in rows]) for rows in batches]
+        embeddings = np.zeros((len(texts), outputs[0].shape[1] if outputs else 0), dtype=np.float32)
+        for rows, output in zip(batches, outputs):
+            embeddings[rows] = output
+        return embeddings[0] if single else embeddings
+
+def _load_torch(model_name, threads=None):
+    from sentence_transformers import SentenceTransformer
+
+    # torch's thread pool is process-wide and shared with MusicGen, so it is only resized on request
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return SentenceTransformer(model_name)
+
+def model_threads(model):
+    """
+    Intra-op threads a loaded model encodes with.
+    """
+    threads = getattr(model, 'threads', None)
+    if threads is None:
+        import torch
+        threads = torch.get_num_threads()
+    return threads
+
+def embedding_error(candidate, reference, texts=CALIBRATION_TEXTS):
+    """
+    Largest 1 - cosine similarity between two models' embeddings of the same texts.
+    """
+    a = np.asarray(candidate.encode(list(texts)), dtype=np.float32)
+    b = np.asarray(reference.encode(list(texts)), dtype=np.float32)
+    a /= np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b /= np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return float(1.0 - (a * b).sum(axis=1).min())
+
+def _reference_model(model_name, threads, backend):
+    """
+    The torch model if installed, else the float32 ONNX export (numerically equivalent).
+
+    Returns (None, None) when the only reference would be the backend itself.
+    """
+    try:
+        return _load_torch(model_name, threads), 'torch'
+    except ImportError:
+        if backend == 'onnx':
+            return None, None
+        return OnnxEmbedder(model_name, threads=threads), 'onnx'
+
+def load_embedding_model(backend='torch', model_name=EMBEDDING_MODEL_NAME, threads=None,
+                         tolerance=DEFAULT_TOLERANCE, verify=True):
+    """
+    Load an embedding model on the requested CPU backend.
+
+    An optimized backend is checked against the reference model on
+    CALIBRATION_TEXTS; if its vectors drift further than tolerance, the
+    reference model is returned instead, so stored and query embeddings
+    stay comparable.
+
+    :param backend: 'torch' (sentence-transformers), 'onnx' (float32 graph) or 'onnx-int8'
+        (dynamically quantized graph for this CPU)
+    :param model_name: sentence-transformers model name
+    :param threads: Inference threads; ONNX sessions default to default_threads(), while torch
+        keeps its process-wide setting unless this is given
+    :param tolerance: Largest accepted 1 - cosine similarity to the reference
+    :param verify: Run the tolerance check
+    :return: Object with a SentenceTransformer-style encode()
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}")
+    start = time.perf_counter()
+    if backend == 'torch':
+        model = _load_torch(model_name, threads)
+    else:
+        file_name = quantized_onnx_file() if backend == 'onnx-int8' else 'onnx/model.onnx'
+        model = OnnxEmbedder(model_name, file_name, threads=threads)
+        reference, reference_backend = _reference_model(model_name, threads, backend) if verify else (None, None)
+        if reference is not None:
+            error = embedding_error(model, reference)
+            if error > tolerance:
+                logger.error(f"{backend} embeddings of {model_name} are {error:.4f} from {reference_backend} "
+                             f"(tolerance {tolerance}); using {reference_backend}")
+                model, backend = reference, reference_backend
+            else:
+                logger.info(f"{backend} embeddings of {model_name} within {error:.4f} of {reference_backend}")
+    logger.info(f"Loaded {model_name} on {backend} with {model_threads(model)} threads in {time.perf_counter() - start:.1f}s")
+    return model
+
+_models = {}
+_models_lock = threading.Lock()
+
+def get_embedding_model(model_name=EMBEDDING_MODEL_NAME):
+    """
+    Return the process-wide embedding model, loading it on first use.
+
+    The backend, thread count and tolerance come from EMBEDDING_BACKEND,
+    EMBEDDING_THREADS and EMBEDDING_TOLERANCE.
+    """
+    key = model_repo(model_name)
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                threads = os.getenv("EMBEDDING_THREADS")
+                model = _models[key] = load_embedding_model(
+                    backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+                    model_name=model_name,
+                    threads=int(threads) if threads else None,
+                    tolerance=float(os.getenv("EMBEDDING_TOLERANCE", str(DEFAULT_TOLERANCE)))
+                )
+    return model
+
+def set_embedding_model(model, model_name=EMBEDDING_MODEL_NAME):
+    """
+    Replace the process-wide embedding model, e.g. with a local fake.
+    """
+    with _models_lock:
+        _models[model_repo(model_name)] = model
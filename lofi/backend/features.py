@@ -0,0 +1,298 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+# Bump when descriptors or the table layout change so stale tables are rebuilt
+FEATURES_VERSION = 1
+FEATURE_COLUMNS = ('rms_db', 'spectral_centroid', 'tempo', 'duration')
+DEFAULT_FEATURES_PATH = os.path.join('downloaded_audio', 'audio_features')
+
+SAMPLE_RATE = 22050
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+MIN_TEMPO = 60.0
+MAX_TEMPO = 180.0
+
+def decode_audio(path, sample_rate=SAMPLE_RATE):
+    """
+    Decode an audio file to mono float32 samples with ffmpeg.
+    """
+    command = [
+        'ffmpeg', '-nostdin', '-v', 'error', '-i', path,
+        '-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', '-'
+    ]
+    completed = subprocess.run(command, capture_output=True, check=True)
+    return np.frombuffer(completed.stdout, dtype=np.float32)
+
+def _estimate_tempo(onset_envelope, frame_rate):
+    """
+    Tempo (BPM) from the autocorrelation peak of the onset envelope.
+    """
+    envelope = onset_envelope - onset_envelope.mean()
+    min_lag = int(frame_rate * 60.0 / MAX_TEMPO)
+    max_lag = int(frame_rate * 60.0 / MIN_TEMPO)
+    if len(envelope) <= max_lag or not envelope.any():
+        return 0.0
+    # FFT autocorrelation, zero-padded so it is linear rather than circular
+    size = 1 << int(np.ceil(np.log2(2 * len(envelope))))
+    spectrum = np.fft.rfft(envelope, size)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:max_lag + 1]
+    # Log-normal prior around 120 BPM damps half- and double-tempo errors
+    lags = np.arange(min_lag, max_lag + 1)
+    prior = np.exp(-0.5 * np.square(np.log2(60.0 * frame_rate / lags / 120.0)))
+    lag = lags[int(np.argmax(autocorrelation[min_lag:max_lag + 1] * prior))]
+    return 60.0 * frame_rate / lag
+
+def compute_features(samples, sample_rate=SAMPLE_RATE):
+    """
+    Compact acoustic descriptors for one decoded track.
+
+    :param samples: Mono float32 samples in [-1, 1]
+    :param sample_rate: Sample rate of samples
+    :return: float32 array ordered like FEATURE_COLUMNS
+    """
+    duration = len(samples) / sample_rate
+    if len(samples) < FRAME_SIZE:
+        return np.array([-120.0, 0.0, 0.0, duration], dtype=np.float32)
+
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+    rms_db = 20.0 * np.log10(max(rms, 1e-6))
+
+    frames = sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    magnitudes = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1))
+    frequencies = np.fft.rfftfreq(FRAME_SIZE, 1.0 / sample_rate)
+    energy = magnitudes.sum(axis=1)
+    voiced = energy > 1e-6
+    if voiced.any():
+        centroids = magnitudes[voiced] @ frequencies / energy[voiced]
+        spectral_centroid = float(np.average(centroids, weights=energy[voiced]))
+    else:
+        spectral_centroid = 0.0
+
+    # Spectral flux: summed increases in log magnitude between consecutive frames
+    log_magnitudes = np.log1p(magnitudes)
+    onset_envelope = np.maximum(np.diff(log_magnitudes, axis=0), 0.0).sum(axis=1)
+    tempo = _estimate_tempo(onset_envelope, sample_rate / HOP_SIZE)
+
+    return np.array([rms_db, spectral_centroid, tempo, duration], dtype=np.float32)
+
+def extract_file_features(path):
+    """
+    Decode one file and compute its descriptors; runs in a worker process.
+    """
+    return compute_features(decode_audio(path))
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def table_paths(prefix):
+    """Return the (.npy, .json) paths of a feature table"""
+    return f"{prefix}.npy", f"{prefix}.json"
+
+def _write_atomic(path, write, mode='wb'):
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _load_previous(prefix):
+    """Rows of an existing table keyed by file name, or {} if missing or stale"""
+    npy_path, json_path = table_paths(prefix)
+    try:
+        with open(json_path) as f:
+            sidecar = json.load(f)
+        features = np.load(npy_path)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if sidecar.get('version') != FEATURES_VERSION or len(sidecar['files']) != len(features):
+        return {}
+    return {
+        filename: (stamp, features[i])
+        for i, (filename, stamp) in enumerate(zip(sidecar['files'], sidecar['sources']))
+    }
+
+def build_feature_table(audio_dir, prefix=None, extensions=('.mp3',), workers=None):
+    """
+    Analyse every audio file in a directory and write the feature table.
+
+    Files whose size and modification time are unchanged since the last run
+    reuse their stored row; only new or changed files are decoded.
+
+    :param audio_dir: Directory of audio files
+    :param prefix: Table path without extension (defaults to <audio_dir>/audio_features)
+    :param extensions: File extensions to analyse
+    :param workers: Decoder processes (defaults to the CPU count)
+    :return: Dictionary with analysed, reused and failed counts
+    """
+    prefix = prefix or os.path.join(audio_dir, 'audio_features')
+    previous = _load_previous(prefix)
+
+    filenames = sorted(
+        name for name in os.listdir(audio_dir)
+        if name.lower().endswith(tuple(extensions))
+    )
+    stamps = {name: _source_stamp(os.path.join(audio_dir, name)) for name in filenames}
+    rows = {}
+    pending = []
+    for name in filenames:
+        entry = previous.get(name)
+        if entry is not None and entry[0] == stamps[name]:
+            rows[name] = entry[1]
+        else:
+            pending.append(name)
+
+    start = time.perf_counter()
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            paths = [os.path.join(audio_dir, name) for name in pending]
+            futures = [executor.submit(extract_file_features, path) for path in paths]
+            for name, future in zip(pending, futures):
+                try:
+                    rows[name] = future.result()
+                except (OSError, subprocess.CalledProcessError, ValueError) as e:
+                    failed += 1
+                    logger.warning(f"Could not analyse {name}: {e}")
+
+    files = [name for name in filenames if name in rows]
+    features = np.zeros((len(files), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for i, name in enumerate(files):
+        features[i] = rows[name]
+
+    npy_path, json_path = table_paths(prefix)
+    os.makedirs(os.path.dirname(npy_path) or '.', exist_ok=True)
+    _write_atomic(npy_path, lambda f: np.save(f, features))
+    sidecar = {
+        'version': FEATURES_VERSION,
+        'columns': list(FEATURE_COLUMNS),
+        'sample_rate': SAMPLE_RATE,
+        'files': files,
+        'sources': [stamps[name] for name in files]
+    }
+    _write_atomic(json_path, lambda f: json.dump(sidecar, f), mode='w')
+
+    stats = {
+        'files': len(files),
+        'analysed': len(pending) - failed,
+        'reused': len(files) - (len(pending) - failed),
+        'failed': failed,
+        'seconds': time.perf_counter() - start
+    }
+    logger.info(f"Feature table {npy_path}: {stats}")
+    return stats
+
+class AudioFeatureIndex:
+    def __init__(self, files, features, columns=FEATURE_COLUMNS):
+        """
+        In-memory table of per-track acoustic descriptors.
+
+        Columns are standardized so that a Euclidean distance weighs loudness,
+        brightness, tempo and length comparably.
+
+        :param files: Audio file names, one per row
+        :param features: Array of shape (len(files), len(columns))
+        :param columns: Descriptor names
+        """
+        self.files = list(files)
+        self.columns = tuple(columns)
+        self.features = np.asarray(features, dtype=np.float32)
+        self._rows = {name: i for i, name in enumerate(self.files)}
+        mean = self.features.mean(axis=0) if len(self.files) else 0.0
+        std = self.features.std(axis=0) if len(self.files) else 1.0
+        self._mean = mean
+        self._std = np.where(std > 0, std, 1.0)
+        self.standardized = (self.features - self._mean) / self._std
+
+    @classmethod
+    def load(cls, prefix=DEFAULT_FEATURES_PATH):
+        """
+        Load a table written by build_feature_table, or return None if there is none.
+        """
+        npy_path, json_path = table_paths(prefix)
+        try:
+            with open(json_path) as f:
+                sidecar = json.load(f)
+            features = np.load(npy_path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        if sidecar.get('version') != FEATURES_VERSION or len(sidecar['files']) != len(features):
+            logger.warning(f"Ignoring stale feature table {npy_path}")
+            return None
+        return cls(sidecar['files'], features, sidecar['columns'])
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, filename):
+        return filename in self._rows
+
+    def row(self, filename):
+        """Row number of a file, or None if it was not analysed"""
+        return self._rows.get(filename)
+
+    def describe(self, filename):
+        """Raw descriptors of a file as a dictionary, or None"""
+        row = self._rows.get(filename)
+        if row is None:
+            return None
+        return {column: float(value) for column, value in zip(self.columns, self.features[row])}
+
+    def distances(self, filename, rows=None):
+        """
+        Standardized Euclidean distance from one file to other rows.
+
+        :param filename: Reference file name (must be in the table)
+        :param rows: Row numbers to compare against (defaults to every row)
+        :return: float32 array of distances aligned with rows
+        """
+        reference = self.standardized[self._rows[filename]]
+        candidates = self.standardized if rows is None else self.standardized[rows]
+        return np.sqrt(np.square(candidates - reference).sum(axis=1))
+
+    def nearest(self, filename, n_results=5):
+        """
+        Files that sound most like the given one, excluding itself.
+
+        :return: List of (file name, distance) pairs, closest first
+        """
+        distances = self.distances(filename)
+        distances[self._rows[filename]] = np.inf
+        n_results = min(n_results, len(self.files) - 1)
+        if n_results <= 0:
+            return []
+        top = np.argpartition(distances, n_results - 1)[:n_results]
+        top = top[np.argsort(distances[top])]
+        return [(self.files[i], float(distances[i])) for i in top]
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Extract acoustic features from downloaded audio.")
+    parser.add_argument("--audio-dir", default="downloaded_audio", help="Directory of audio files")
+    parser.add_argument("--output", default=None, help="Table path without extension")
+    parser.add_argument("--workers", type=int, default=None, help="Decoder processes")
+    args = parser.parse_args()
+
+    stats = build_feature_table(args.audio_dir, args.output, workers=args.workers)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == '__main__':
+    main()
+
+# Usage (from the lofi/ directory, after download.py; requires ffmpeg on PATH):
+# python -m backend.features --audio-dir downloaded_audio --workers 8
@@ -1,15 +1,215 @@
-from huggingface_hub import InferenceClient
 import os
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from io import BytesIO
 
+from .metrics import stage
+from .upstream import Upstream
+
+IMAGE_MODEL = "stabilityai/stable-diffusion-3.5-large-turbo"
+
+# Seconds the inference client waits on one text-to-image call
+IMAGE_TIMEOUT = float(os.getenv("IMAGE_TIMEOUT", "60"))
+
+# Renders are slow and expensive, so a failure is retried once; a run of them opens the circuit
+image_upstream = Upstream(
+    'image-inference', max_concurrency=int(os.getenv("IMAGE_POOL_WORKERS", "4")), read_timeout=IMAGE_TIMEOUT,
+    max_retries=1, backoff=1.0, failure_threshold=3, reset_timeout=30.0
+)
+
+# Modify the prompt to include pixelated, lofi, and vaporwave aesthetics
+PROMPT_TEMPLATE = "Calm, Peaceful, Pixelated, lofi, vaporwave aesthetic: {prompt}"
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Return the shared, long-lived inference client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from huggingface_hub import InferenceClient
+                _client = InferenceClient(api_key=os.getenv("HF_API_KEY"), timeout=IMAGE_TIMEOUT)
+    return _client
+
+def set_client(client):
+    """
+    Replace the shared inference client, e.g. with a local fake.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+class ImageCache:
+    def __init__(self, directory='image_cache', max_bytes=512 * 1024 * 1024, max_age=7 * 24 * 3600):
+        """
+        Disk-backed cache of encoded images keyed by prompt and model.
+
+        :param directory: Directory holding cached PNG files
+        :param max_bytes: Total size above which the oldest entries are evicted
+        :param max_age: Seconds after which an entry is considered stale
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    @staticmethod
+    def key(prompt, model):
+        """
+        Content address for a prompt/model pair.
+        """
+        normalized = ' '.join(prompt.lower().split())
+        return hashlib.sha256(f"{model}\n{normalized}".encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key):
+        """
+        Return cached bytes, or None on a miss or a stale entry.
+        """
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.max_age:
+                self._remove(path, stat.st_size)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        """
+        Store encoded bytes atomically, then evict old entries if over budget.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        path = self.path(key)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data) - replaced
+        self.evict()
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.png'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """
+        Drop stale entries, then the oldest ones until the cache fits max_bytes.
+        """
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+                return
+            entries = sorted(self._entries())
+            now = time.time()
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if total <= self.max_bytes and now - mtime <= self.max_age:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self._total_bytes = total
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one execution.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+image_cache = ImageCache(
+    directory=os.getenv("IMAGE_CACHE_DIR", "image_cache"),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+    max_age=float(os.getenv("IMAGE_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+)
+_in_flight = SingleFlight()
+
+def _render_png(prompt, model, key):
+    # Another caller may have filled the cache while we waited to lead
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with stage('image_inference'):
+        image = image_upstream.call(
+            'text_to_image', get_client().text_to_image,
+            PROMPT_TEMPLATE.format(prompt=prompt),
+            model=model
+        )
+    with stage('png_encode'):
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        data = buffer.getvalue()
+    image_cache.put(key, data)
+    return data
+
+def generate_image_bytes(prompt, model=IMAGE_MODEL):
+    """
+    Return PNG bytes for a prompt, calling the upstream model at most once per prompt.
+
+    :param prompt: Mood prompt from the user
+    :param model: Text-to-image model id
+    :return: Encoded PNG bytes
+    """
+    key = image_cache.key(prompt, model)
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached
+    return _in_flight.do(key, lambda: _render_png(prompt, model, key))
 
 def generate_image(prompt):
-    client = InferenceClient(api_key=os.getenv("HF_API_KEY"))
-
-    # Modify the prompt to include pixelated, lofi, and vaporwave aesthetics
-    modified_prompt = f"Calm, Peaceful, Pixelated, lofi, vaporwave aesthetic: {prompt}"
-    
-    image = client.text_to_image(
-        modified_prompt,
-        model="stabilityai/stable-diffusion-3.5-large-turbo"
-    )
-    return image
+    from PIL import Image
+
+    return Image.open(BytesIO(generate_image_bytes(prompt)))
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds spent importing each backend module, filled in by import_timer
+IMPORT_TIMINGS = {}
+
+@contextmanager
+def import_timer(name):
+    """
+    Record how long the imports inside the block take.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        IMPORT_TIMINGS[name] = time.perf_counter() - start
+
+class LazyComponent:
+    def __init__(self, name, factory, required=True):
+        """
+        Heavy object (model, DB client) built on first use, exactly once.
+
+        :param name: Component name used in readiness reports
+        :param factory: Zero-argument callable building the object
+        :param required: Whether the service is not ready until this is loaded
+        """
+        self.name = name
+        self.required = required
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self.error = None
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        """
+        Return the component, building it on the first call.
+
+        Concurrent first callers block until the single build finishes; a
+        failed build is retried on the next call.
+        """
+        value = self._value
+        if value is not None:
+            return value
+        with self._lock:
+            if self._value is None:
+                start = time.perf_counter()
+                try:
+                    self._value = self._factory()
+                    self.error = None
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.load_seconds = time.perf_counter() - start
+                logger.info(f"Loaded {self.name} in {self.load_seconds:.2f}s")
+            return self._value
+
+    def warm_up(self):
+        """
+        Start loading in a background thread.
+        """
+        def load():
+            try:
+                self.get()
+            except Exception as e:
+                logger.error(f"Warmup of {self.name} failed: {e}")
+
+        thread = threading.Thread(target=load, name=f'warmup-{self.name}', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        return {
+            'loaded': self.loaded,
+            'required': self.required,
+            'load_seconds': self.load_seconds,
+            'error': self.error
+        }
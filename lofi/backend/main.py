@@ -1,24 +1,140 @@
+import time
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from io import BytesIO
-import traceback
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import json
+import logging
 import os
-from fastapi.responses import FileResponse
-import uuid
-from pathlib import Path
+import secrets
+
+# Deferred loading of models and DB clients, plus import timings
+from .lazy import LazyComponent, IMPORT_TIMINGS, import_timer
 
 # Import image generation
-from .image_generation import generate_image
+with import_timer("image_generation"):
+    from .image_generation import generate_image_bytes
+    from .upstream import CircuitOpenError, upstream_stats
 
 # Import query manager for semantic search
-from .query import AudioQueryManager
+with import_timer("query"):
+    from .query import AudioQueryManager
+
+# Bounded worker pools that keep blocking work off the event loop
+from .concurrency import BoundedExecutor, PoolSaturatedError
+
+# Request tracing, Prometheus metrics and the optional sampling profiler
+from .metrics import MetricsMiddleware, render_metrics, profiler_from_env
+
+# Range-aware static audio serving
+with import_timer("audio_store"):
+    from .audio_store import AudioLibrary, file_response, requested_variant
+    from .transcode import DEFAULT_VARIANTS_DIR, VARIANTS
+
+# Model-resident MusicGen used when no stored track is close enough
+with import_timer("musicgen"):
+    from .musicgen import MusicGenService
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+def _embedding_model():
+    # With several workers, EMBEDDER_SOCKET points every process at one shared model
+    socket_path = os.getenv("EMBEDDER_SOCKET")
+    if socket_path:
+        from .shared import RemoteEmbedder
+        return RemoteEmbedder(socket_path)
+    return None
+
+# Global audio query manager; the embedding model and Chroma client load on first use
+audio_query_manager = LazyComponent("audio_query_manager", lambda: AudioQueryManager(
+    embedding_model=_embedding_model(),
+    search_backend=os.getenv("SEARCH_BACKEND", "chroma"),
+    backend_dtype=os.getenv("SEARCH_DTYPE", "float32"),
+    index_dir=os.getenv("SHARED_INDEX_DIR"),
+    ivf_probe=int(os.getenv("IVF_PROBE", "8")),
+    features_path=os.getenv("AUDIO_FEATURES", os.path.join("downloaded_audio", "audio_features"))
+))
+
+# Remote image inference is I/O-bound; query embedding is CPU-bound and gets its own pool
+image_pool = BoundedExecutor(
+    "image",
+    max_workers=int(os.getenv("IMAGE_POOL_WORKERS", "4")),
+    max_queue=int(os.getenv("IMAGE_POOL_QUEUE", "16"))
+)
+embedding_pool = BoundedExecutor(
+    "embedding",
+    max_workers=int(os.getenv("EMBEDDING_POOL_WORKERS", "8")),
+    max_queue=int(os.getenv("EMBEDDING_POOL_QUEUE", "64"))
+)
+
+# Index of servable audio files, so requests never stat the filesystem
+audio_library = AudioLibrary("downloaded_audio")
 
-# Initialize global audio query manager
-audio_query_manager = AudioQueryManager()
+# Loudness-normalized, lower-bitrate copies written by transcode.py; Save-Data clients get SAVE_DATA_VARIANT
+AUDIO_VARIANTS_DIR = os.getenv("AUDIO_VARIANTS_DIR", DEFAULT_VARIANTS_DIR)
+SAVE_DATA_VARIANT = os.getenv("SAVE_DATA_VARIANT", "low")
+audio_variants = {
+    name: AudioLibrary(os.path.join(AUDIO_VARIANTS_DIR, name), etag_suffix=f"-{name}")
+    for name in VARIANTS
+}
 
-app = FastAPI()
+# Generate new music when the best match is farther than this (squared L2); unset disables it
+MUSICGEN_FALLBACK_DISTANCE = os.getenv("MUSICGEN_FALLBACK_DISTANCE")
+musicgen_service = MusicGenService(
+    output_dir=os.getenv("GENERATED_AUDIO_DIR", "generated_audio"),
+    max_pending=int(os.getenv("MUSICGEN_MAX_PENDING", "8")),
+    max_streams=int(os.getenv("MUSICGEN_MAX_STREAMS", "2"))
+)
+generated_library = AudioLibrary(musicgen_service.output_dir, extensions=('.wav',), rescan_interval=0)
+
+AUDIO_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+    "Access-Control-Allow-Headers": "*"
+}
+
+def _audio_url(track):
+    """
+    URL of a stored track's audio, or None when it has no local file.
+    """
+    path = track.get('local_audio_path')
+    if not path or path == 'No local path':
+        return None
+    return f"/api/audio/{os.path.basename(path)}"
+
+def _with_audio_url(content, track):
+    # Tracks without a local file are returned without an audio_url rather than a broken one
+    url = _audio_url(track)
+    if url is not None:
+        content["audio_url"] = url
+    return content
+
+def _semantic_search(prompt, n_results):
+    return audio_query_manager.get().semantic_search(prompt, n_results=n_results)
+
+def _similar_tracks(track_id, n_results):
+    return audio_query_manager.get().similar_tracks(track_id, n_results=n_results)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Start loading heavy components in the background so the first request does not pay for it
+    if os.getenv("WARMUP", "1") == "1":
+        audio_query_manager.warm_up()
+    app.state.profiler = profiler_from_env()
+    yield
+    image_pool.shutdown(wait=False)
+    embedding_pool.shutdown(wait=False)
+    if app.state.profiler is not None:
+        app.state.profiler.stop()
+        app.state.profiler.dump(os.getenv("PROFILE_OUTPUT", "profile.collapsed"))
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -30,80 +146,273 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Outermost, so latency covers CORS handling and errors; SLOW_REQUEST_SECONDS enables the slow log
+slow_request_seconds = os.getenv("SLOW_REQUEST_SECONDS")
+app.add_middleware(
+    MetricsMiddleware,
+    slow_request_seconds=float(slow_request_seconds) if slow_request_seconds else None
+)
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+logger.info(f"Imported backend.main in {IMPORT_SECONDS:.3f}s")
+
 class PromptRequest(BaseModel):
     prompt: str
 
+class PlaylistRequest(BaseModel):
+    prompts: list[str] = []
+    prompt: str | None = None
+    length: int = 10
+
+MAX_PLAYLIST_PROMPTS = 32
+MAX_PLAYLIST_LENGTH = 100
+
 @app.options("/api/generate-image")
 @app.options("/api/generate-music")
+@app.options("/api/playlist")
+@app.options("/api/mood")
+@app.options("/api/generate-music/stream")
 async def options_handler():
     return Response(status_code=200)
 
+def _service_unavailable(error):
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": "1"})
+
 @app.post("/api/generate-image")
 async def generate_image_endpoint(request: PromptRequest):
     try:
-        image = generate_image(request.prompt)
-        img_byte_arr = BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
+        img_byte_arr = await image_pool.run("generate-image", generate_image_bytes, request.prompt)
         return Response(content=img_byte_arr, media_type="image/png")
+    except (PoolSaturatedError, CircuitOpenError) as e:
+        raise _service_unavailable(e)
     except Exception as e:
-        print(f"Error in generate_image: {str(e)}")
-        print(traceback.format_exc())  # Print full traceback
+        logger.exception(f"Error in generate_image: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _needs_generation(search_results):
+    if MUSICGEN_FALLBACK_DISTANCE is None:
+        return False
+    if not search_results:
+        return True
+    distance = search_results[0].get('distance')
+    return distance is not None and distance > float(MUSICGEN_FALLBACK_DISTANCE)
+
+async def _track_for_prompt(prompt, endpoint):
+    """
+    Metadata of the closest stored track, or of a freshly generated clip when nothing is close enough.
+    """
+    # Perform semantic search to find most similar existing track
+    search_results = await embedding_pool.run(endpoint, _semantic_search, prompt, 1)
+    
+    if _needs_generation(search_results):
+        # Nothing close enough in the catalog: generate a new clip instead. The Future is shared by
+        # every caller of this prompt, so a timed-out or disconnected caller must not cancel it
+        path = await asyncio.shield(asyncio.wrap_future(musicgen_service.submit(prompt)))
+        return {
+            "prompt": prompt,
+            "audio_url": f"/api/generated/{os.path.basename(path)}",
+            "distance": search_results[0].get('distance') if search_results else None,
+            "generated": True
+        }
+    
+    if not search_results:
+        raise HTTPException(status_code=404, detail="No similar audio found")
+    
+    # Get the most similar track's details
+    most_similar_track = search_results[0]
+    
+    # Return track metadata with a URL endpoint for the audio file
+    return _with_audio_url({
+        "prompt": most_similar_track['prompt'],
+        "distance": most_similar_track.get('distance')
+    }, most_similar_track)
+
 @app.post("/api/generate-music")
 async def generate_music_endpoint(request: PromptRequest):
     try:
-        print(f"Received music prompt: {request.prompt}")
-        
-        # Perform semantic search to find most similar existing track
-        search_results = audio_query_manager.semantic_search(request.prompt, n_results=1)
-        
-        if not search_results:
-            raise HTTPException(status_code=404, detail="No similar audio found")
-        
-        # Get the most similar track's details
-        most_similar_track = search_results[0]
-        
-        # Create a URL endpoint for the audio file
-        audio_endpoint = f"/api/audio/{os.path.basename(most_similar_track['local_audio_path'])}"
-        
-        # Return track metadata with the endpoint URL
-        return JSONResponse(content={
-            "prompt": most_similar_track['prompt'],
-            "audio_url": audio_endpoint,
-            "distance": most_similar_track.get('distance')
-        })
+        logger.debug(f"Received music prompt: {request.prompt}")
+        return JSONResponse(content=await _track_for_prompt(request.prompt, "generate-music"))
 
+    except HTTPException:
+        raise
+    except PoolSaturatedError as e:
+        raise _service_unavailable(e)
     except Exception as e:
-        print(f"Error in generate_music endpoint: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception(f"Error in generate_music endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/audio/{filename}")
-async def get_audio(filename: str):
+# Per-stage limits for /api/mood, so a slow image backend never holds back the track
+MOOD_TRACK_TIMEOUT = float(os.getenv("MOOD_TRACK_TIMEOUT", "10"))
+MOOD_IMAGE_TIMEOUT = float(os.getenv("MOOD_IMAGE_TIMEOUT", "30"))
+
+async def _mood_stage(kind, work, timeout, started):
+    """
+    Run one /api/mood stage and turn its outcome into an NDJSON event.
+    """
     try:
-        # Use the correct audio directory path
-        audio_dir = Path("downloaded_audio")  # Changed from "audio" to "downloaded_audio"
-        audio_path = audio_dir / filename
-        
-        print(f"Attempting to serve audio from: {audio_path}")
-        print(f"File exists: {audio_path.exists()}")
-        
-        if not audio_path.exists():
-            raise HTTPException(status_code=404, detail=f"Audio file not found at {audio_path}")
-            
-        return FileResponse(
-            str(audio_path),
-            media_type="audio/mpeg",
-            headers={
-                "Accept-Ranges": "bytes",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
-                "Access-Control-Allow-Headers": "*"
-            }
-        )
+        event = {"type": kind, **await asyncio.wait_for(work, timeout)}
+    except asyncio.TimeoutError:
+        # Queued track lookups are cancelled; image work is shielded and still fills the cache
+        event = {"type": kind, "status": 504, "error": f"{kind} stage timed out after {timeout:g}s"}
+    except HTTPException as e:
+        event = {"type": kind, "status": e.status_code, "error": e.detail}
+    except (PoolSaturatedError, CircuitOpenError) as e:
+        event = {"type": kind, "status": 503, "error": str(e)}
     except Exception as e:
-        print(f"Error serving audio: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        logger.exception(f"Error in mood {kind} stage: {str(e)}")
+        event = {"type": kind, "status": 500, "error": str(e)}
+    event["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return event
+
+async def _mood_image(prompt):
+    # Shielded so a stage timeout or client disconnect leaves the render running, queued or not
+    png = await asyncio.shield(image_pool.run("mood", generate_image_bytes, prompt))
+    return {"content_type": "image/png", "data": base64.b64encode(png).decode('ascii')}
+
+@app.post("/api/mood")
+async def mood_endpoint(request: PromptRequest):
+    """
+    Track lookup and image generation for one mood, run concurrently.
+    
+    The response is NDJSON with one line per stage in completion order:
+    {"type": "track", ...} with the same fields as /api/generate-music and
+    {"type": "image", "content_type": "image/png", "data": <base64>}. A stage
+    that fails or exceeds its timeout yields {"type": ..., "status", "error"}
+    instead, without affecting the other one.
+    """
+    started = time.perf_counter()
+    stages = [
+        asyncio.ensure_future(_mood_stage("track", _track_for_prompt(request.prompt, "mood"), MOOD_TRACK_TIMEOUT, started)),
+        asyncio.ensure_future(_mood_stage("image", _mood_image(request.prompt), MOOD_IMAGE_TIMEOUT, started))
+    ]
+    
+    async def events():
+        try:
+            for next_event in asyncio.as_completed(stages):
+                yield json.dumps(await next_event) + "\n"
+        finally:
+            # The client went away before both stages finished
+            for stage_task in stages:
+                stage_task.cancel()
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers={"Cache-Control": "no-store"})
+
+def _playlist(prompts, length):
+    return audio_query_manager.get().playlist(prompts, length=length)
+
+@app.post("/api/playlist")
+async def playlist_endpoint(request: PlaylistRequest):
+    prompts = request.prompts or ([request.prompt] if request.prompt else [])
+    if not prompts:
+        raise HTTPException(status_code=422, detail="Provide 'prompts' or 'prompt'")
+    if len(prompts) > MAX_PLAYLIST_PROMPTS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_PLAYLIST_PROMPTS} prompts per request")
+    length = max(1, min(request.length, MAX_PLAYLIST_LENGTH))
+    
+    try:
+        # One encode pass and one k-NN call for the whole playlist
+        tracks = await embedding_pool.run("playlist", _playlist, prompts, length)
+    except PoolSaturatedError as e:
+        raise _service_unavailable(e)
+    except Exception as e:
+        logger.exception(f"Error in playlist endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return JSONResponse(content={
+        "tracks": [
+            _with_audio_url({
+                "query": track['query'],
+                "prompt": track['prompt'],
+                "distance": track.get('distance')
+            }, track)
+            for track in tracks
+        ]
+    })
+
+@app.post("/api/generate-music/stream")
+async def stream_music_endpoint(request: PromptRequest):
+    try:
+        # Segments are sent as they are decoded, so playback can start after ~1s of audio
+        chunks = musicgen_service.stream_wav(request.prompt)
+    except PoolSaturatedError as e:
+        raise _service_unavailable(e)
+    return StreamingResponse(chunks, media_type="audio/wav", headers=AUDIO_HEADERS)
+
+@app.get("/api/ready")
+async def readiness():
+    components = {
+        component.name: component.status()
+        for component in (audio_query_manager,)
+    }
+    components["musicgen"] = {"loaded": musicgen_service.model is not None, "required": False}
+    ready = all(status["loaded"] for status in components.values() if status["required"])
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "components": components,
+            "import_seconds": IMPORT_SECONDS,
+            "import_timings": IMPORT_TIMINGS
+        }
+    )
+
+@app.get("/api/similar/{track_id}")
+async def similar_tracks(track_id: str, n_results: int = 5):
+    try:
+        tracks = await embedding_pool.run("similar", _similar_tracks, track_id, max(1, min(n_results, 50)))
+    except PoolSaturatedError as e:
+        raise _service_unavailable(e)
+    except Exception as e:
+        logger.exception(f"Error in similar endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if tracks is None:
+        raise HTTPException(status_code=404, detail=f"Unknown track: {track_id}")
+    return tracks
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Stacks expose file paths and internals, so /api/profile also needs this bearer token
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+
+@app.get("/api/profile")
+async def profile(request: Request):
+    # Collapsed stacks for flamegraph tools; only when PROFILE_SAMPLING_INTERVAL and PROFILE_TOKEN are set
+    if getattr(app.state, "profiler", None) is None or not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {PROFILE_TOKEN}".encode('utf-8')
+    if not secrets.compare_digest(request.headers.get("Authorization", "").encode('utf-8'), expected):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+    return PlainTextResponse(app.state.profiler.collapsed())
+
+@app.get("/api/pools")
+async def pool_stats():
+    return {
+        "image": image_pool.stats(),
+        "embedding": embedding_pool.stats(),
+        "upstreams": upstream_stats()
+    }
+
+@app.api_route("/api/audio/{filename}", methods=["GET", "HEAD"])
+async def get_audio(filename: str, request: Request):
+    variant = requested_variant(request, SAVE_DATA_VARIANT)
+    if variant is not None and variant not in audio_variants:
+        raise HTTPException(status_code=400, detail=f"Unknown audio variant: {variant}")
+    # Tracks not transcoded yet fall back to the original
+    entry = audio_variants[variant].get(filename) if variant else None
+    served = variant if entry is not None else "original"
+    if entry is None:
+        entry = audio_library.get(filename)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Audio file not found: {filename}")
+    headers = {**AUDIO_HEADERS, "Vary": "X-Audio-Variant, Save-Data", "X-Audio-Variant": served}
+    return file_response(request, entry, "audio/mpeg", headers)
+
+@app.api_route("/api/generated/{filename}", methods=["GET", "HEAD"])
+async def get_generated_audio(filename: str, request: Request):
+    entry = generated_library.get(filename)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Generated audio not found: {filename}")
+    return file_response(request, entry, "audio/wav", AUDIO_HEADERS)
@@ -0,0 +1,294 @@
+import bisect
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; covers cache hits (~10us) up to image inference (~tens of seconds)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Cumulative histogram in the Prometheus text format.
+
+        :param name: Metric name
+        :param documentation: HELP text
+        :param labelnames: Label names; observe() takes values in the same order
+        :param buckets: Sorted bucket upper bounds (+Inf is implicit)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", le)])} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {total}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return '\n'.join(lines)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Monotonic counter in the Prometheus text format.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return '\n'.join(lines)
+
+REGISTRY = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render_metrics():
+    """
+    All registered metrics as a Prometheus text exposition.
+    """
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+REQUEST_SECONDS = register(Histogram(
+    'lofi_request_seconds', 'HTTP request latency by endpoint.', ('method', 'endpoint', 'status')
+))
+STAGE_SECONDS = register(Histogram(
+    'lofi_stage_seconds', 'Time spent in each request stage.', ('endpoint', 'stage')
+))
+ERRORS = register(Counter(
+    'lofi_errors_total', 'Responses with a 5xx status by endpoint.', ('endpoint',)
+))
+
+# Stage timings of the request being served; copied into worker threads with the context
+_current_trace = contextvars.ContextVar('lofi_trace', default=None)
+
+class RequestTrace:
+    """
+    Per-request list of (stage, seconds) pairs.
+    """
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add(self, stage_name, seconds):
+        with self._lock:
+            self.stages.append((stage_name, seconds))
+
+    def server_timing(self):
+        """
+        Stages as a Server-Timing header value (durations in milliseconds).
+        """
+        with self._lock:
+            stages = list(self.stages)
+        return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in stages)
+
+def record_stage(stage_name, seconds):
+    """
+    Attribute time to a stage of the current request, or to 'background' outside one.
+
+    Traced stages are added to the histogram when the request finishes, once
+    its route (and so its endpoint label) is known.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage_name, seconds)
+    else:
+        STAGE_SECONDS.observe(seconds, 'background', stage_name)
+
+@contextmanager
+def stage(stage_name):
+    """
+    Time the enclosed block as one stage of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage_name, time.perf_counter() - start)
+
+class MetricsMiddleware:
+    def __init__(self, app, slow_request_seconds=None):
+        """
+        ASGI middleware recording request latency and per-stage timings.
+
+        Each request gets a RequestTrace that stage() blocks add to, including
+        blocks run on worker pools. Stage timings are returned to the client in
+        a Server-Timing header and requests slower than slow_request_seconds
+        are logged with their breakdown.
+
+        :param app: ASGI application to wrap
+        :param slow_request_seconds: Threshold for the slow-request log, or None
+        """
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                timing = trace.server_timing()
+                if timing:
+                    message = {**message, 'headers': [*message.get('headers', []), (b'server-timing', timing.encode('latin-1'))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - start
+            endpoint = _endpoint(scope)
+            REQUEST_SECONDS.observe(elapsed, scope['method'], endpoint, str(status))
+            if status >= 500:
+                ERRORS.inc(endpoint)
+            for stage_name, seconds in trace.stages:
+                STAGE_SECONDS.observe(seconds, endpoint, stage_name)
+            if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+                logger.warning(f"Slow request {scope['method']} {endpoint} {status} "
+                               f"{elapsed * 1000:.1f}ms [{trace.server_timing()}]")
+
+def _endpoint(scope):
+    """
+    Route template (e.g. /api/audio/{filename}) so labels stay low-cardinality.
+    """
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01, max_depth=64):
+        """
+        Low-overhead statistical profiler for all Python threads.
+
+        A daemon thread wakes every interval seconds, walks each thread's
+        current stack and counts it; the result is in the collapsed-stack
+        format understood by flamegraph tools.
+
+        :param interval: Seconds between samples
+        :param max_depth: Frames kept per stack, innermost first
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = StackCounter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _stack(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [
+                f'{names.get(thread_id, thread_id)};{self._stack(frame)}'
+                for thread_id, frame in sys._current_frames().items()
+                if thread_id != own_id
+            ]
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def collapsed(self):
+        """
+        Sampled stacks as 'frame;frame;frame count' lines, most frequent first.
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return '\n'.join(f'{stack} {count}' for stack, count in stacks) + '\n'
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
+        logger.info(f"Wrote {self.samples} profiler samples to {path}")
+
+def profiler_from_env():
+    """
+    Start a SamplingProfiler if PROFILE_SAMPLING_INTERVAL (seconds) is set, else return None.
+    """
+    interval = os.getenv("PROFILE_SAMPLING_INTERVAL")
+    if not interval:
+        return None
+    logger.info(f"Sampling profiler enabled every {interval}s")
+    return SamplingProfiler(interval=float(interval)).start()
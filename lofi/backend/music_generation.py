@@ -1,73 +1,240 @@
-from huggingface_hub import HfApi, hf_hub_download
 import os
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import json
+import hashlib
+import tempfile
+import threading
 import numpy as np
 import logging
-import pandas as pd
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DATASET_REPO = "vikhyatk/lofi"
+STATIC_PROMPTS_FILE = "data/static-prompts-022ecf03-24a6-4b73-a2bf-063928125f48.parquet"
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# Bump when the artifact layout changes so stale files are rebuilt
+ARTIFACT_VERSION = 2
+
+# Written by download.py next to the audio files: row id -> {"file": ..., "sha256": ...}
+AUDIO_MANIFEST = 'manifest.json'
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+def _file_sha256(path):
+    """Hash a file in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_atomic(path, write):
+    """Write a file via a temporary file and rename so readers never see partial data"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def artifact_paths(artifact_dir, dataset_sha256, model_name):
+    """Return the (.npy, .json) paths of the embedding artifact for a dataset file and model"""
+    model_slug = model_name.replace('/', '--')
+    base = os.path.join(artifact_dir, f"static-prompts-v{ARTIFACT_VERSION}-{model_slug}-{dataset_sha256[:16]}")
+    return f"{base}.npy", f"{base}.json"
+
 class LofiMusicGenerator:
-    def __init__(self):
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        self.api = HfApi()
+    def __init__(self, model_name=EMBEDDING_MODEL, artifact_dir=None, audio_dir=None):
+        self.model_name = model_name
+        self.artifact_dir = artifact_dir or os.getenv("EMBEDDING_ARTIFACT_DIR", "embedding_cache")
+        self.audio_dir = audio_dir or os.getenv("AUDIO_DIR", "downloaded_audio")
+        self._model = None
+        self._api = None
         self.static_prompts = []
+        self.static_ids = []
+        # Row i of prompt_embeddings <-> static_ids[i], static_prompts[i], audio_files[i]
+        self.audio_files = []
+        self.has_audio = np.zeros(0, dtype=bool)
         self.dynamic_prompts = []
         self.prompt_embeddings = None
-        self._load_dataset()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """Sentence embedding model, loaded on first use and shared with the rest of the process"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from .embeddings import get_embedding_model
+                    self._model = get_embedding_model(self.model_name)
+        return self._model
+
+    @property
+    def api(self):
+        """Hugging Face Hub API client, created on first use"""
+        if self._api is None:
+            from huggingface_hub import HfApi
+            self._api = HfApi()
+        return self._api
+
+    def _ensure_loaded(self):
+        """Load the prompt table and embeddings once, on first use"""
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self._load_dataset()
+                    self._loaded = True
+
+    def _dataset_file(self):
+        """Resolve the static prompts parquet, preferring the local Hugging Face cache"""
+        from huggingface_hub import hf_hub_download
+        
+        try:
+            return hf_hub_download(
+                repo_id=DATASET_REPO,
+                filename=STATIC_PROMPTS_FILE,
+                repo_type="dataset",
+                local_files_only=True
+            )
+        except Exception:
+            return hf_hub_download(
+                repo_id=DATASET_REPO,
+                filename=STATIC_PROMPTS_FILE,
+                repo_type="dataset"
+            )
+
+    def _load_artifact(self, npy_path, json_path, dataset_sha256):
+        """Memory-map a previously built artifact, or return False if it is missing or stale"""
+        try:
+            with open(json_path) as f:
+                sidecar = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if (sidecar.get('version') != ARTIFACT_VERSION
+                or sidecar.get('model') != self.model_name
+                or sidecar.get('dataset_sha256') != dataset_sha256):
+            return False
+        try:
+            embeddings = np.load(npy_path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return False
+        if embeddings.shape[0] != len(sidecar['prompts']):
+            return False
+        self.prompt_embeddings = embeddings
+        self.static_prompts = sidecar['prompts']
+        self.static_ids = sidecar['ids']
+        return True
+
+    def _build_artifact(self, static_file, npy_path, json_path, dataset_sha256):
+        """Encode the dataset prompts and persist them as a versioned artifact"""
+        import pandas as pd
+        
+        # Load static prompts
+        df_static = pd.read_parquet(static_file)
+        prompts = df_static['prompt'].tolist()
+        if 'id' in df_static.columns:
+            ids = df_static['id'].astype(str).tolist()
+        else:
+            # Row positions rarely match the ids download.py writes to the audio manifest
+            logger.warning(f"{STATIC_PROMPTS_FILE} has no 'id' column; using row positions as ids, "
+                           f"so prompts may not match the audio in {AUDIO_MANIFEST}")
+            ids = [str(i) for i in range(len(prompts))]
+        
+        # Create normalized embeddings so similarity is a plain dot product
+        logger.info(f"Creating embeddings for {len(prompts)} prompts")
+        embeddings = np.ascontiguousarray(
+            self.model.encode(prompts, normalize_embeddings=True),
+            dtype=np.float32
+        )
+        
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        _write_atomic(npy_path, lambda f: np.save(f, embeddings))
+        sidecar = {
+            'version': ARTIFACT_VERSION,
+            'model': self.model_name,
+            'dataset_file': STATIC_PROMPTS_FILE,
+            'dataset_sha256': dataset_sha256,
+            'prompts': prompts,
+            'ids': ids
+        }
+        _write_atomic(json_path, lambda f: f.write(json.dumps(sidecar).encode('utf-8')))
+        logger.info(f"Saved embedding artifact to {npy_path}")
 
     def _load_dataset(self):
-        """Load and cache the dataset prompts"""
+        """Load the dataset prompts and their embeddings, rebuilding the artifact only when inputs change"""
         try:
             # Load a few static prompt files for quick testing
             # In production, you'd want to load all files
-            static_file = hf_hub_download(
-                repo_id="vikhyatk/lofi",
-                filename="data/static-prompts-022ecf03-24a6-4b73-a2bf-063928125f48.parquet",
-                repo_type="dataset"
-            )
+            static_file = self._dataset_file()
+            dataset_sha256 = _file_sha256(static_file)
+            npy_path, json_path = artifact_paths(self.artifact_dir, dataset_sha256, self.model_name)
             
-            # Load static prompts
-            df_static = pd.read_parquet(static_file)
-            self.static_prompts = df_static['prompt'].tolist()
-            
-            # Create embeddings
-            logger.info(f"Creating embeddings for {len(self.static_prompts)} prompts")
-            self.prompt_embeddings = self.model.encode(self.static_prompts)
+            if not self._load_artifact(npy_path, json_path, dataset_sha256):
+                self._build_artifact(static_file, npy_path, json_path, dataset_sha256)
+                self._load_artifact(npy_path, json_path, dataset_sha256)
+            self._map_audio_files()
+            logger.info(f"Loaded {len(self.static_prompts)} prompt embeddings, "
+                        f"{int(self.has_audio.sum())} with local audio")
             
         except Exception as e:
             logger.error(f"Error loading dataset: {str(e)}")
             raise
 
+    def _map_audio_files(self):
+        """Line up a local audio file name with every prompt row, using the download manifest"""
+        manifest_path = os.path.join(self.audio_dir, AUDIO_MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        
+        audio_files = []
+        for track_id in self.static_ids:
+            entry = manifest.get(track_id)
+            filename = entry['file'] if entry else None
+            if filename and not os.path.exists(os.path.join(self.audio_dir, filename)):
+                filename = None
+            audio_files.append(filename)
+        self.audio_files = audio_files
+        self.has_audio = np.array([filename is not None for filename in audio_files], dtype=bool)
+        if self.static_ids and not self.has_audio.any():
+            logger.error(f"None of the {len(self.static_ids)} prompts has a local audio file listed in "
+                         f"{manifest_path}; run python -m backend.download to fetch the tracks")
+
     def find_closest_match(self, prompt):
         """Find the closest matching prompt in the dataset"""
         try:
-            # Generate embedding for input prompt
-            prompt_embedding = self.model.encode([prompt])[0]
+            self._ensure_loaded()
+            
+            # Generate normalized embedding for input prompt
+            prompt_embedding = self.model.encode([prompt], normalize_embeddings=True)[0]
             
-            # Reshape for sklearn
-            prompt_embedding = prompt_embedding.reshape(1, -1)
+            # Cosine similarity of unit vectors is a single matrix-vector product
+            similarities = self.prompt_embeddings @ prompt_embedding.astype(np.float32)
             
-            # Calculate similarities
-            similarities = cosine_similarity(
-                prompt_embedding,
-                self.prompt_embeddings
-            )[0]
+            # Only rows with a playable file can be served
+            if self.has_audio.any():
+                similarities = np.where(self.has_audio, similarities, -np.inf)
             
             # Get best match
-            best_match_idx = np.argmax(similarities)
-            best_match_score = similarities[best_match_idx]
+            best_match_idx = int(np.argmax(similarities))
+            best_match_score = float(similarities[best_match_idx])
             matched_prompt = self.static_prompts[best_match_idx]
             
             logger.info(f"Best match score: {best_match_score}")
             logger.info(f"Matched prompt: {matched_prompt}")
             
-            # For now, return a standard filename since we need to map between prompts and audio files
             return {
-                'file_path': 'lofi_track_001.mp3',  # This would come from your prompt-to-audio mapping
+                'id': self.static_ids[best_match_idx],
+                'file_path': self.audio_files[best_match_idx],
                 'prompt': matched_prompt,
                 'score': best_match_score
             }
@@ -76,23 +243,37 @@ class LofiMusicGenerator:
             logger.error(f"Error finding match: {str(e)}")
             raise
 
-    def get_audio(self, file_path):
-        """Get the audio file from the dataset"""
+    def get_audio(self, file_path, chunk_size=AUDIO_CHUNK_SIZE):
+        """Open a track from the local audio store and return an iterator over its bytes"""
         try:
-            # For now, return a dummy audio buffer since we need the actual audio files
-            # In production, this would download and return the actual audio file
-            logger.info(f"Would fetch audio file: {file_path}")
-            return bytes([0] * 44100)  # 1 second of silence as dummy data
-                
+            if not file_path:
+                raise FileNotFoundError("Matched track has no local audio file")
+            
+            # Only bare file names inside the audio store are served
+            path = os.path.join(self.audio_dir, os.path.basename(file_path))
+            
+            # Open eagerly so a missing file fails here rather than mid-stream
+            f = open(path, 'rb')
+            
         except Exception as e:
             logger.error(f"Error getting audio: {str(e)}")
             raise
+        
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        
+        return chunks()
 
-# Global instance
+# Global instance; the model and embeddings load on first use
 generator = LofiMusicGenerator()
 
 def generate_music(prompt):
-    """Main function to generate/retrieve music based on prompt"""
+    """Main function to generate/retrieve music based on prompt; returns an iterator of audio bytes"""
     try:
         logger.info(f"Processing prompt: {prompt}")
         
@@ -100,11 +281,8 @@ def generate_music(prompt):
         match = generator.find_closest_match(prompt)
         logger.info(f"Found matching track: {match['file_path']}")
         
-        # Get the audio data
-        audio_data = generator.get_audio(match['file_path'])
-        logger.info(f"Retrieved audio data: {len(audio_data)} bytes")
-        
-        return audio_data
+        # Stream the audio data, e.g. StreamingResponse(generate_music(prompt), media_type="audio/mpeg")
+        return generator.get_audio(match['file_path'])
         
     except Exception as e:
         logger.error(f"Error in generate_music: {str(e)}")
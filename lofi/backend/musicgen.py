@@ -0,0 +1,426 @@
+import hashlib
+import logging
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+from .concurrency import PoolSaturatedError
+
+logger = logging.getLogger(__name__)
+
+MUSICGEN_MODEL = "facebook/musicgen-small"
+DEFAULT_MAX_NEW_TOKENS = 256
+
+# MusicGen emits 50 token frames per second, so 50 steps is roughly one second of audio
+DEFAULT_PLAY_STEPS = 50
+
+# Sentinel data size for a WAV whose length is unknown when the header is sent
+STREAMING_WAV_SIZE = 0xFFFFFFFF
+
+def wav_header(sampling_rate, channels=1, bits_per_sample=16, data_size=None):
+    """
+    RIFF/WAVE header for 16-bit PCM; an unknown length uses the streaming sentinel.
+    """
+    block_align = channels * bits_per_sample // 8
+    if data_size is None:
+        data_size = STREAMING_WAV_SIZE - 36
+    riff_size = min(data_size + 36, STREAMING_WAV_SIZE)
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sampling_rate,
+                                sampling_rate * block_align, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+def to_pcm16(audio):
+    """
+    Convert float audio in [-1, 1] to little-endian 16-bit PCM bytes.
+    """
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+def _make_streamer(model, play_steps, on_audio):
+    """
+    Build a transformers streamer that decodes audio every play_steps tokens.
+
+    Tokens are cached as they are generated; every play_steps steps the
+    codebook delay pattern is undone, the cache is decoded with the audio
+    encoder and the not-yet-emitted samples (minus a stride kept back for
+    overlap) are passed to on_audio. end() flushes the remainder.
+    """
+    import torch
+    from transformers.generation.streamers import BaseStreamer
+
+    decoder = model.decoder
+    audio_encoder = model.audio_encoder
+    generation_config = model.generation_config
+    hop_length = int(np.prod(audio_encoder.config.upsampling_ratios))
+    stride = hop_length * (play_steps - decoder.num_codebooks) // 6
+
+    class AudioSegmentStreamer(BaseStreamer):
+        def __init__(self):
+            self.token_cache = None
+            self.emitted = 0
+
+        def _decode(self):
+            input_ids = self.token_cache
+            _, delay_pattern_mask = decoder.build_delay_pattern_mask(
+                input_ids[:, :1],
+                pad_token_id=generation_config.decoder_start_token_id,
+                max_length=input_ids.shape[-1],
+            )
+            input_ids = decoder.apply_delay_pattern_mask(input_ids, delay_pattern_mask)
+            input_ids = input_ids[input_ids != generation_config.pad_token_id].reshape(
+                1, decoder.num_codebooks, -1
+            )
+            input_ids = input_ids[None, ...].to(audio_encoder.device)
+            output_values = audio_encoder.decode(input_ids, audio_scales=[None])
+            return output_values.audio_values[0, 0].cpu().float().numpy()
+
+        def put(self, value):
+            if value.shape[0] // decoder.num_codebooks > 1:
+                raise ValueError("Streaming generation supports a single prompt")
+            if self.token_cache is None:
+                self.token_cache = value
+            else:
+                self.token_cache = torch.cat([self.token_cache, value[:, None]], dim=-1)
+            if self.token_cache.shape[-1] % play_steps == 0:
+                audio = self._decode()
+                end = len(audio) - stride
+                if end > self.emitted:
+                    on_audio(audio[self.emitted:end])
+                    self.emitted = end
+
+        def end(self):
+            if self.token_cache is not None:
+                audio = self._decode()
+                if len(audio) > self.emitted:
+                    on_audio(audio[self.emitted:])
+
+    return AudioSegmentStreamer()
+
+class _SlotIterator:
+    """
+    Iterator that releases a concurrency slot exactly once when it is exhausted,
+    closed or garbage collected, even if iteration never started.
+    """
+    def __init__(self, iterator, release):
+        self._iterator = iterator
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._iterator.close()
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __del__(self):
+        self.close()
+
+class _GenerationRequest:
+    def __init__(self, key, prompt, seed, max_new_tokens, future):
+        self.key = key
+        self.prompt = prompt
+        self.seed = seed
+        self.max_new_tokens = max_new_tokens
+        self.future = future
+
+    @property
+    def group(self):
+        """Requests can share a generate() call only if they match on this; seeded ones share with none"""
+        return (self.max_new_tokens,) if self.seed is None else (self.seed, self.max_new_tokens, self.key)
+
+class MusicGenService:
+    def __init__(self, model_name=MUSICGEN_MODEL, output_dir='generated_audio',
+                 max_batch_size=4, batch_window=0.05, max_pending=32, max_streams=2):
+        """
+        Long-lived MusicGen generator that loads the model once.
+
+        Requests are queued and a single worker thread batches unseeded
+        prompts of the same length into one generate() call. Results are
+        cached on disk by (prompt, seed, length), so a repeated request returns
+        the existing file without generating again.
+
+        generate() samples every row of a batch from one global RNG, so a
+        batched clip depends on its batch-mates and is not reproducible. A
+        request with an explicit seed is therefore generated alone, and its
+        clip is the same however it was requested.
+
+        :param model_name: Hugging Face model id
+        :param output_dir: Directory for generated WAV files
+        :param max_batch_size: Maximum prompts per generate() call
+        :param batch_window: Seconds to wait for more prompts to join a batch
+        :param max_pending: Queued requests allowed before submit() rejects new ones
+        :param max_streams: Concurrent streaming generations allowed
+        """
+        self.model_name = model_name
+        self.output_dir = output_dir
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_pending = max_pending
+        self.model = None
+        self.processor = None
+        self.sampling_rate = None
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._load_lock = threading.Lock()
+        # One generate() at a time; concurrent CPU generations only slow each other down
+        self._generate_lock = threading.Lock()
+        self._stream_slots = threading.BoundedSemaphore(max_streams)
+
+    def cache_key(self, prompt, seed, max_new_tokens):
+        normalized = ' '.join(prompt.split())
+        payload = f"{self.model_name}\n{'unseeded' if seed is None else seed}\n{max_new_tokens}\n{normalized}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def output_path(self, key):
+        return os.path.join(self.output_dir, f"{key}.wav")
+
+    def load(self):
+        """
+        Load the processor and model once.
+        """
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
+            from transformers import AutoProcessor, MusicgenForConditionalGeneration
+
+            start = time.perf_counter()
+            self.processor = AutoProcessor.from_pretrained(self.model_name)
+            model = MusicgenForConditionalGeneration.from_pretrained(self.model_name)
+            model.eval()
+            self.sampling_rate = model.config.audio_encoder.sampling_rate
+            self.model = model
+            logger.info(f"Loaded {self.model_name} in {time.perf_counter() - start:.1f}s")
+
+    def submit(self, prompt, seed=None, max_new_tokens=DEFAULT_MAX_NEW_TOKENS):
+        """
+        Queue a generation and return a Future for the WAV path.
+
+        Identical in-flight requests share one Future.
+
+        :raises PoolSaturatedError: If max_pending requests are already queued
+        """
+        key = self.cache_key(prompt, seed, max_new_tokens)
+        path = self.output_path(key)
+        if os.path.exists(path):
+            future = Future()
+            future.set_result(path)
+            return future
+
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            if len(self._pending) >= self.max_pending:
+                raise PoolSaturatedError("music generation queue is full")
+            future = Future()
+            self._pending[key] = future
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='musicgen', daemon=True)
+                self._worker.start()
+        self._queue.put(_GenerationRequest(key, prompt, seed, max_new_tokens, future))
+        return future
+
+    def generate(self, prompt, seed=None, max_new_tokens=DEFAULT_MAX_NEW_TOKENS, timeout=None):
+        """
+        Generate (or fetch from cache) audio for a prompt and return the WAV path.
+        """
+        return self.submit(prompt, seed, max_new_tokens).result(timeout=timeout)
+
+    def _next_batch(self, deferred):
+        """
+        Take the oldest request plus up to max_batch_size - 1 more it can share a generate() call with.
+
+        Requests that cannot join are kept in deferred, in arrival order.
+        """
+        first = deferred.pop(0) if deferred else self._queue.get()
+        batch = [first]
+        if first.seed is not None:
+            return batch
+        for request in list(deferred):
+            if len(batch) == self.max_batch_size:
+                break
+            if request.group == first.group:
+                deferred.remove(request)
+                batch.append(request)
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            # Only unseeded prompts of the same length can share a generate() call
+            if request.group == first.group:
+                batch.append(request)
+            else:
+                deferred.append(request)
+        return batch
+
+    def _run(self):
+        deferred = []
+        while True:
+            batch = self._next_batch(deferred)
+            try:
+                self.load()
+                paths = self._generate_batch(batch)
+                for request, path in zip(batch, paths):
+                    request.future.set_result(path)
+            except Exception as e:
+                logger.error(f"Music generation failed: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+            finally:
+                with self._lock:
+                    for request in batch:
+                        self._pending.pop(request.key, None)
+
+    def _generate_batch(self, batch):
+        # generate() samples every row from the one global RNG, so only a batch of one can be seeded
+        seed, max_new_tokens = batch[0].seed, batch[0].max_new_tokens
+        if any(request.group != batch[0].group for request in batch[1:]):
+            raise ValueError("Seeded requests and requests of different lengths cannot share a generate() call")
+
+        import torch
+        import scipy.io.wavfile
+
+        inputs = self.processor(
+            text=[request.prompt for request in batch],
+            padding=True,
+            return_tensors="pt",
+        )
+        start = time.perf_counter()
+        with self._generate_lock, torch.inference_mode():
+            if seed is not None:
+                torch.manual_seed(seed)
+            audio_values = self.model.generate(**inputs, do_sample=True, max_new_tokens=max_new_tokens)
+        logger.info(f"Generated {len(batch)} clip(s) in {time.perf_counter() - start:.1f}s")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        paths = []
+        for request, audio in zip(batch, audio_values):
+            path = self.output_path(request.key)
+            fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, suffix='.tmp')
+            os.close(fd)
+            scipy.io.wavfile.write(tmp_path, rate=self.sampling_rate, data=audio[0].cpu().numpy())
+            os.replace(tmp_path, path)
+            paths.append(path)
+        return paths
+
+    def stream_wav(self, prompt, seed=None, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+                   play_steps=DEFAULT_PLAY_STEPS, chunk_size=64 * 1024):
+        """
+        Generate audio incrementally and return an iterator of WAV bytes.
+
+        The first segment is available after play_steps tokens instead of the
+        full max_new_tokens run. A cached clip is streamed from disk, and a
+        completed streaming run is written to the cache.
+
+        :raises PoolSaturatedError: If max_streams generations are already streaming
+        """
+        key = self.cache_key(prompt, seed, max_new_tokens)
+        path = self.output_path(key)
+        if os.path.exists(path):
+            return self._stream_file(path, chunk_size)
+        if not self._stream_slots.acquire(blocking=False):
+            raise PoolSaturatedError("too many streaming generations")
+        return _SlotIterator(
+            self._stream_generation(key, prompt, seed, max_new_tokens, play_steps),
+            self._stream_slots.release
+        )
+
+    def _stream_file(self, path, chunk_size):
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _stream_generation(self, key, prompt, seed, max_new_tokens, play_steps):
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        segments = queue.Queue()
+        cancelled = threading.Event()
+        finished = object()
+
+        class StopWhenCancelled(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return cancelled.is_set()
+
+        def run():
+            try:
+                self.load()
+                inputs = self.processor(text=[prompt], padding=True, return_tensors="pt")
+                streamer = _make_streamer(self.model, play_steps, segments.put)
+                with self._generate_lock, torch.inference_mode():
+                    if seed is not None:
+                        torch.manual_seed(seed)
+                    self.model.generate(
+                        **inputs,
+                        do_sample=True,
+                        max_new_tokens=max_new_tokens,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([StopWhenCancelled()])
+                    )
+                segments.put(finished)
+            except Exception as e:
+                logger.error(f"Streaming generation failed: {e}")
+                segments.put(e)
+
+        try:
+            thread = threading.Thread(target=run, name='musicgen-stream', daemon=True)
+            thread.start()
+
+            pcm = []
+            header_sent = False
+            while True:
+                segment = segments.get()
+                if segment is finished:
+                    break
+                if isinstance(segment, Exception):
+                    raise segment
+                if not header_sent:
+                    yield wav_header(self.sampling_rate)
+                    header_sent = True
+                data = to_pcm16(segment)
+                pcm.append(data)
+                yield data
+
+            if not header_sent:
+                yield wav_header(self.sampling_rate, data_size=0)
+            self._save_stream(key, pcm)
+        finally:
+            # Runs on completion, error, or when the client goes away mid-stream
+            cancelled.set()
+
+    def _save_stream(self, key, pcm):
+        data = b''.join(pcm)
+        os.makedirs(self.output_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(wav_header(self.sampling_rate, data_size=len(data)))
+            f.write(data)
+        os.replace(tmp_path, self.output_path(key))
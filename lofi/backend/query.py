@@ -1,26 +1,830 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
+import itertools
+import logging
 import os
+import threading
+import numpy as np
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+
+from .text_index import PromptIndex
+from .ivf import IVFIndex, ids_fingerprint, list_count
+from .shared import catalog_version_path, read_catalog_version, read_snapshot, snapshot_lock, write_snapshot
+from .metrics import stage
+from .features import AudioFeatureIndex
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(query):
+    """
+    Normalize query text so trivially different spellings share cache entries.
+    
+    The MiniLM tokenizer is uncased, so lowercasing does not change the embedding.
+    """
+    return ' '.join(query.lower().split())
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping that evicts the least recently used entry.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent encode requests into a single model call.
+    
+    Callers block on encode() while a background thread gathers requests that
+    arrive within max_wait seconds (or until max_batch_size is reached) and
+    embeds them together.
+    """
+    def __init__(self, model, max_batch_size=32, max_wait=0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._worker.start()
+
+    def encode(self, text):
+        """
+        Embed a single text, sharing the model call with concurrent callers.
+        
+        :param text: Text to embed
+        :return: Embedding as a NumPy array
+        """
+        future = Future()
+        with self._condition:
+            self._pending.append((text, future))
+            self._condition.notify()
+        return future.result()
+
+    def encode_many(self, texts):
+        """
+        Embed several texts, queued together so they share as few model calls as possible.
+        
+        :param texts: Texts to embed
+        :return: List of embeddings aligned with texts
+        """
+        futures = [Future() for _ in texts]
+        with self._condition:
+            self._pending.extend(zip(texts, futures))
+            self._condition.notify()
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = self.model.encode(texts, batch_size=len(texts))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            by_text = dict(zip(texts, embeddings))
+            for text, future in batch:
+                future.set_result(by_text[text])
+
+def _normalize_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def _top_k_results(ids, metadatas, scores, n_results):
+    """
+    Turn a (queries x rows) cosine score matrix into Chroma-style results.
+    
+    Distances are squared L2 between unit vectors (2 - 2 * cosine), the same
+    scale Chroma reports for its default space.
+    """
+    results = {'ids': [], 'metadatas': [], 'distances': []}
+    k = min(n_results, len(ids))
+    if k == 0:
+        for _ in range(len(scores)):
+            results['ids'].append([])
+            results['metadatas'].append([])
+            results['distances'].append([])
+        return results
+    
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), (len(scores), scores.shape[1]))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    
+    for row, row_scores in zip(top, top_scores):
+        results['ids'].append([ids[i] for i in row])
+        results['metadatas'].append([metadatas[i] for i in row])
+        results['distances'].append([float(d) for d in 2.0 - 2.0 * row_scores])
+    return results
+
+class ChromaSearchBackend:
+    """
+    Search backend that delegates nearest-neighbour lookups to ChromaDB.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def load(self):
+        """
+        Nothing to load: Chroma always reads the current collection state.
+        """
+
+    def upsert(self, ids, embeddings, metadatas):
+        """
+        Nothing to update: rows are written to the collection by the caller.
+        """
+
+    def search(self, query_embeddings, n_results, candidate_ids=None):
+        """
+        Find the nearest tracks for each query embedding.
+        
+        :param query_embeddings: Sequence of query vectors
+        :param n_results: Number of results per query
+        :param candidate_ids: Optional ids to restrict the search to
+        :return: Chroma-style results dict with per-query lists
+        """
+        if candidate_ids is not None:
+            # Rank the (small) candidate set locally instead of a filtered HNSW query
+            data = self.collection.get(ids=list(candidate_ids), include=['embeddings', 'metadatas'])
+            embeddings = np.asarray(data['embeddings'], dtype=np.float32).reshape(len(data['ids']), -1)
+            queries = _normalize_rows(query_embeddings)
+            scores = queries @ _normalize_rows(embeddings).T if len(data['ids']) else np.zeros((len(queries), 0))
+            return _top_k_results(data['ids'], data['metadatas'], scores, n_results)
+        return self.collection.query(
+            query_embeddings=[list(map(float, embedding)) for embedding in query_embeddings],
+            n_results=n_results
+        )
+
+class NumpySearchBackend:
+    """
+    Exact in-memory search over a contiguous matrix of normalized embeddings.
+    
+    All rows are loaded once, L2-normalized and stored as float32, float16 or
+    int8 (symmetric per-row scale). A query is answered with a single matmul
+    followed by argpartition. Distances use the same scale as Chroma.
+    """
+    SUPPORTED_DTYPES = ('float32', 'float16', 'int8')
+
+    # Rows converted to float32 at a time for the compressed dtypes
+    BLOCK_SIZE = 8192
+
+    def __init__(self, collection, dtype='float32'):
+        if dtype not in self.SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype!r}, expected one of {self.SUPPORTED_DTYPES}")
+        self.collection = collection
+        self.dtype = dtype
+        self.ids = []
+        self.metadatas = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.scales = None
+        self.load()
+
+    def load(self):
+        """
+        (Re)load every embedding and metadata dict from the collection.
+        """
+        data = self.collection.get(include=['embeddings', 'metadatas'])
+        embeddings = np.asarray(data['embeddings'], dtype=np.float32)
+        self._set_rows(list(data['ids']), list(data['metadatas']), embeddings)
+
+    def _set_rows(self, ids, metadatas, embeddings):
+        if embeddings.size:
+            embeddings = _normalize_rows(embeddings)
+        matrix, scales = self._encode(embeddings)
+        self._swap(ids, metadatas, matrix, scales)
+
+    def _swap(self, ids, metadatas, matrix, scales):
+        positions = {track_id: i for i, track_id in enumerate(ids)}
+        # Swap all fields together so concurrent searches see a consistent snapshot
+        self._snapshot = (ids, metadatas, matrix, scales, positions)
+        self.ids, self.metadatas, self.matrix, self.scales, _ = self._snapshot
+
+    def upsert(self, ids, embeddings, metadatas):
+        """
+        Insert or replace rows in the in-memory index without reloading it.
+        
+        :param ids: Track ids
+        :param embeddings: Embeddings aligned with ids
+        :param metadatas: Metadata dicts aligned with ids
+        """
+        old_ids, old_metadatas, matrix, scales, positions = self._snapshot
+        encoded, encoded_scales = self._encode(_normalize_rows(embeddings))
+        new_ids = list(old_ids)
+        new_metadatas = list(old_metadatas)
+        matrix = matrix.copy()
+        scales = scales.copy() if scales is not None else None
+        appended = []
+        for i, (track_id, metadata) in enumerate(zip(ids, metadatas)):
+            if track_id in positions:
+                row = positions[track_id]
+                matrix[row] = encoded[i]
+                if scales is not None:
+                    scales[row] = encoded_scales[i]
+                new_metadatas[row] = metadata
+            else:
+                appended.append(i)
+                new_ids.append(track_id)
+                new_metadatas.append(metadata)
+        if appended:
+            matrix = np.concatenate([matrix.reshape(-1, encoded.shape[1]), encoded[appended]])
+            if scales is not None:
+                scales = np.concatenate([scales, encoded_scales[appended]])
+        self._swap(new_ids, new_metadatas, np.ascontiguousarray(matrix), scales)
+
+    def _encode(self, embeddings):
+        if self.dtype == 'float32':
+            return np.ascontiguousarray(embeddings, dtype=np.float32), None
+        if self.dtype == 'float16':
+            return np.ascontiguousarray(embeddings, dtype=np.float16), None
+        max_abs = np.abs(embeddings).max(axis=1) if embeddings.size else np.zeros(0, dtype=np.float32)
+        scales = (np.maximum(max_abs, 1e-12) / 127.0).astype(np.float32)
+        quantized = np.round(embeddings / scales[:, None]) if embeddings.size else embeddings
+        return np.ascontiguousarray(quantized, dtype=np.int8), scales
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the embedding matrix (and int8 scales).
+        """
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _scores(self, matrix, scales, queries):
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+        scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), self.BLOCK_SIZE):
+            block = matrix[start:start + self.BLOCK_SIZE].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def search(self, query_embeddings, n_results, candidate_ids=None):
+        """
+        Find the nearest tracks for each query embedding.
+        
+        :param query_embeddings: Sequence or 2-D array of query vectors
+        :param n_results: Number of results per query
+        :param candidate_ids: Optional ids to restrict the search to
+        :return: Chroma-style results dict with per-query lists
+        """
+        ids, metadatas, matrix, scales, positions = self._snapshot
+        queries = _normalize_rows(query_embeddings)
+        
+        if candidate_ids is not None:
+            rows = np.fromiter((positions[i] for i in candidate_ids if i in positions), dtype=np.int64)
+            ids = [ids[row] for row in rows]
+            metadatas = [metadatas[row] for row in rows]
+            matrix = matrix[rows]
+            scales = scales[rows] if scales is not None else None
+        
+        if not len(ids):
+            return _top_k_results(ids, metadatas, np.zeros((len(queries), 0), dtype=np.float32), n_results)
+        return _top_k_results(ids, metadatas, self._scores(matrix, scales, queries), n_results)
+
+class SharedSearchBackend(NumpySearchBackend):
+    """
+    Exact search over a snapshot that every worker process maps read-only.
+    
+    The first process to find the snapshot missing or stale builds it under a
+    file lock; the others wait and then attach. The matrix lives in the page
+    cache once, however many workers serve from it. An upsert gives this
+    process a private copy until the next reload attaches to a fresh snapshot.
+    """
+    def __init__(self, collection, directory, dtype='float32', revision=None):
+        self.directory = directory
+        self.revision = revision
+        super().__init__(collection, dtype=dtype)
+
+    def load(self):
+        """
+        Attach to the snapshot for the collection's current ids, building it if needed.
+        """
+        fingerprint = ids_fingerprint(self.collection.get(include=[])['ids'], self.revision)
+        snapshot = read_snapshot(self.directory, fingerprint, self.dtype)
+        if snapshot is None:
+            with snapshot_lock(self.directory):
+                snapshot = read_snapshot(self.directory, fingerprint, self.dtype)
+                if snapshot is None:
+                    data = self.collection.get(include=['embeddings', 'metadatas'])
+                    embeddings = np.asarray(data['embeddings'], dtype=np.float32)
+                    matrix, scales = self._encode(_normalize_rows(embeddings) if embeddings.size else embeddings)
+                    write_snapshot(self.directory, fingerprint, self.dtype,
+                                   data['ids'], data['metadatas'], matrix, scales)
+                    snapshot = read_snapshot(self.directory, fingerprint, self.dtype)
+        self._swap(*snapshot)
+
+class IVFSearchBackend:
+    """
+    Approximate search over an inverted-file index with int8 codes (see ivf.py).
+    
+    The index is built from the collection on first load and saved under
+    index_dir; later loads memory-map it as long as the collection holds the
+    same ids. Rows upserted after the build are kept in a small exact buffer
+    that is searched alongside the index until the next rebuild.
+
+    Catalogs under EXACT_ROWS rows, or where n_probe would scan every list
+    anyway, skip the index and keep all rows in the exact buffer: at that size
+    an exhaustive float32 scan is cheap and never misses the true nearest track.
+    """
+    EXACT_ROWS = 20000
+
+    def __init__(self, collection, index_dir=None, n_lists=None, n_probe=8, revision=None):
+        """
+        :param collection: ChromaDB collection holding the embeddings
+        :param index_dir: Directory to persist the index in, or None to keep it in memory only
+        :param n_lists: Number of inverted lists (defaults to about 4 * sqrt(n))
+        :param n_probe: Lists scanned per query; higher is slower with better recall
+        :param revision: Catalog generation the saved index must match
+        """
+        self.collection = collection
+        self.index_dir = index_dir
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.revision = revision
+        self.load()
+
+    def load(self):
+        """
+        Open the saved index, rebuilding it if the collection's ids changed.
+        """
+        data = self.collection.get(include=['metadatas'])
+        n = len(data['ids'])
+        if n and (n < self.EXACT_ROWS or self.n_probe >= list_count(n, self.n_lists)):
+            full = self.collection.get(include=['embeddings', 'metadatas'])
+            vectors = _normalize_rows(full['embeddings'])
+            index = IVFIndex(np.zeros((0, vectors.shape[1]), dtype=np.float32),
+                             np.zeros((0, vectors.shape[1]), dtype=np.int8),
+                             np.zeros(0, dtype=np.float32), np.zeros(1, dtype=np.int64), [])
+            self._swap(index, [], frozenset(), full['ids'], full['metadatas'], vectors)
+            return
+        metadata_by_id = dict(zip(data['ids'], data['metadatas']))
+        fingerprint = ids_fingerprint(data['ids'], self.revision)
+        index = IVFIndex.load(self.index_dir, fingerprint, self.n_probe) if self.index_dir else None
+        if index is None and data['ids']:
+            full = self.collection.get(include=['embeddings'])
+            index = IVFIndex.build(full['ids'], full['embeddings'], self.n_lists, self.n_probe)
+            if self.index_dir:
+                index.save(self.index_dir, fingerprint)
+                index = IVFIndex.load(self.index_dir, fingerprint, self.n_probe)
+        if index is None:
+            index = IVFIndex(np.zeros((0, 0), dtype=np.float32), np.zeros((0, 0), dtype=np.int8),
+                             np.zeros(0, dtype=np.float32), np.zeros(1, dtype=np.int64), [])
+        metadatas = [metadata_by_id[track_id] for track_id in index.ids]
+        self._swap(index, metadatas, frozenset(), [], [], np.zeros((0, index.codes.shape[1]), dtype=np.float32))
+
+    def _swap(self, index, metadatas, superseded, extra_ids, extra_metadatas, extra_matrix):
+        positions = {track_id: row for row, track_id in enumerate(index.ids)}
+        extra_positions = {track_id: row for row, track_id in enumerate(extra_ids)}
+        # Swap all fields together so concurrent searches see a consistent snapshot
+        self._snapshot = (index, metadatas, positions, superseded, extra_ids, extra_metadatas, extra_matrix, extra_positions)
+        live = [row for row in range(len(index.ids)) if row not in superseded]
+        self.ids = [index.ids[row] for row in live] + list(extra_ids)
+        self.metadatas = [metadatas[row] for row in live] + list(extra_metadatas)
+
+    def upsert(self, ids, embeddings, metadatas):
+        """
+        Add or replace rows in the exact side buffer without touching the index.
+        """
+        index, index_metadatas, positions, superseded, extra_ids, extra_metadatas, extra_matrix, extra_positions = self._snapshot
+        vectors = _normalize_rows(embeddings)
+        superseded = set(superseded)
+        extra_ids = list(extra_ids)
+        extra_metadatas = list(extra_metadatas)
+        extra_matrix = extra_matrix.reshape(-1, vectors.shape[1]).copy()
+        appended = []
+        for i, (track_id, metadata) in enumerate(zip(ids, metadatas)):
+            if track_id in positions:
+                superseded.add(positions[track_id])
+            if track_id in extra_positions:
+                row = extra_positions[track_id]
+                extra_matrix[row] = vectors[i]
+                extra_metadatas[row] = metadata
+            else:
+                appended.append(i)
+                extra_ids.append(track_id)
+                extra_metadatas.append(metadata)
+        extra_matrix = np.concatenate([extra_matrix, vectors[appended]])
+        self._swap(index, index_metadatas, frozenset(superseded), extra_ids, extra_metadatas, extra_matrix)
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the index arrays (mapped pages included) and the side buffer.
+        """
+        return self._snapshot[0].nbytes + self._snapshot[6].nbytes
+
+    def search(self, query_embeddings, n_results, candidate_ids=None, n_probe=None):
+        """
+        Find the (approximately) nearest tracks for each query embedding.
+        
+        :param query_embeddings: Sequence or 2-D array of query vectors
+        :param n_results: Number of results per query
+        :param candidate_ids: Optional ids to restrict the search to; scored exactly
+        :param n_probe: Override the number of lists scanned
+        :return: Chroma-style results dict with per-query lists
+        """
+        index, metadatas, positions, superseded, extra_ids, extra_metadatas, extra_matrix, extra_positions = self._snapshot
+        queries = _normalize_rows(query_embeddings)
+        
+        if candidate_ids is not None:
+            index_rows = np.fromiter(
+                (positions[i] for i in candidate_ids if i in positions and positions[i] not in superseded),
+                dtype=np.int64
+            )
+            extra_rows = np.fromiter((extra_positions[i] for i in candidate_ids if i in extra_positions), dtype=np.int64)
+            candidates = [(index_rows, index.score_rows(query, index_rows)) for query in queries]
+        else:
+            extra_rows = np.arange(len(extra_ids))
+            if len(index):
+                # Over-fetch so rows replaced through upsert can be dropped
+                candidates = index.search(queries, n_results + len(superseded), n_probe or self.n_probe)
+            else:
+                candidates = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+        
+        results = {'ids': [], 'metadatas': [], 'distances': []}
+        extra_scores = queries @ extra_matrix[extra_rows].T if len(extra_rows) else np.zeros((len(queries), 0))
+        for query_index, (rows, scores) in enumerate(candidates):
+            keep = [i for i, row in enumerate(rows) if row not in superseded]
+            hits = [(float(scores[i]), index.ids[rows[i]], metadatas[rows[i]]) for i in keep]
+            hits.extend(
+                (float(score), extra_ids[row], extra_metadatas[row])
+                for row, score in zip(extra_rows, extra_scores[query_index])
+            )
+            hits.sort(key=lambda hit: -hit[0])
+            hits = hits[:n_results]
+            results['ids'].append([hit[1] for hit in hits])
+            results['metadatas'].append([hit[2] for hit in hits])
+            results['distances'].append([2.0 - 2.0 * hit[0] for hit in hits])
+        return results
+
+def create_search_backend(name, collection, dtype='float32', index_dir=None, n_lists=None, n_probe=8,
+                          revision=None):
+    """
+    Build a search backend by name.
+    
+    :param name: 'chroma', 'numpy', 'shared' or 'ivf'
+    :param collection: ChromaDB collection holding the embeddings
+    :param dtype: Matrix dtype for the numpy and shared backends
+    :param index_dir: Directory the shared and ivf backends persist their files in
+    :param n_lists: Number of inverted lists for the ivf backend
+    :param n_probe: Lists scanned per query by the ivf backend
+    :param revision: Catalog generation the persisted shared and ivf files must match
+    :return: Search backend instance
+    """
+    if name == 'chroma':
+        return ChromaSearchBackend(collection)
+    if name == 'numpy':
+        return NumpySearchBackend(collection, dtype=dtype)
+    if name == 'shared':
+        return SharedSearchBackend(collection, index_dir, dtype=dtype, revision=revision)
+    if name == 'ivf':
+        return IVFSearchBackend(collection, index_dir=index_dir, n_lists=n_lists, n_probe=n_probe,
+                                revision=revision)
+    raise ValueError(f"Unknown search backend {name!r}")
+
+# Seconds a replaced Chroma client stays open so requests still holding it can finish
+CHROMA_RETIRE_DELAY = 30.0
 
 class AudioQueryManager:
-    def __init__(self, db_path='./chroma_db', collection_name='audio'):
+    def __init__(self, db_path='./chroma_db', collection_name='audio',
+                 embedding_cache_size=1024, result_cache_size=256,
+                 batch_window=0.005, max_batch_size=32, version_check_interval=5.0,
+                 search_backend='chroma', backend_dtype='float32', features_path=None,
+                 embedding_model=None, index_dir=None, ivf_lists=None, ivf_probe=8):
         """
         Initialize ChromaDB client and load or create the audio prompts collection.
         
         :param db_path: Path to ChromaDB storage
         :param collection_name: Name of the collection to query
+        :param embedding_cache_size: Maximum number of cached query embeddings
+        :param result_cache_size: Maximum number of cached top-k result lists
+        :param batch_window: Seconds to wait for concurrent queries to share an encode call
+        :param max_batch_size: Maximum number of queries embedded together
+        :param version_check_interval: Seconds between checks for collection changes
+        :param search_backend: 'chroma' to query the collection, 'numpy' for the exact in-memory
+            index, 'shared' for the exact index mapped from a file shared by all workers,
+            'ivf' for the approximate quantized index
+        :param backend_dtype: Matrix dtype for the numpy backend (float32, float16 or int8)
+        :param features_path: Acoustic feature table written by features.py, without extension
+        :param embedding_model: Object with a SentenceTransformer-style encode(); defaults to the
+            process-wide MiniLM from embeddings.get_embedding_model()
+        :param index_dir: Where the shared and ivf backends keep their files
+            (defaults to <db_path>/<backend>_<collection>)
+        :param ivf_lists: Number of inverted lists for the ivf backend
+        :param ivf_probe: Lists scanned per query by the ivf backend
         """
         # Ensure the database directory exists
         os.makedirs(db_path, exist_ok=True)
+        self.db_path = db_path
+        self.collection_name = collection_name
+        
+        # Load embedding model (shared with the rest of the process)
+        if embedding_model is None:
+            from .embeddings import get_embedding_model
+            embedding_model = get_embedding_model()
+        self.embedding_model = embedding_model
+        
+        # Initialize ChromaDB client and get the collection
+        self._catalog_stamp = self._read_catalog_stamp()
+        self._chroma_slots = set()
+        self._chroma_slots_lock = threading.Lock()
+        self.chroma_client, self.collection, self._chroma_slot = self._open_collection()
+        
+        # Nearest-neighbour search backend
+        self._create_backend = partial(
+            create_search_backend, search_backend, dtype=backend_dtype,
+            index_dir=index_dir or os.path.join(db_path, f'{search_backend}_{collection_name}'),
+            n_lists=ivf_lists, n_probe=ivf_probe
+        )
+        self.search_backend = self._create_backend(self.collection, revision=self._catalog_revision())
+        
+        # Acoustic descriptors per audio file, used for re-ranking and "more like this"
+        self.feature_index = AudioFeatureIndex.load(features_path) if features_path else None
+        
+        # Inverted index over prompt text for keyword and substring filters
+        self.text_index, self._track_files, self._file_tracks = self._build_text_index(self.search_backend)
+        
+        # Query embedding and top-k result caches
+        self.embedding_cache = LRUCache(embedding_cache_size)
+        self.result_cache = LRUCache(result_cache_size)
+        self.batcher = EmbeddingBatcher(self.embedding_model, max_batch_size, batch_window)
+        
+        # Result cache entries are only valid for the collection version they were computed on
+        self.version_check_interval = version_check_interval
+        self._generation = 0
+        self._collection_version = None
+        self._version_checked_at = 0.0
+        self._version_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        # Size of the collection the indexes were built from, for databases without a version file
+        self._served_count = self.collection.count()
+
+    def embed_query(self, query):
+        """
+        Return the embedding for a query, using the cache and the micro-batcher.
+        
+        :param query: Text query to embed
+        :return: Embedding as a NumPy array
+        """
+        key = normalize_query(query)
+        embedding = self.embedding_cache.get(key)
+        if embedding is None:
+            with stage('embed'):
+                embedding = self.batcher.encode(key)
+            self.embedding_cache.put(key, embedding)
+        return embedding
+
+    def embed_queries(self, queries):
+        """
+        Return embeddings for several queries, encoding all cache misses together.
+        
+        :param queries: Text queries to embed
+        :return: 2-D array with one row per query
+        """
+        keys = [normalize_query(query) for query in queries]
+        embeddings = {}
+        misses = []
+        for key in dict.fromkeys(keys):
+            embedding = self.embedding_cache.get(key)
+            if embedding is None:
+                misses.append(key)
+            else:
+                embeddings[key] = embedding
+        if misses:
+            with stage('embed'):
+                encoded = self.batcher.encode_many(misses)
+            for key, embedding in zip(misses, encoded):
+                self.embedding_cache.put(key, embedding)
+                embeddings[key] = embedding
+        return np.stack([embeddings[key] for key in keys])
+
+    def _open_collection(self):
+        """
+        Create a ChromaDB client with a view of the database of its own.
         
-        # Initialize ChromaDB client
-        self.chroma_client = chromadb.PersistentClient(path=db_path)
+        chromadb shares one System, and with it one view of the database,
+        between all clients opened with the same path string. Every client open
+        here spells the path differently (db/., db/./., ...), and never as the
+        plain path other code uses, so a reload sees writes made elsewhere since
+        the previous client was opened.
         
-        # Load embedding model
-        self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+        :return: (client, collection, slot) where slot numbers the path spelling
+        """
+        # Heavy dependencies are imported here so importing this module stays cheap
+        import chromadb
         
-        # Get the collection
-        self.collection = self.chroma_client.get_collection(name=collection_name)
+        with self._chroma_slots_lock:
+            slot = next(i for i in itertools.count(1) if i not in self._chroma_slots)
+            self._chroma_slots.add(slot)
+        client = None
+        try:
+            client = chromadb.PersistentClient(path=os.path.join(self.db_path, *['.'] * slot))
+            return client, client.get_collection(name=self.collection_name), slot
+        except BaseException:
+            self._close_chroma_client(client, slot)
+            raise
+
+    def _close_chroma_client(self, client, slot):
+        """
+        Close a client (chromadb stops its System once no client uses it) and free its path spelling.
+        """
+        try:
+            if client is not None:
+                client.close()
+        finally:
+            with self._chroma_slots_lock:
+                self._chroma_slots.discard(slot)
+
+    def _retire_chroma_client(self, client, slot):
+        """
+        Close a replaced client once in-flight requests had time to finish.
+        """
+        timer = threading.Timer(CHROMA_RETIRE_DELAY, self._close_chroma_client, (client, slot))
+        timer.daemon = True
+        timer.start()
+
+    def _read_catalog_stamp(self):
+        try:
+            return os.stat(catalog_version_path(self.db_path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _catalog_revision(self):
+        record = read_catalog_version(self.db_path)
+        return record.get('generation') if record else None
+
+    def _build_text_index(self, search_backend, collection=None):
+        """
+        Build the prompt index and audio file maps, reusing metadata already loaded by the search backend.
+        
+        :return: (PromptIndex, track id -> file name, file name -> track id)
+        """
+        if hasattr(search_backend, 'metadatas'):
+            ids, metadatas = search_backend.ids, search_backend.metadatas
+        else:
+            data = (collection or self.collection).get(include=['metadatas'])
+            ids, metadatas = data['ids'], data['metadatas']
+        index = PromptIndex(field='prompt')
+        index.add(ids, metadatas)
+        track_files = {}
+        file_tracks = {}
+        self._map_audio_files(ids, metadatas, track_files, file_tracks)
+        return index, track_files, file_tracks
+
+    @staticmethod
+    def _map_audio_files(ids, metadatas, track_files, file_tracks):
+        """
+        Link track ids to the audio file names used as keys of the feature table.
+        """
+        for track_id, metadata in zip(ids, metadatas):
+            path = (metadata or {}).get('local_audio_path')
+            if path:
+                filename = os.path.basename(path)
+                track_files[track_id] = filename
+                file_tracks[filename] = track_id
+
+    def reload_catalog(self):
+        """
+        Reopen the database and swap in indexes built from its current contents.
+        
+        The new client, search backend and text index are built alongside the
+        old ones, which keep serving requests until the references are swapped
+        in one step; nothing is dropped or served half-loaded. The new client
+        gets a fresh view of the database (see _open_collection), so writes
+        made by another process (a catalog sync) become visible. The old client
+        is closed CHROMA_RETIRE_DELAY seconds after the swap.
+        
+        :return: Catalog generation now being served, or None before the first sync
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            stamp = self._read_catalog_stamp()
+            revision = self._catalog_revision()
+            client, collection, slot = self._open_collection()
+            try:
+                search_backend = self._create_backend(collection, revision=revision)
+                text_index, track_files, file_tracks = self._build_text_index(search_backend, collection)
+                count = collection.count()
+            except BaseException:
+                self._close_chroma_client(client, slot)
+                raise
+            with self._version_lock:
+                old_client, old_slot = self.chroma_client, self._chroma_slot
+                self.chroma_client, self.collection, self._chroma_slot = client, collection, slot
+                self.search_backend = search_backend
+                self.text_index, self._track_files, self._file_tracks = text_index, track_files, file_tracks
+                self._catalog_stamp = stamp
+                self._served_count = count
+                self._generation += 1
+                self._collection_version = None
+                self.result_cache.clear()
+            self._retire_chroma_client(old_client, old_slot)
+            logger.info(f"Reloaded catalog generation {revision} with {count} tracks "
+                        f"in {time.perf_counter() - start:.2f}s")
+            return revision
+
+    def _start_reload(self):
+        """
+        Start a background reload unless one is running; call with _version_lock held.
+        """
+        if not (self._reload_thread and self._reload_thread.is_alive()):
+            self._reload_thread = threading.Thread(
+                target=self._reload_in_background, name='catalog-reload', daemon=True
+            )
+            self._reload_thread.start()
+
+    def _reload_in_background(self):
+        try:
+            self.reload_catalog()
+        except Exception:
+            # Keep serving the previous catalog; the next version check retries
+            logger.exception("Catalog reload failed")
+
+    def invalidate_cache(self):
+        """
+        Drop cached search results, e.g. after tracks were added or removed.
+        """
+        with self._version_lock:
+            self._generation += 1
+            self._collection_version = None
+        self.result_cache.clear()
+
+    def _current_version(self):
+        """
+        Return a token identifying the collection contents.
+        
+        invalidate_cache() bumps the generation immediately.
+        Every write path (ingest and catalog sync) publishes a new
+        catalog version file, which is polled at most every
+        version_check_interval seconds. Databases written before version files
+        existed fall back to polling the collection size. A detected change
+        starts a background reload; the current indexes and cached results keep
+        serving until it swaps in and bumps the generation.
+        """
+        with self._version_lock:
+            now = time.monotonic()
+            if self._collection_version is None or now - self._version_checked_at >= self.version_check_interval:
+                stamp = self._read_catalog_stamp()
+                if stamp is not None:
+                    # This client's view goes stale while another process syncs, so it is not polled
+                    if stamp != self._catalog_stamp:
+                        self._start_reload()
+                elif self.collection.count() != self._served_count:
+                    self._start_reload()
+                self._collection_version = (self._generation, self._catalog_stamp)
+                self._version_checked_at = now
+            return self._collection_version
 
     def semantic_search(self, query, n_results=5):
         """
@@ -30,16 +834,180 @@ class AudioQueryManager:
         :param n_results: Number of results to return
         :return: List of matching audio files and their metadata
         """
+        version = self._current_version()
+        cache_key = (normalize_query(query), n_results)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            return [dict(result) for result in cached[1]]
+        
         # Generate embedding for the query
-        query_embedding = self.embedding_model.encode(query).tolist()
+        query_embedding = self.embed_query(query)
         
         # Perform semantic search
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
+        with stage('vector_query'):
+            results = self.search_backend.search([query_embedding], n_results)
+        
+        with stage('process_results'):
+            processed_results = self._process_query_results(results)
+        self.result_cache.put(cache_key, (version, processed_results))
+        return [dict(result) for result in processed_results]
+
+    def batch_search(self, queries, n_results=5):
+        """
+        Semantic search for several queries with one encode pass and one k-NN call.
+        
+        :param queries: Text queries to search
+        :param n_results: Number of results per query
+        :return: List of result lists aligned with queries
+        """
+        if not queries:
+            return []
+        unique = list(dict.fromkeys(normalize_query(query) for query in queries))
+        query_embeddings = self.embed_queries(unique)
+        with stage('vector_query'):
+            results = self.search_backend.search(query_embeddings, n_results)
+        by_query = {}
+        with stage('process_results'):
+            for i, key in enumerate(unique):
+                by_query[key] = self._process_query_results({
+                    'ids': [results['ids'][i]],
+                    'metadatas': [results['metadatas'][i]],
+                    'distances': [results['distances'][i]] if results.get('distances') else None
+                })
+        return [[dict(result) for result in by_query[normalize_query(query)]] for query in queries]
+
+    def playlist(self, prompts, length=10):
+        """
+        Build an ordered playlist of distinct tracks for one or more prompts.
+        
+        Prompts take turns: the playlist interleaves each prompt's best remaining
+        track, skipping tracks (or audio files) already picked for another prompt.
+        
+        :param prompts: Text prompts; a single prompt fills the whole playlist
+        :param length: Number of tracks wanted
+        :return: List of tracks, each with the 'query' it was picked for
+        """
+        # Every prompt may need to supply the whole playlist if the others overlap it
+        per_prompt = self.batch_search(prompts, n_results=length)
+        positions = [0] * len(per_prompt)
+        seen = set()
+        tracks = []
+        while len(tracks) < length:
+            added = False
+            for i, results in enumerate(per_prompt):
+                while positions[i] < len(results):
+                    result = results[positions[i]]
+                    positions[i] += 1
+                    keys = {result['id']}
+                    if result['local_audio_path'] != 'No local path':
+                        keys.add(result['local_audio_path'])
+                    if seen.isdisjoint(keys):
+                        seen.update(keys)
+                        result['query'] = prompts[i]
+                        tracks.append(result)
+                        added = True
+                        break
+                if len(tracks) == length:
+                    break
+            if not added:
+                break
+        return tracks
+
+    def hybrid_search(self, query, keyword, n_results=5, match='contains'):
+        """
+        Rank tracks matching a keyword filter by semantic similarity to a query.
         
-        return self._process_query_results(results)
+        :param query: Text query used for ranking
+        :param keyword: Substring (match='contains') or words (match='keywords') to filter on
+        :param n_results: Number of results to return
+        :param match: 'contains' for substring matching, 'keywords' to require every word
+        :return: List of matching audio files and their metadata
+        """
+        if match == 'keywords':
+            candidate_ids = self.text_index.keywords(keyword)
+        else:
+            candidate_ids = self.text_index.contains(keyword)
+        if not candidate_ids:
+            return []
+        
+        query_embedding = self.embed_query(query)
+        with stage('vector_query'):
+            results = self.search_backend.search([query_embedding], n_results, candidate_ids=candidate_ids)
+        with stage('process_results'):
+            return self._process_query_results(results)
+
+    def _feature_file(self, track_id):
+        filename = self._track_files.get(track_id)
+        if self.feature_index is None or filename not in self.feature_index:
+            return None
+        return filename
+
+    def similar_tracks(self, track_id, n_results=5):
+        """
+        Tracks that sound most like a given track, by acoustic features alone.
+        
+        :param track_id: Id of the reference track
+        :param n_results: Number of results to return
+        :return: List of tracks with a 'feature_distance' field, closest first (empty if the
+            track's audio was not analysed), or None if track_id is not in the catalog
+        """
+        if self.text_index.metadata(track_id) is None:
+            return None
+        filename = self._feature_file(track_id)
+        if filename is None:
+            return []
+        
+        # Ask for extra neighbours since some analysed files may not be in the collection
+        neighbours = self.feature_index.nearest(filename, n_results * 2 + 10)
+        ids, distances = [], []
+        for neighbour, distance in neighbours:
+            neighbour_id = self._file_tracks.get(neighbour)
+            if neighbour_id is not None and self.text_index.metadata(neighbour_id) is not None:
+                ids.append(neighbour_id)
+                distances.append(distance)
+                if len(ids) == n_results:
+                    break
+        
+        results = self._index_results(ids)
+        for result, distance in zip(results, distances):
+            result['feature_distance'] = distance
+        return results
+
+    def rerank_by_features(self, results, track_id, feature_weight=0.5):
+        """
+        Re-order search results by a blend of text distance and acoustic distance to a track.
+        
+        Both distances are scaled to [0, 1] over the candidate list before blending.
+        Results without analysed audio are treated as acoustically farthest.
+        
+        :param results: Results from semantic_search or hybrid_search
+        :param track_id: Id of the track the results should sound like
+        :param feature_weight: Share of the score taken from acoustic distance (0 to 1)
+        :return: New list of results with 'feature_distance' set where known
+        """
+        filename = self._feature_file(track_id)
+        if filename is None or not results:
+            return results
+        
+        feature_index = self.feature_index
+        rows = [feature_index.row(self._track_files.get(result['id'])) for result in results]
+        known = np.array([row is not None for row in rows])
+        feature_distances = np.ones(len(results), dtype=np.float32)
+        if known.any():
+            distances = feature_index.distances(filename, [row for row in rows if row is not None])
+            feature_distances[known] = distances / max(float(distances.max()), 1e-6)
+        
+        text_distances = np.array([result.get('distance') or 0.0 for result in results], dtype=np.float32)
+        text_distances /= max(float(text_distances.max()), 1e-6)
+        scores = (1.0 - feature_weight) * text_distances + feature_weight * feature_distances
+        
+        reranked = []
+        for i in np.argsort(scores, kind='stable'):
+            result = dict(results[i])
+            if known[i]:
+                result['feature_distance'] = float(feature_distances[i])
+            reranked.append(result)
+        return reranked
 
     def metadata_filter_search(self, filter_dict, n_results=5):
         """
@@ -57,6 +1025,10 @@ class AudioQueryManager:
                 elif '$contains' in value:
                     # For text containment, we'll do a manual post-filtering
                     return self._manual_contains_filter(key, value['$contains'], n_results)
+                elif '$keywords' in value and key == self.text_index.field:
+                    # Every word must appear; answered from the inverted index
+                    ids = self.text_index.keywords(value['$keywords'], limit=n_results)
+                    return self._index_results(ids)
                 else:
                     # Pass through other standard ChromaDB operators
                     chroma_filter[key] = value
@@ -81,6 +1053,10 @@ class AudioQueryManager:
         :param n_results: Number of results to return
         :return: Filtered results
         """
+        if key == self.text_index.field:
+            # Indexed field: n-gram lookup instead of a full collection scan
+            return self._index_results(self.text_index.contains(search_term, limit=n_results))
+        
         # Get all results
         all_results = self.collection.get()
         
@@ -101,6 +1077,13 @@ class AudioQueryManager:
         
         return self._process_get_results(filtered_results)
 
+    def _index_results(self, ids):
+        text_index = self.text_index
+        return self._process_get_results({
+            'ids': ids,
+            'metadatas': [text_index.metadata(track_id) for track_id in ids]
+        })
+
     def _process_query_results(self, results):
         """
         Process and format query results.
@@ -187,5 +1170,9 @@ Usage Notes:
 Supported Metadata Filters:
 - Exact match: {"key": "value"}
 - ChromaDB operators: {"key": {"$eq": value, "$gt": value, "$gte": value, "$lt": value, "$lte": value}}
-- Partial text search: {"key": {"$contains": "partial"}} (uses manual filtering)
+- Partial text search: {"key": {"$contains": "partial"}} (uses the prompt index, manual filtering for other keys)
+- Keyword search: {"prompt": {"$keywords": "rainy cafe"}} (every word must appear)
+- Hybrid search: query_manager.hybrid_search("relaxing music", "piano")
+- More like this: query_manager.similar_tracks(track_id) (needs a table from features.py)
+- Acoustic re-rank: query_manager.rerank_by_features(results, track_id)
 """
\ No newline at end of file
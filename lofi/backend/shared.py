@@ -0,0 +1,305 @@
+import argparse
+import fcntl
+import json
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bump when the snapshot layout changes so stale snapshots are rebuilt
+SNAPSHOT_VERSION = 1
+
+DEFAULT_EMBEDDER_SOCKET = '/tmp/lofi-embedder.sock'
+
+# Written next to the database after every catalog sync; servers watch it to hot-reload
+CATALOG_VERSION_FILENAME = 'catalog_version.json'
+
+def _authkey_path(address):
+    return f"{address}.key"
+
+def _authkey(address):
+    """
+    Handshake key for the embedder socket: EMBEDDER_AUTHKEY if set, else the key the embedder wrote next to it.
+    """
+    key = os.getenv("EMBEDDER_AUTHKEY")
+    if key:
+        return key.encode('utf-8')
+    try:
+        with open(_authkey_path(address), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        raise RuntimeError(f"EMBEDDER_AUTHKEY is not set and {_authkey_path(address)} does not exist; "
+                           f"start the embedder first") from None
+
+def _embedder_listener(address):
+    """
+    Listen on a Unix socket only the current user can connect to.
+
+    Without EMBEDDER_AUTHKEY a random key is generated and written to <socket>.key
+    for the workers. The socket and key file are created under umask 0o177, so
+    they are never accessible to other users, not even briefly.
+    """
+    if os.path.exists(address):
+        os.remove(address)
+    previous_umask = os.umask(0o177)
+    try:
+        key = os.getenv("EMBEDDER_AUTHKEY")
+        if key:
+            authkey = key.encode('utf-8')
+        else:
+            authkey = secrets.token_hex(32).encode('utf-8')
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(address)), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(authkey)
+            os.replace(tmp_path, _authkey_path(address))
+        return Listener(address, family='AF_UNIX', authkey=authkey)
+    finally:
+        os.umask(previous_umask)
+
+@contextmanager
+def snapshot_lock(directory):
+    """
+    Exclusive inter-process lock so only one worker builds a snapshot.
+    """
+    lock_path = f"{os.path.abspath(directory)}.lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def replace_directory(tmp_dir, directory):
+    """
+    Move a fully written tmp_dir into place of directory.
+
+    The old directory is renamed aside, the new one renamed in, and only then
+    is the old one removed, so a failure never leaves neither in place.
+    Call under snapshot_lock(directory).
+    """
+    old_dir = None
+    if os.path.exists(directory):
+        old_dir = f"{tmp_dir}.old"
+        os.rename(directory, old_dir)
+    try:
+        os.rename(tmp_dir, directory)
+    except BaseException:
+        if old_dir is not None:
+            os.rename(old_dir, directory)
+        raise
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+def read_snapshot(directory, fingerprint, dtype):
+    """
+    Attach to a snapshot without copying the matrix.
+
+    :param directory: Snapshot directory
+    :param fingerprint: Expected fingerprint of the collection ids
+    :param dtype: Expected matrix dtype
+    :return: (ids, metadatas, matrix, scales) with memory-mapped arrays, or None if missing or stale
+    """
+    try:
+        with open(os.path.join(directory, 'snapshot.json')) as f:
+            meta = json.load(f)
+        if (meta.get('version') != SNAPSHOT_VERSION or meta.get('fingerprint') != fingerprint
+                or meta.get('dtype') != dtype):
+            return None
+        with open(os.path.join(directory, 'rows.json')) as f:
+            rows = json.load(f)
+        matrix = np.load(os.path.join(directory, 'matrix.npy'), mmap_mode='r')
+        scales = np.load(os.path.join(directory, 'scales.npy'), mmap_mode='r') if meta.get('scales') else None
+    except (FileNotFoundError, ValueError):
+        return None
+    return rows['ids'], rows['metadatas'], matrix, scales
+
+def write_snapshot(directory, fingerprint, dtype, ids, metadatas, matrix, scales=None):
+    """
+    Write a snapshot atomically: files go to a temporary directory that replaces the old one.
+
+    Call under snapshot_lock(directory). Processes still mapping the old files
+    keep reading them until they reload.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, suffix='.tmp')
+    try:
+        np.save(os.path.join(tmp_dir, 'matrix.npy'), np.ascontiguousarray(matrix))
+        if scales is not None:
+            np.save(os.path.join(tmp_dir, 'scales.npy'), np.ascontiguousarray(scales))
+        with open(os.path.join(tmp_dir, 'rows.json'), 'w') as f:
+            json.dump({'ids': list(ids), 'metadatas': list(metadatas)}, f)
+        with open(os.path.join(tmp_dir, 'snapshot.json'), 'w') as f:
+            json.dump({
+                'version': SNAPSHOT_VERSION,
+                'fingerprint': fingerprint,
+                'dtype': dtype,
+                'scales': scales is not None,
+                'rows': len(ids)
+            }, f)
+        replace_directory(tmp_dir, directory)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logger.info(f"Wrote {dtype} snapshot of {len(ids)} rows to {directory}")
+
+def catalog_version_path(db_path):
+    return os.path.join(db_path, CATALOG_VERSION_FILENAME)
+
+def read_catalog_version(db_path):
+    """
+    Return the catalog version record of a database directory, or None before the first sync.
+    """
+    try:
+        with open(catalog_version_path(db_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_catalog_version(db_path, generation, **details):
+    """
+    Atomically publish a new catalog generation for processes serving from db_path.
+    """
+    os.makedirs(db_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=db_path, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'generation': generation, 'updated_at': time.time(), **details}, f)
+    os.replace(tmp_path, catalog_version_path(db_path))
+
+def bump_catalog_version(db_path, **details):
+    """
+    Publish the next catalog generation after a write to the database.
+
+    Writers in different processes take turns on a lock file, so no
+    generation is handed out twice.
+
+    :return: The new generation
+    """
+    with snapshot_lock(catalog_version_path(db_path)):
+        record = read_catalog_version(db_path)
+        generation = (record.get('generation') or 0) + 1 if record else 1
+        write_catalog_version(db_path, generation, **details)
+    return generation
+
+class RemoteEmbedder:
+    def __init__(self, address=DEFAULT_EMBEDDER_SOCKET):
+        """
+        Client for the shared embedder process, usable wherever a SentenceTransformer is.
+
+        Each thread keeps its own connection; a broken connection is reopened once.
+        Connections authenticate with EMBEDDER_AUTHKEY or the key file the embedder wrote.
+
+        :param address: Unix socket path of the embedder process
+        """
+        self.address = address
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = Client(self.address, family='AF_UNIX', authkey=_authkey(self.address))
+            self._local.connection = connection
+        return connection
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=False, **kwargs):
+        single = isinstance(texts, str)
+        request = ([texts] if single else list(texts), normalize_embeddings)
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.send(request)
+                status, payload = connection.recv()
+                break
+            except (OSError, EOFError):
+                self._local.connection = None
+                if attempt:
+                    raise
+        if status != 'ok':
+            raise RuntimeError(f"Embedder error: {payload}")
+        return payload[0] if single else payload
+
+def _serve_connection(connection, batcher):
+    with connection:
+        while True:
+            try:
+                texts, normalize = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if texts:
+                    embeddings = np.stack(batcher.encode_many(texts)).astype(np.float32)
+                else:
+                    embeddings = np.zeros((0, 0), dtype=np.float32)
+                if normalize and len(embeddings):
+                    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+                connection.send(('ok', embeddings))
+            except Exception as e:
+                connection.send(('error', str(e)))
+
+def serve_embedder(address=DEFAULT_EMBEDDER_SOCKET, model_name="all-MiniLM-L6-v2",
+                   max_batch_size=64, batch_window=0.005):
+    """
+    Host one embedding model for every worker process on a Unix socket.
+
+    Requests from all workers go through one EmbeddingBatcher, so concurrent
+    queries from different processes share model calls.
+    """
+    from .embeddings import get_embedding_model
+    from .query import EmbeddingBatcher
+
+    batcher = EmbeddingBatcher(get_embedding_model(model_name), max_batch_size, batch_window)
+    with _embedder_listener(address) as listener:
+        logger.info(f"Embedder {model_name} listening on {address}")
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                # A client that fails the handshake should not stop the server
+                logger.warning(f"Rejected embedder connection: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(connection, batcher), daemon=True).start()
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Shared resources for multi-worker deployments.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    embedder_parser = subparsers.add_parser("embedder", help="Run the shared embedding process")
+    embedder_parser.add_argument("--socket", default=os.getenv("EMBEDDER_SOCKET", DEFAULT_EMBEDDER_SOCKET))
+    embedder_parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    embedder_parser.add_argument("--max-batch-size", type=int, default=64)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Build the shared search snapshot ahead of time")
+    snapshot_parser.add_argument("--db-path", default="./chroma_db")
+    snapshot_parser.add_argument("--collection", default="audio")
+    snapshot_parser.add_argument("--output", default=os.getenv("SHARED_INDEX_DIR"),
+                                 help="Snapshot directory (defaults to <db-path>/shared_<collection>)")
+    snapshot_parser.add_argument("--dtype", default=os.getenv("SEARCH_DTYPE", "float32"))
+    args = parser.parse_args()
+
+    if args.command == "embedder":
+        serve_embedder(args.socket, args.model, args.max_batch_size)
+    else:
+        import chromadb
+        from .query import SharedSearchBackend
+        collection = chromadb.PersistentClient(path=args.db_path).get_collection(name=args.collection)
+        output = args.output or os.path.join(args.db_path, f'shared_{args.collection}')
+        backend = SharedSearchBackend(collection, output, dtype=args.dtype)
+        print(f"Snapshot of {len(backend.ids)} rows ready in {output}")
+
+if __name__ == '__main__':
+    main()
+
+# Multi-worker deployment (from the lofi/ directory):
+# python -m backend.shared embedder &   (set EMBEDDER_AUTHKEY in both, or let workers read /tmp/lofi-embedder.sock.key)
+# python -m backend.shared snapshot
+# EMBEDDER_SOCKET=/tmp/lofi-embedder.sock SEARCH_BACKEND=shared uvicorn backend.main:app --workers 4
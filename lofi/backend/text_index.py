@@ -0,0 +1,132 @@
+import re
+import threading
+from collections import defaultdict
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-']\w+)*")
+
+def tokenize(text):
+    """
+    Split text into lowercase word tokens, keeping hyphenated words like "lo-fi" whole.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+class PromptIndex:
+    def __init__(self, field='prompt', ngram=3):
+        """
+        Inverted index over one metadata text field.
+
+        Word tokens answer keyword queries directly. Character n-grams narrow
+        substring queries down to a few candidates, which are then verified, so
+        neither kind of query scans every document.
+
+        :param field: Metadata key to index
+        :param ngram: Length of the character n-grams used for substring search
+        """
+        self.field = field
+        self.ngram = ngram
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._texts = {}
+            self._metadatas = {}
+            self._positions = {}
+            self._next_position = 0
+            self._tokens = defaultdict(set)
+            self._grams = defaultdict(set)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _grams_of(self, text):
+        return {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+
+    def add(self, ids, metadatas):
+        """
+        Index (or re-index) documents.
+
+        :param ids: Track ids
+        :param metadatas: Metadata dicts aligned with ids
+        """
+        with self._lock:
+            self.remove([track_id for track_id in ids if track_id in self._texts])
+            for track_id, metadata in zip(ids, metadatas):
+                text = str((metadata or {}).get(self.field, '')).lower()
+                self._texts[track_id] = text
+                self._metadatas[track_id] = metadata
+                self._positions[track_id] = self._next_position
+                self._next_position += 1
+                for token in set(tokenize(text)):
+                    self._tokens[token].add(track_id)
+                for gram in self._grams_of(text):
+                    self._grams[gram].add(track_id)
+
+    def remove(self, ids):
+        """
+        Drop documents from the index; unknown ids are ignored.
+        """
+        with self._lock:
+            for track_id in ids:
+                text = self._texts.pop(track_id, None)
+                if text is None:
+                    continue
+                self._metadatas.pop(track_id, None)
+                self._positions.pop(track_id, None)
+                for token in set(tokenize(text)):
+                    self._tokens[token].discard(track_id)
+                    if not self._tokens[token]:
+                        del self._tokens[token]
+                for gram in self._grams_of(text):
+                    self._grams[gram].discard(track_id)
+                    if not self._grams[gram]:
+                        del self._grams[gram]
+
+    def metadata(self, track_id):
+        return self._metadatas.get(track_id)
+
+    def _ordered(self, ids, limit):
+        ordered = sorted(ids, key=self._positions.__getitem__)
+        return ordered[:limit] if limit is not None else ordered
+
+    def contains(self, term, limit=None):
+        """
+        Ids whose field contains term as a case-insensitive substring.
+
+        :param term: Substring to look for
+        :param limit: Maximum number of ids to return
+        :return: List of ids in insertion order
+        """
+        term = term.lower()
+        with self._lock:
+            if len(term) < self.ngram:
+                # Too short for n-gram lookup; the texts are already in memory
+                matches = [track_id for track_id, text in self._texts.items() if term in text]
+                return self._ordered(matches, limit)
+
+            postings = sorted((self._grams.get(gram, set()) for gram in self._grams_of(term)), key=len)
+            candidates = set(postings[0]) if postings else set()
+            for posting in postings[1:]:
+                candidates &= posting
+                if not candidates:
+                    break
+            matches = [track_id for track_id in candidates if term in self._texts[track_id]]
+            return self._ordered(matches, limit)
+
+    def keywords(self, query, limit=None):
+        """
+        Ids whose field contains every word token in query.
+
+        :param query: Space-separated keywords
+        :param limit: Maximum number of ids to return
+        :return: List of ids in insertion order
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            postings = sorted((self._tokens.get(token, set()) for token in tokens), key=len)
+            matches = set(postings[0])
+            for posting in postings[1:]:
+                matches &= posting
+            return self._ordered(matches, limit)
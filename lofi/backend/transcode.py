@@ -0,0 +1,236 @@
+import argparse
+import json
+import logging
+import math
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Bump when the encoding pipeline changes so every variant is rebuilt
+TRANSCODE_VERSION = 1
+DEFAULT_VARIANTS_DIR = os.path.join('downloaded_audio', 'variants')
+MANIFEST_FILENAME = 'manifest.json'
+
+class Variant(NamedTuple):
+    bitrate: str
+    sample_rate: int
+    channels: int
+
+# Served next to the original; 'low' is what data-saving clients get by default
+VARIANTS = {
+    'low': Variant(bitrate='64k', sample_rate=32000, channels=1),
+    'medium': Variant(bitrate='128k', sample_rate=44100, channels=2),
+}
+
+# EBU R128 integrated loudness (LUFS), true peak (dBTP) and loudness range, as streaming services use
+LOUDNESS_TARGET = {'I': -14.0, 'TP': -1.5, 'LRA': 11.0}
+# Below this integrated loudness a track is treated as silence and left as is
+MIN_MEASURABLE_LOUDNESS = -70.0
+
+def _target_options():
+    return ':'.join(f'{name}={value}' for name, value in LOUDNESS_TARGET.items())
+
+def measure_loudness(path):
+    """
+    First loudnorm pass: measure a file's loudness without writing anything.
+
+    :return: Dictionary of loudnorm measurements (input_i, input_tp, input_lra, input_thresh, target_offset)
+    """
+    command = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-i', path, '-vn',
+        '-af', f'loudnorm={_target_options()}:print_format=json', '-f', 'null', '-'
+    ]
+    completed = subprocess.run(command, capture_output=True, check=True, text=True)
+    # The measurement is the last JSON object ffmpeg prints on stderr
+    report = completed.stderr[completed.stderr.rindex('{'):completed.stderr.rindex('}') + 1]
+    return {key: float(value) for key, value in json.loads(report).items() if key.startswith(('input_', 'target_offset'))}
+
+def _filter_graph(measured, variants):
+    """
+    Normalize once, then split into one resampled stream per variant.
+    """
+    head = '[0:a]'
+    if measured is not None:
+        head += (
+            f"loudnorm={_target_options()}:measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}:linear=true,"
+        )
+    head += f"asplit={len(variants)}" + ''.join(f'[s{i}]' for i in range(len(variants)))
+    chains = [f'[s{i}]aresample={variant.sample_rate}[o{i}]' for i, variant in enumerate(variants)]
+    return ';'.join([head] + chains)
+
+def transcode_file(path, outputs):
+    """
+    Write every variant of one file with a single decode; runs in a worker process.
+
+    :param path: Source audio file
+    :param outputs: Dictionary mapping output paths to Variant
+    :return: Loudness measurements, with 'normalized' telling whether they were applied
+    """
+    measured = measure_loudness(path)
+    normalize = math.isfinite(measured.get('input_i', -math.inf)) and measured['input_i'] > MIN_MEASURABLE_LOUDNESS
+    variants = list(outputs.values())
+
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', path,
+               '-filter_complex', _filter_graph(measured if normalize else None, variants)]
+    tmp_paths = []
+    try:
+        for i, (output, variant) in enumerate(outputs.items()):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output), suffix='.part')
+            os.close(fd)
+            tmp_paths.append((tmp_path, output))
+            command += [
+                '-map', f'[o{i}]', '-ac', str(variant.channels),
+                '-c:a', 'libmp3lame', '-b:a', variant.bitrate,
+                '-map_metadata', '-1', '-f', 'mp3', tmp_path
+            ]
+        subprocess.run(command, capture_output=True, check=True)
+        for tmp_path, output in tmp_paths:
+            os.replace(tmp_path, output)
+        tmp_paths = []
+    finally:
+        for tmp_path, _ in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return {**{key: value if math.isfinite(value) else None for key, value in measured.items()},
+            'normalized': normalize}
+
+def variant_path(output_dir, variant, filename):
+    return os.path.join(output_dir, variant, filename)
+
+def load_manifest(output_dir=DEFAULT_VARIANTS_DIR):
+    """
+    Load the transcode manifest, or None if there is none.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _settings(variants):
+    return {
+        'version': TRANSCODE_VERSION,
+        'loudness_target': LOUDNESS_TARGET,
+        'variants': {name: variant._asdict() for name, variant in variants.items()}
+    }
+
+def _write_manifest(output_dir, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(output_dir, MANIFEST_FILENAME))
+
+def build_variants(audio_dir, output_dir=None, variants=VARIANTS, extensions=('.mp3',), workers=None):
+    """
+    Transcode every audio file in a directory into loudness-normalized variants.
+
+    Each variant lands in <output_dir>/<variant>/ under the source file name.
+    Files whose size and modification time are unchanged since the last run,
+    with the same variants and loudness target, are not transcoded again.
+    Variants of files that no longer exist are removed.
+
+    :param audio_dir: Directory of original audio files
+    :param output_dir: Variants directory (defaults to <audio_dir>/variants)
+    :param variants: Dictionary mapping variant names to Variant
+    :param extensions: File extensions to transcode
+    :param workers: ffmpeg processes run at once (defaults to the CPU count)
+    :return: Dictionary with file counts and total bytes per variant
+    """
+    output_dir = output_dir or os.path.join(audio_dir, 'variants')
+    os.makedirs(output_dir, exist_ok=True)
+    settings = _settings(variants)
+    previous = load_manifest(output_dir)
+    previous_files = previous['files'] if previous and previous.get('settings') == settings else {}
+
+    filenames = sorted(
+        name for name in os.listdir(audio_dir)
+        if name.lower().endswith(tuple(extensions))
+    )
+    files = {}
+    pending = []
+    for name in filenames:
+        stat = os.stat(os.path.join(audio_dir, name))
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        entry = previous_files.get(name)
+        if entry is not None and entry['source'] == stamp and all(
+                os.path.exists(variant_path(output_dir, variant, name)) for variant in variants):
+            files[name] = entry
+        else:
+            pending.append((name, stamp))
+
+    start = time.perf_counter()
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(transcode_file, os.path.join(audio_dir, name), {
+                    variant_path(output_dir, variant, name): params for variant, params in variants.items()
+                })
+                for name, _ in pending
+            ]
+            for (name, stamp), future in zip(pending, futures):
+                try:
+                    loudness = future.result()
+                except (OSError, subprocess.CalledProcessError, ValueError) as e:
+                    failed += 1
+                    logger.warning(f"Could not transcode {name}: {e}")
+                    continue
+                files[name] = {
+                    'source': stamp,
+                    'loudness': loudness,
+                    'variants': {
+                        variant: {'size': os.path.getsize(variant_path(output_dir, variant, name))}
+                        for variant in variants
+                    }
+                }
+
+    # Drop variants whose source is gone, and variants no longer configured
+    for variant in os.listdir(output_dir):
+        variant_dir = os.path.join(output_dir, variant)
+        if not os.path.isdir(variant_dir):
+            continue
+        for name in os.listdir(variant_dir):
+            if variant not in variants or (name not in files and not name.endswith('.part')):
+                os.remove(os.path.join(variant_dir, name))
+
+    _write_manifest(output_dir, {'settings': settings, 'files': files})
+
+    stats = {
+        'files': len(files),
+        'transcoded': len(pending) - failed,
+        'reused': len(files) - (len(pending) - failed),
+        'failed': failed,
+        'seconds': time.perf_counter() - start,
+        'bytes': {
+            'original': sum(os.path.getsize(os.path.join(audio_dir, name)) for name in files),
+            **{variant: sum(entry['variants'][variant]['size'] for entry in files.values()) for variant in variants}
+        }
+    }
+    logger.info(f"Variants in {output_dir}: {stats}")
+    return stats
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Transcode downloaded audio into loudness-normalized variants.")
+    parser.add_argument("--audio-dir", default="downloaded_audio", help="Directory of audio files")
+    parser.add_argument("--output", default=None, help="Variants directory (defaults to <audio-dir>/variants)")
+    parser.add_argument("--workers", type=int, default=None, help="ffmpeg processes run at once")
+    args = parser.parse_args()
+
+    stats = build_variants(args.audio_dir, args.output, workers=args.workers)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == '__main__':
+    main()
+
+# Usage (from the lofi/ directory, after download.py; requires ffmpeg with libmp3lame on PATH):
+# python -m backend.transcode --audio-dir downloaded_audio --workers 8
+# Clients then pick a variant with /api/audio/<file>?variant=low, X-Audio-Variant: low or Save-Data: on
@@ -0,0 +1,266 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import Counter, Histogram, register
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Failures of the connection to the upstream, as opposed to local faults such as a full disk
+try:
+    import httpx
+    TIMEOUT_ERRORS = (TimeoutError, requests.Timeout, httpx.TimeoutException)
+    TRANSPORT_ERRORS = (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, httpx.TransportError)
+except ImportError:
+    TIMEOUT_ERRORS = (TimeoutError, requests.Timeout)
+    TRANSPORT_ERRORS = (requests.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+UPSTREAM_SECONDS = register(Histogram(
+    'lofi_upstream_seconds', 'Latency of upstream call attempts by outcome.', ('upstream', 'operation', 'outcome')
+))
+UPSTREAM_RETRIES = register(Counter(
+    'lofi_upstream_retries_total', 'Upstream call attempts that were retried.', ('upstream', 'operation')
+))
+UPSTREAM_REJECTED = register(Counter(
+    'lofi_upstream_rejected_total', 'Upstream calls failed fast by an open circuit breaker.', ('upstream', 'operation')
+))
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an upstream whose circuit breaker is open.
+    """
+
+def create_session(pool_size=16):
+    """
+    Create a requests session with a keep-alive connection pool.
+
+    :param pool_size: Maximum number of pooled connections per host
+    :return: Configured requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def _status_code(error):
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+def is_retryable(error):
+    """
+    Whether a failed call is worth retrying and counts against the upstream's health.
+
+    Throttling, 5xx responses, timeouts and connection failures are; other
+    HTTP errors (bad request, auth, not found) and local failures (a full
+    disk, a programming error) are not, so they never open the breaker.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return isinstance(error, TIMEOUT_ERRORS + TRANSPORT_ERRORS)
+
+def _outcome(error, retryable):
+    if isinstance(error, TIMEOUT_ERRORS):
+        return 'timeout'
+    return 'error' if retryable else 'client_error'
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """
+        Fail fast while an upstream is degraded.
+
+        After failure_threshold consecutive failures the circuit opens and
+        calls are rejected for reset_timeout seconds. Then a single probe call
+        is let through: success closes the circuit, failure opens it again.
+
+        :param name: Upstream name used in errors and logs
+        :param failure_threshold: Consecutive failures that open the circuit
+        :param reset_timeout: Seconds the circuit stays open before a probe
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'open' if time.monotonic() - self._opened_at < self.reset_timeout else 'half_open'
+
+    def before_call(self):
+        """
+        :raises CircuitOpenError: If the circuit is open, or half-open with a probe already in flight
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            remaining = self.reset_timeout - (now - self._opened_at)
+            # A probe that never reported back (e.g. its thread died) does not block the circuit forever
+            probing = self._probe_started is not None and now - self._probe_started < self.reset_timeout
+            if remaining > 0 or probing:
+                raise CircuitOpenError(f"{self.name} circuit is open; retry in {max(remaining, 1):.0f}s")
+            self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name} circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_started is not None or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if self._probe_started is None:
+                    logger.warning(f"{self.name} circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+UPSTREAMS = {}
+
+class Upstream:
+    def __init__(self, name, pool_size=16, max_concurrency=None, connect_timeout=5.0, read_timeout=30.0,
+                 max_retries=3, backoff=0.5, max_backoff=30.0, failure_threshold=5, reset_timeout=30.0):
+        """
+        Shared client for one upstream service.
+
+        Calls go through a keep-alive connection pool with explicit timeouts,
+        at most max_concurrency at a time. Retryable failures are retried with
+        jittered exponential backoff (honouring Retry-After) and feed a circuit
+        breaker. Every attempt is recorded in the lofi_upstream_* metrics,
+        labelled with the upstream name and the caller's operation.
+
+        :param name: Upstream name used in metrics and logs
+        :param pool_size: Pooled connections per host
+        :param max_concurrency: Calls in flight at once (defaults to pool_size)
+        :param connect_timeout: Seconds to establish a connection
+        :param read_timeout: Seconds to wait for each read from the upstream
+        :param max_retries: Retries after the first attempt
+        :param backoff: Base retry delay in seconds, doubled after every failed attempt
+        :param max_backoff: Cap on a single retry delay
+        :param failure_threshold: Consecutive failures that open the circuit breaker
+        :param reset_timeout: Seconds the breaker stays open before probing again
+        """
+        self.name = name
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._slots = threading.BoundedSemaphore(max_concurrency or pool_size)
+        self._session = None
+        self._session_lock = threading.Lock()
+        UPSTREAMS[name] = self
+
+    @property
+    def session(self):
+        """Pooled requests session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = create_session(self.pool_size)
+        return self._session
+
+    def _retry_delay(self, error, attempt):
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff * 2 ** attempt
+        return min(delay, self.max_backoff) * random.uniform(0.5, 1.5)
+
+    def call(self, operation, fn, *args, max_retries=None, **kwargs):
+        """
+        Run one upstream call with the concurrency limit, retries, circuit breaker and metrics.
+
+        :param operation: Label for the call site, e.g. 'rows' or 'download'
+        :param fn: Callable doing the actual request
+        :param max_retries: Overrides the upstream's retry count for this call
+        :return: Result of fn
+        :raises CircuitOpenError: If the upstream is failing and the breaker is open
+        """
+        retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(retries + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                UPSTREAM_REJECTED.inc(self.name, operation)
+                raise
+            with self._slots:
+                start = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                else:
+                    UPSTREAM_SECONDS.observe(time.perf_counter() - start, self.name, operation, 'ok')
+                    self.breaker.record_success()
+                    return result
+            retryable = is_retryable(error)
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, self.name, operation, _outcome(error, retryable))
+            if not retryable:
+                # The upstream answered; the request itself was wrong
+                self.breaker.record_success()
+                raise error
+            self.breaker.record_failure()
+            if attempt == retries:
+                raise error
+            delay = self._retry_delay(error, attempt)
+            UPSTREAM_RETRIES.inc(self.name, operation)
+            logger.warning(f"{self.name} {operation} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def send(self, method, url, **kwargs):
+        """
+        One HTTP attempt through the pooled session, for use inside a call() that spans more than the request.
+
+        Error statuses raise requests.HTTPError; timeout defaults to (connect_timeout, read_timeout).
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            try:
+                response.raise_for_status()
+            finally:
+                response.close()
+        return response
+
+    def request(self, method, url, operation, **kwargs):
+        """
+        HTTP request through call(); error statuses raise requests.HTTPError.
+
+        Takes requests keyword arguments, plus max_retries to override the upstream's.
+        """
+        max_retries = kwargs.pop('max_retries', None)
+        return self.call(operation, self.send, method, url, max_retries=max_retries, **kwargs)
+
+    def get(self, url, operation, **kwargs):
+        return self.request('GET', url, operation, **kwargs)
+
+    def stats(self):
+        return {'state': self.breaker.state, 'timeout': list(self.timeout), 'max_retries': self.max_retries}
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+def upstream_stats():
+    """
+    Circuit state and settings of every upstream client in this process.
+    """
+    return {name: upstream.stats() for name, upstream in UPSTREAMS.items()}
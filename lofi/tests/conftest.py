@@ -0,0 +1,46 @@
+import chromadb
+import pytest
+
+from backend.benchmark import FakeDatasetServer, HashEmbedder
+from backend.upstream import Upstream
+
+@pytest.fixture
+def collection(tmp_path):
+    return chromadb.PersistentClient(path=str(tmp_path / 'db')).get_or_create_collection(name='audio')
+
+@pytest.fixture
+def embedder():
+    return HashEmbedder()
+
+@pytest.fixture
+def fast_upstream(request):
+    """
+    Factory for upstream clients with test-sized timeouts and backoff.
+    """
+    created = []
+
+    def make(name, **settings):
+        settings = {'connect_timeout': 0.5, 'read_timeout': 0.5, 'backoff': 0.01, 'max_backoff': 0.05, **settings}
+        upstream = Upstream(f'test-{request.node.name}-{name}', **settings)
+        created.append(upstream)
+        return upstream
+
+    yield make
+    for upstream in created:
+        upstream.close()
+
+@pytest.fixture
+def dataset_server():
+    """
+    Factory for FakeDatasetServer instances that are shut down after the test.
+    """
+    servers = []
+
+    def make(num_rows=50, audio_bytes=256, **faults):
+        server = FakeDatasetServer(num_rows, audio_bytes, **faults).__enter__()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.__exit__(None, None, None)
@@ -0,0 +1,122 @@
+import os
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from backend.audio_store import AudioLibrary, file_response
+
+BODY = bytes(range(100))
+
+@pytest.fixture
+def audio_dir(tmp_path):
+    (tmp_path / 'track.mp3').write_bytes(BODY)
+    return tmp_path
+
+@pytest.fixture
+def library(audio_dir):
+    return AudioLibrary(str(audio_dir), rescan_interval=0)
+
+@pytest.fixture
+def client(library):
+    app = FastAPI()
+
+    @app.api_route('/audio/{filename}', methods=['GET', 'HEAD'])
+    async def audio(filename: str, request: Request):
+        entry = library.get(filename)
+        if entry is None:
+            raise HTTPException(status_code=404)
+        return file_response(request, entry, 'audio/mpeg')
+
+    return TestClient(app)
+
+def test_full_response_carries_validators(client):
+    response = client.get('/audio/track.mp3')
+    assert response.status_code == 200
+    assert response.content == BODY
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['content-length'] == str(len(BODY))
+    assert response.headers['etag'] and response.headers['last-modified']
+
+def test_head_sends_headers_only(client):
+    response = client.head('/audio/track.mp3')
+    assert response.status_code == 200
+    assert response.content == b''
+    assert response.headers['content-length'] == str(len(BODY))
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=10-19', 10, 19),
+    ('bytes=90-', 90, 99),
+    ('bytes=-5', 95, 99),
+    ('bytes=95-500', 95, 99),
+])
+def test_range_returns_partial_content(client, header, start, end):
+    response = client.get('/audio/track.mp3', headers={'Range': header})
+    assert response.status_code == 206
+    assert response.content == BODY[start:end + 1]
+    assert response.headers['content-range'] == f'bytes {start}-{end}/{len(BODY)}'
+    assert response.headers['content-length'] == str(end - start + 1)
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=50-10', 'bytes=-0'])
+def test_unsatisfiable_range(client, header):
+    response = client.get('/audio/track.mp3', headers={'Range': header})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(BODY)}'
+
+@pytest.mark.parametrize('header', ['bytes=0-1,5-6', 'items=0-1', 'bytes=-'])
+def test_unsupported_range_gets_the_whole_file(client, header):
+    response = client.get('/audio/track.mp3', headers={'Range': header})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+def test_if_none_match(client):
+    etag = client.get('/audio/track.mp3').headers['etag']
+    for header in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+        response = client.get('/audio/track.mp3', headers={'If-None-Match': header})
+        assert response.status_code == 304
+        assert response.content == b''
+        assert response.headers['etag'] == etag
+    assert client.get('/audio/track.mp3', headers={'If-None-Match': '"other"'}).status_code == 200
+
+def test_if_modified_since(client):
+    last_modified = client.get('/audio/track.mp3').headers['last-modified']
+    assert client.get('/audio/track.mp3', headers={'If-Modified-Since': last_modified}).status_code == 304
+    old = 'Mon, 01 Jan 2001 00:00:00 GMT'
+    assert client.get('/audio/track.mp3', headers={'If-Modified-Since': old}).status_code == 200
+
+def test_if_range(client):
+    first = client.get('/audio/track.mp3')
+    for validator in (first.headers['etag'], first.headers['last-modified']):
+        response = client.get('/audio/track.mp3', headers={'Range': 'bytes=0-9', 'If-Range': validator})
+        assert response.status_code == 206
+        assert response.content == BODY[:10]
+    # A stale validator means the client's copy changed: send the whole file
+    response = client.get('/audio/track.mp3', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+def test_rewritten_file_gets_a_new_size_and_etag(client, audio_dir):
+    etag = client.get('/audio/track.mp3').headers['etag']
+    path = audio_dir / 'track.mp3'
+    path.write_bytes(b'new audio')
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    response = client.get('/audio/track.mp3', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.content == b'new audio'
+    assert response.headers['etag'] != etag
+    assert response.headers['content-length'] == str(len(b'new audio'))
+
+def test_deleted_and_new_files(client, audio_dir):
+    (audio_dir / 'track.mp3').unlink()
+    assert client.get('/audio/track.mp3').status_code == 404
+    (audio_dir / 'later.mp3').write_bytes(b'later')
+    assert client.get('/audio/later.mp3').content == b'later'
+    assert client.get('/audio/notes.txt').status_code == 404
+
+def test_content_addressed_files_use_their_hash_as_etag(audio_dir):
+    digest = 'ab' * 32
+    (audio_dir / f'{digest}.mp3').write_bytes(BODY)
+    library = AudioLibrary(str(audio_dir), etag_suffix='-low')
+    assert library.get(f'{digest}.mp3').etag == f'"{digest}-low"'
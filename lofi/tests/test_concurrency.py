@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+import pytest
+
+from backend.concurrency import BoundedExecutor, PoolSaturatedError
+
+@pytest.fixture
+def pool():
+    pool = BoundedExecutor('test', 1, 2)
+    yield pool
+    pool.shutdown(wait=False)
+
+def _blocker(pool):
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    future = pool.submit('block', block)
+    started.wait(5)
+    return future, release
+
+def test_full_pool_rejects(pool):
+    future, release = _blocker(pool)
+    queued = [pool.submit('x', lambda: None) for _ in range(2)]
+    with pytest.raises(PoolSaturatedError):
+        pool.submit('x', lambda: None)
+    release.set()
+    assert future.result(5) == 'done'
+    for task in queued:
+        task.result(5)
+    assert pool.stats()['endpoints']['x']['rejected'] == 1
+
+def test_cancelled_queued_tasks_give_their_slot_back(pool):
+    future, release = _blocker(pool)
+    queued = [pool.submit('x', lambda: None) for _ in range(2)]
+    assert all(task.cancel() for task in queued)
+    assert pool.stats()['endpoints']['x']['queued'] == 0
+    assert pool.stats()['endpoints']['x']['cancelled'] == 2
+
+    again = pool.submit('x', lambda: 'ran')
+    release.set()
+    assert again.result(5) == 'ran'
+
+def test_timed_out_await_releases_a_queued_task(pool):
+    future, release = _blocker(pool)
+
+    async def wait_briefly():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.run('x', lambda: None), 0.05)
+
+    for _ in range(3):
+        asyncio.run(wait_briefly())
+    assert pool.stats()['endpoints']['x']['queued'] == 0
+    release.set()
+    assert future.result(5) == 'done'
@@ -0,0 +1,92 @@
+from backend.benchmark import _unused_port
+from backend.download import DatasetCheckpoint, iter_dataset_rows, load_manifest, populate_chromadb
+from backend.upstream import UPSTREAM_RETRIES
+
+def _ids(n):
+    return [f'row-{i}' for i in range(n)]
+
+def test_iter_dataset_rows_pages_through_the_split(dataset_server, fast_upstream):
+    server = dataset_server(num_rows=23)
+    rows = iter_dataset_rows(server_url=server.url, page_size=5, upstream=fast_upstream('rows'))
+    assert [row['id'] for row in rows] == _ids(23)
+
+def test_iter_dataset_rows_starts_at_offset(dataset_server, fast_upstream):
+    server = dataset_server(num_rows=12)
+    rows = iter_dataset_rows(server_url=server.url, page_size=5, offset=7, upstream=fast_upstream('rows'))
+    assert [row['id'] for row in rows] == _ids(12)[7:]
+
+def test_iter_dataset_rows_retries_errors_and_stalls(dataset_server, fast_upstream):
+    server = dataset_server(num_rows=40, failure_rate=0.3, stall_rate=0.1, stall_seconds=1.0)
+    upstream = fast_upstream('rows', read_timeout=0.2, max_retries=10, failure_threshold=100)
+    rows = iter_dataset_rows(server_url=server.url, page_size=4, upstream=upstream)
+    assert [row['id'] for row in rows] == _ids(40)
+    assert UPSTREAM_RETRIES.value(upstream.name, 'rows') > 0
+
+class FailingEmbedder:
+    """
+    Raises on the nth encode call, delegating to another embedder otherwise.
+    """
+    def __init__(self, embedder, fail_on):
+        self.embedder = embedder
+        self.fail_on = fail_on
+        self.calls = 0
+
+    def encode(self, texts, **kwargs):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError('embedding failed')
+        return self.embedder.encode(texts, **kwargs)
+
+def _ingest(server, collection, embedder, checkpoint_path, audio_dir, upstream, batch_size):
+    checkpoint = DatasetCheckpoint(str(checkpoint_path))
+    rows = iter_dataset_rows(server_url=server.url, page_size=10, checkpoint=checkpoint, upstream=upstream)
+    populate_chromadb(
+        rows, embedder, collection, output_dir=str(audio_dir), max_workers=2, batch_size=batch_size,
+        on_batch_written=checkpoint.mark_done, on_rows_skipped=checkpoint.mark_done
+    )
+    # What a later run would resume from
+    return DatasetCheckpoint(str(checkpoint_path)).offset
+
+def test_checkpoint_stops_at_a_failed_batch_and_resumes(dataset_server, fast_upstream, collection, embedder, tmp_path):
+    # Batches span several pages, so a page-based cursor would run past the failed batch
+    server = dataset_server(num_rows=100)
+    upstream = fast_upstream('rows')
+    checkpoint_path = tmp_path / 'checkpoint.json'
+
+    offset = _ingest(server, collection, FailingEmbedder(embedder, fail_on=2), checkpoint_path,
+                     tmp_path / 'audio', upstream, batch_size=32)
+    stored = set(collection.get(include=[])['ids'])
+    assert len(stored) == 100 - 32
+    assert offset < 100
+    # Everything before the cursor is stored
+    assert set(_ids(offset)) <= stored
+
+    offset = _ingest(server, collection, embedder, checkpoint_path, tmp_path / 'audio', upstream, batch_size=32)
+    assert offset == 100
+    assert collection.count() == 100
+
+def test_checkpoint_waits_for_the_last_batch(dataset_server, fast_upstream, collection, tmp_path):
+    server = dataset_server(num_rows=25)
+    checkpoint_path = tmp_path / 'checkpoint.json'
+    # Every encode fails: nothing is stored, so the cursor must not move
+    offset = _ingest(server, collection, FailingEmbedder(None, fail_on=1), checkpoint_path,
+                     tmp_path / 'audio', fast_upstream('rows'), batch_size=100)
+    assert collection.count() == 0
+    assert offset == 0
+
+def test_rows_without_downloaded_audio_are_retried(dataset_server, fast_upstream, collection, embedder, tmp_path):
+    down = dataset_server(num_rows=10, audio_url=f'http://127.0.0.1:{_unused_port()}')
+    populate_chromadb(
+        iter_dataset_rows(server_url=down.url, upstream=fast_upstream('rows')), embedder, collection,
+        output_dir=str(tmp_path / 'audio'), upstream=fast_upstream('audio', max_retries=0)
+    )
+    assert collection.count() == 0
+
+    healthy = dataset_server(num_rows=10)
+    populate_chromadb(
+        iter_dataset_rows(server_url=healthy.url, upstream=fast_upstream('rows')), embedder, collection,
+        output_dir=str(tmp_path / 'audio'), upstream=fast_upstream('audio')
+    )
+    assert collection.count() == 10
+    assert len(load_manifest(str(tmp_path / 'audio'))) == 10
+    assert all(metadata.get('local_audio_path') for metadata in collection.get(include=['metadatas'])['metadatas'])
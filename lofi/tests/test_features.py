@@ -0,0 +1,125 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from backend import features
+from backend.features import SAMPLE_RATE, AudioFeatureIndex, build_feature_table, compute_features, table_paths
+
+def _tone(frequency, amplitude=0.5, seconds=5):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+def test_compute_features_on_synthetic_signals():
+    rms_db, centroid, _, duration = compute_features(_tone(440))
+    assert rms_db == pytest.approx(20 * np.log10(0.5 / np.sqrt(2)), abs=0.1)
+    assert centroid == pytest.approx(440, rel=0.02)
+    assert duration == pytest.approx(5.0)
+    assert compute_features(_tone(2000, amplitude=0.05))[1] == pytest.approx(2000, rel=0.02)
+
+    # Noise bursts every half second are a 120 BPM click track
+    clicks = np.zeros(SAMPLE_RATE * 10, dtype=np.float32)
+    burst = np.random.default_rng(0).uniform(-1, 1, 200).astype(np.float32)
+    for start in range(0, len(clicks), SAMPLE_RATE // 2):
+        clicks[start:start + 200] = burst
+    assert compute_features(clicks)[2] == pytest.approx(120, abs=5)
+
+    # Too short to frame: silence with just a duration
+    assert compute_features(np.zeros(100, dtype=np.float32)).tolist() == pytest.approx([-120, 0, 0, 100 / SAMPLE_RATE])
+
+def _index():
+    rows = {
+        'quiet.mp3': [-30, 500, 80, 120],
+        'quiet-twin.mp3': [-29, 520, 82, 118],
+        'loud.mp3': [-8, 3000, 140, 200],
+        'middle.mp3': [-20, 1500, 110, 160],
+    }
+    return AudioFeatureIndex(rows, np.array(list(rows.values())))
+
+def test_index_lookups():
+    index = _index()
+    assert len(index) == 4
+    assert 'loud.mp3' in index and 'missing.mp3' not in index
+    assert index.row('loud.mp3') == 2 and index.row('missing.mp3') is None
+    assert index.describe('loud.mp3') == {'rms_db': -8, 'spectral_centroid': 3000, 'tempo': 140, 'duration': 200}
+    assert index.describe('missing.mp3') is None
+    # Standardized columns have zero mean and unit variance
+    assert index.standardized.mean(axis=0) == pytest.approx(0, abs=1e-5)
+    assert index.standardized.std(axis=0) == pytest.approx(1, abs=1e-5)
+
+def test_nearest_excludes_the_file_and_sorts_by_distance():
+    index = _index()
+    nearest = index.nearest('quiet.mp3', n_results=2)
+    assert [name for name, _ in nearest] == ['quiet-twin.mp3', 'middle.mp3']
+    assert nearest[0][1] < nearest[1][1]
+    assert nearest[0][1] == pytest.approx(index.distances('quiet.mp3', [1])[0])
+    assert [name for name, _ in index.nearest('quiet.mp3', n_results=10)][-1] == 'loud.mp3'
+    assert index.distances('quiet.mp3')[0] == 0
+    assert AudioFeatureIndex(['solo.mp3'], [[-20, 1000, 100, 60]]).nearest('solo.mp3') == []
+
+def test_constant_columns_do_not_divide_by_zero():
+    index = AudioFeatureIndex(['a.mp3', 'b.mp3'], [[-20, 1000, 100, 60], [-10, 1000, 100, 60]])
+    assert np.isfinite(index.standardized).all()
+    assert index.nearest('a.mp3') == [('b.mp3', pytest.approx(2.0))]
+
+@pytest.fixture
+def fake_decoder(monkeypatch):
+    """
+    Analyse files in threads, reading a frequency from each file instead of decoding audio with ffmpeg.
+    """
+    analysed = []
+
+    def extract(path):
+        analysed.append(os.path.basename(path))
+        with open(path) as f:
+            return compute_features(_tone(float(f.read()), seconds=1))
+
+    monkeypatch.setattr(features, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(features, 'extract_file_features', extract)
+    return analysed
+
+def test_build_then_load_reuses_unchanged_files(tmp_path, fake_decoder):
+    audio_dir = tmp_path / 'audio'
+    audio_dir.mkdir()
+    for name, frequency in [('a.mp3', '220'), ('b.mp3', '440'), ('c.mp3', '880'), ('broken.mp3', 'x')]:
+        (audio_dir / name).write_text(frequency)
+    (audio_dir / 'notes.txt').write_text('skipped')
+    prefix = str(tmp_path / 'table' / 'features')
+
+    stats = build_feature_table(str(audio_dir), prefix)
+    assert (stats['files'], stats['analysed'], stats['reused'], stats['failed']) == (3, 3, 0, 1)
+    index = AudioFeatureIndex.load(prefix)
+    assert index.files == ['a.mp3', 'b.mp3', 'c.mp3']
+    assert index.describe('b.mp3')['spectral_centroid'] == pytest.approx(440, rel=0.02)
+    assert index.nearest('a.mp3', n_results=1)[0][0] == 'b.mp3'
+
+    fake_decoder.clear()
+    (audio_dir / 'c.mp3').write_text('1760')
+    (audio_dir / 'b.mp3').unlink()
+    stats = build_feature_table(str(audio_dir), prefix)
+    assert sorted(fake_decoder) == ['broken.mp3', 'c.mp3']
+    assert (stats['files'], stats['analysed'], stats['reused']) == (2, 1, 1)
+    index = AudioFeatureIndex.load(prefix)
+    assert index.files == ['a.mp3', 'c.mp3']
+    assert index.describe('c.mp3')['spectral_centroid'] == pytest.approx(1760, rel=0.02)
+
+def test_load_ignores_missing_and_stale_tables(tmp_path, fake_decoder):
+    prefix = str(tmp_path / 'features')
+    assert AudioFeatureIndex.load(prefix) is None
+
+    (tmp_path / 'a.mp3').write_text('440')
+    build_feature_table(str(tmp_path), prefix)
+    _, json_path = table_paths(prefix)
+    with open(json_path) as f:
+        sidecar = json.load(f)
+    with open(json_path, 'w') as f:
+        json.dump({**sidecar, 'version': features.FEATURES_VERSION + 1}, f)
+    assert AudioFeatureIndex.load(prefix) is None
+
+    # A stale table is rebuilt from scratch rather than reused
+    fake_decoder.clear()
+    build_feature_table(str(tmp_path), prefix)
+    assert fake_decoder == ['a.mp3']
+    assert len(AudioFeatureIndex.load(prefix)) == 1
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from backend import image_generation
+from backend.image_generation import ImageCache, SingleFlight, generate_image_bytes
+from backend.upstream import CircuitOpenError
+
+class FakeImage:
+    def __init__(self, prompt):
+        self.prompt = prompt
+
+    def save(self, buffer, format):
+        buffer.write(f'{format}:{self.prompt}'.encode('utf-8'))
+
+class FakeClient:
+    """
+    Stand-in for InferenceClient that counts calls and can fail or stall.
+    """
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def text_to_image(self, prompt, model=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return FakeImage(prompt)
+
+class HTTPStatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f'{status} from upstream')
+
+        class Response:
+            status_code = status
+            headers = {}
+        self.response = Response()
+
+@pytest.fixture
+def image_env(tmp_path, monkeypatch, fast_upstream):
+    monkeypatch.setattr(image_generation, 'image_cache', ImageCache(str(tmp_path / 'images')))
+    monkeypatch.setattr(image_generation, 'image_upstream',
+                        fast_upstream('image', max_retries=1, failure_threshold=2, reset_timeout=60))
+
+    def install(client):
+        image_generation.set_client(client)
+        return client
+
+    yield install
+    image_generation.set_client(None)
+
+def test_cache_key_normalizes_whitespace_and_case():
+    assert ImageCache.key('Rainy  Night ', 'm') == ImageCache.key('rainy night', 'm')
+    assert ImageCache.key('rainy night', 'a') != ImageCache.key('rainy night', 'b')
+
+def test_repeat_prompt_is_served_from_disk(image_env):
+    client = image_env(FakeClient())
+    first = generate_image_bytes('rainy night')
+    assert generate_image_bytes('Rainy night') == first
+    assert client.calls == 1
+
+def test_concurrent_misses_render_once(image_env):
+    client = image_env(FakeClient(delay=0.2))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(generate_image_bytes('snow'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(results)) == 1 and len(results) == 8
+    assert client.calls == 1
+
+def test_single_flight_shares_errors_and_forgets_them():
+    def fail():
+        raise ValueError('boom')
+
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 42) == 42
+
+def test_eviction_keeps_cache_under_budget(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=250)
+    for i in range(5):
+        cache.put(f'key{i}', b'x' * 100)
+        time.sleep(0.01)
+    assert sum(len(cache.get(f'key{i}') or b'') for i in range(5)) <= 250
+    assert cache.get('key4') is not None
+
+def test_stale_entries_are_misses(tmp_path):
+    cache = ImageCache(str(tmp_path), max_age=0)
+    cache.put('key', b'data')
+    time.sleep(0.01)
+    assert cache.get('key') is None
+
+def test_failed_render_is_not_cached(image_env):
+    image_env(FakeClient(error=HTTPStatusError(400)))
+    with pytest.raises(HTTPStatusError):
+        generate_image_bytes('broken')
+    client = image_env(FakeClient())
+    generate_image_bytes('broken')
+    assert client.calls == 1
+
+def test_transient_errors_are_retried_then_open_the_circuit(image_env):
+    client = image_env(FakeClient(error=HTTPStatusError(503)))
+    with pytest.raises(HTTPStatusError):
+        generate_image_bytes('busy')
+    # One retry per call; the second failure opened the circuit
+    assert client.calls == 2
+    with pytest.raises(CircuitOpenError):
+        generate_image_bytes('busy again')
+    assert client.calls == 2
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+
+from backend.ivf import IVFIndex, ids_fingerprint
+from backend.query import IVFSearchBackend, NumpySearchBackend
+
+def _index(n, dim=16, seed=0):
+    ids = [f"track-{i}" for i in range(n)]
+    embeddings = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return ids, embeddings, IVFIndex.build(ids, embeddings)
+
+def test_save_replaces_an_existing_index(tmp_path):
+    directory = str(tmp_path / 'ivf')
+    ids, _, first = _index(50)
+    first.save(directory, ids_fingerprint(ids))
+    ids, _, second = _index(80, seed=1)
+    second.save(directory, ids_fingerprint(ids))
+
+    loaded = IVFIndex.load(directory, ids_fingerprint(ids))
+    assert loaded is not None and len(loaded) == 80
+    # Neither the temporary nor the renamed-aside directory is left behind
+    assert sorted(os.listdir(tmp_path)) == ['ivf', 'ivf.lock']
+
+def _fill(collection, n, dim=16):
+    ids, embeddings, _ = _index(n, dim)
+    collection.upsert(ids=ids, embeddings=embeddings.tolist(), metadatas=[{'i': i} for i in range(n)])
+    return embeddings
+
+def test_small_catalogs_are_searched_exactly(collection):
+    queries = np.random.default_rng(2).normal(size=(20, 16))
+    _fill(collection, 305)
+    exact = NumpySearchBackend(collection).search(queries, 5)
+    ivf = IVFSearchBackend(collection, n_probe=1)
+    assert ivf.search(queries, 5)['ids'] == exact['ids']
+    assert sorted(ivf.ids) == sorted(collection.get(include=[])['ids'])
+
+def test_large_catalogs_use_the_index(collection, monkeypatch):
+    monkeypatch.setattr(IVFSearchBackend, 'EXACT_ROWS', 100)
+    _fill(collection, 305)
+    backend = IVFSearchBackend(collection, n_probe=1)
+    index = backend._snapshot[0]
+    assert len(index) == 305 and index.n_lists > 1
+    # Probing every list is exhaustive, so the exact buffer is used instead
+    exhaustive = IVFSearchBackend(collection, n_lists=4, n_probe=4)
+    assert len(exhaustive._snapshot[0]) == 0
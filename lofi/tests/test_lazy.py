@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from backend.lazy import IMPORT_TIMINGS, LazyComponent, import_timer
+
+def test_concurrent_first_calls_build_once():
+    builds = []
+    release = threading.Event()
+
+    def build():
+        builds.append(1)
+        release.wait(5)
+        return object()
+
+    component = LazyComponent('model', build)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(component.get())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    assert not component.loaded
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(builds) == 1
+    assert len(results) == 4 and all(result is results[0] for result in results)
+    assert component.get() is results[0]
+    status = component.status()
+    assert status['loaded'] and status['required'] and status['error'] is None
+    assert status['load_seconds'] >= 0.05
+
+def test_failed_build_is_reported_and_retried():
+    attempts = []
+
+    def build():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('database locked')
+        return 'client'
+
+    component = LazyComponent('db', build, required=False)
+    with pytest.raises(RuntimeError):
+        component.get()
+    assert component.status() == {'loaded': False, 'required': False,
+                                  'load_seconds': component.load_seconds, 'error': 'database locked'}
+    assert component.get() == 'client'
+    assert component.status()['error'] is None
+
+def test_warm_up_loads_in_the_background():
+    component = LazyComponent('model', lambda: 'weights')
+    component.warm_up().join(5)
+    assert component.loaded
+
+    failing = LazyComponent('broken', lambda: 1 / 0)
+    failing.warm_up().join(5)
+    assert not failing.loaded
+    assert 'division by zero' in failing.error
+
+def test_import_timer_records_the_block():
+    with import_timer('test-block'):
+        time.sleep(0.01)
+    assert IMPORT_TIMINGS.pop('test-block') >= 0.01
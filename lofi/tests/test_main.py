@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.concurrency import BoundedExecutor
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    App client on one event loop for the whole test, with pools of its own (shutdown closes them).
+    """
+    monkeypatch.setenv('WARMUP', '0')
+    monkeypatch.setattr(main, 'image_pool', BoundedExecutor('image', 2, 2))
+    monkeypatch.setattr(main, 'embedding_pool', BoundedExecutor('embedding', 2, 4))
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def slow_images(client, monkeypatch):
+    """
+    A one-worker image pool with a one-slot queue, and a render that outlasts the mood image timeout.
+    """
+    pool = BoundedExecutor('image', 1, 1)
+    rendered = []
+    lock = threading.Lock()
+
+    def render(prompt):
+        time.sleep(0.3)
+        with lock:
+            rendered.append(prompt)
+        return b'png'
+
+    monkeypatch.setattr(main, 'image_pool', pool)
+    monkeypatch.setattr(main, 'generate_image_bytes', render)
+    monkeypatch.setattr(main, 'MOOD_IMAGE_TIMEOUT', 0.05)
+    monkeypatch.setattr(main, '_semantic_search', lambda prompt, n_results: [
+        {'prompt': prompt, 'local_audio_path': 'downloaded_audio/a.mp3', 'distance': 0.1}
+    ])
+    return pool, rendered
+
+def _idle(pool, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        counts = pool.stats()['endpoints'].values()
+        if all(c['queued'] == 0 and c['running'] == 0 for c in counts):
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_mood_image_timeout_does_not_leak_pool_slots(client, slow_images):
+    pool, rendered = slow_images
+    for prompt in ('rain', 'night'):
+        events = [json.loads(line) for line in client.post('/api/mood', json={'prompt': prompt}).text.splitlines()]
+        by_type = {event['type']: event for event in events}
+        assert by_type['track']['audio_url'] == '/api/audio/a.mp3'
+        assert by_type['image']['status'] == 504
+
+    assert _idle(pool)
+    # Timed-out renders still ran to completion, so they fill the image cache
+    assert sorted(rendered) == ['night', 'rain']
+    response = client.post('/api/generate-image', json={'prompt': 'sunset'})
+    assert response.status_code == 200
+    assert response.content == b'png'
+
+class FakeProfiler:
+    def collapsed(self):
+        return 'main;handler 3\n'
+
+    def stop(self):
+        pass
+
+    def dump(self, path):
+        pass
+
+@pytest.fixture
+def profiled(client, monkeypatch):
+    monkeypatch.setattr(main.app.state, 'profiler', FakeProfiler(), raising=False)
+    return client
+
+def test_profile_is_hidden_without_a_token(profiled, monkeypatch):
+    monkeypatch.setattr(main, 'PROFILE_TOKEN', None)
+    assert profiled.get('/api/profile').status_code == 404
+
+def test_profile_requires_the_token(profiled, monkeypatch):
+    monkeypatch.setattr(main, 'PROFILE_TOKEN', 'secret')
+    assert profiled.get('/api/profile').status_code == 403
+    assert profiled.get('/api/profile', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = profiled.get('/api/profile', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert response.text == 'main;handler 3\n'
+
+def test_profile_is_hidden_when_profiling_is_off(client, monkeypatch):
+    monkeypatch.setattr(main, 'PROFILE_TOKEN', 'secret')
+    response = client.get('/api/profile', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 404
+
+def _track(track_id, path='downloaded_audio/a.mp3', **fields):
+    return {'id': track_id, 'prompt': f'prompt {track_id}', 'local_audio_path': path, 'distance': 0.1, **fields}
+
+def test_playlist_links_stored_audio_and_omits_missing_files(client, monkeypatch):
+    calls = []
+
+    def playlist(prompts, length):
+        calls.append((prompts, length))
+        return [_track('a', query=prompts[0]), _track('b', path='No local path', query=prompts[0])]
+
+    monkeypatch.setattr(main, '_playlist', playlist)
+    response = client.post('/api/playlist', json={'prompt': 'rain', 'length': 1000})
+    assert response.status_code == 200
+    assert calls == [(['rain'], main.MAX_PLAYLIST_LENGTH)]
+    first, second = response.json()['tracks']
+    assert first['audio_url'] == '/api/audio/a.mp3'
+    assert 'audio_url' not in second and second['prompt'] == 'prompt b'
+
+def test_playlist_validates_prompts(client):
+    assert client.post('/api/playlist', json={}).status_code == 422
+    too_many = ['rain'] * (main.MAX_PLAYLIST_PROMPTS + 1)
+    assert client.post('/api/playlist', json={'prompts': too_many}).status_code == 422
+
+def test_generate_music_omits_the_url_without_a_local_file(client, monkeypatch):
+    monkeypatch.setattr(main, '_semantic_search', lambda prompt, n_results: [_track('a', path='No local path')])
+    response = client.post('/api/generate-music', json={'prompt': 'rain'})
+    assert response.status_code == 200
+    assert response.json() == {'prompt': 'prompt a', 'distance': 0.1}
+
+def test_similar_maps_unknown_tracks_and_errors(client, monkeypatch):
+    def similar(track_id, n_results):
+        if track_id == 'broken':
+            raise RuntimeError('index unavailable')
+        return None if track_id == 'missing' else [_track('b', feature_distance=0.2)][:n_results]
+
+    monkeypatch.setattr(main, '_similar_tracks', similar)
+    response = client.get('/api/similar/a', params={'n_results': 1})
+    assert response.status_code == 200
+    assert [track['id'] for track in response.json()] == ['b']
+    assert client.get('/api/similar/missing').status_code == 404
+    response = client.get('/api/similar/broken')
+    assert response.status_code == 500
+    assert response.json()['detail'] == 'index unavailable'
+
+def test_similar_reports_a_saturated_pool(client, monkeypatch):
+    async def saturated(*args, **kwargs):
+        raise main.PoolSaturatedError('embedding pool is at capacity')
+
+    monkeypatch.setattr(main.embedding_pool, 'run', saturated)
+    response = client.get('/api/similar/a')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_ready_turns_200_once_required_components_load(client, monkeypatch):
+    release = threading.Event()
+
+    def build():
+        release.wait(5)
+        return object()
+
+    component = main.LazyComponent('audio_query_manager', build)
+    monkeypatch.setattr(main, 'audio_query_manager', component)
+    thread = component.warm_up()
+
+    response = client.get('/api/ready')
+    assert response.status_code == 503
+    assert response.json()['ready'] is False
+    assert response.json()['components']['audio_query_manager']['loaded'] is False
+
+    release.set()
+    thread.join(5)
+    response = client.get('/api/ready')
+    assert response.status_code == 200
+    body = response.json()
+    assert body['ready'] is True
+    assert body['components']['audio_query_manager']['loaded'] is True
+    # Optional components do not hold readiness back
+    assert body['components']['musicgen'] == {'loaded': False, 'required': False}
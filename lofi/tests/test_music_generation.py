@@ -0,0 +1,47 @@
+import json
+import logging
+
+import pandas as pd
+import pytest
+
+from backend.music_generation import AUDIO_MANIFEST, LofiMusicGenerator
+
+@pytest.fixture
+def generator(tmp_path, embedder):
+    generator = LofiMusicGenerator(artifact_dir=str(tmp_path / 'artifacts'), audio_dir=str(tmp_path / 'audio'))
+    generator._model = embedder
+    (tmp_path / 'audio').mkdir()
+    return generator
+
+def _load(generator, tmp_path, frame):
+    static_file = tmp_path / 'static.parquet'
+    frame.to_parquet(static_file)
+    generator._dataset_file = lambda: str(static_file)
+    generator._ensure_loaded()
+
+def test_prompts_map_to_downloaded_audio_by_id(generator, tmp_path):
+    (tmp_path / 'audio' / 'b.mp3').write_bytes(b'audio')
+    (tmp_path / 'audio' / AUDIO_MANIFEST).write_text(json.dumps({'b': {'file': 'b.mp3'}}))
+    _load(generator, tmp_path, pd.DataFrame({'id': ['a', 'b'], 'prompt': ['rain', 'night drive']}))
+
+    assert generator.audio_files == [None, 'b.mp3']
+    match = generator.find_closest_match('rain')
+    assert match['id'] == 'b'
+    assert b''.join(generator.get_audio(match['file_path'])) == b'audio'
+
+def test_dataset_without_ids_falls_back_to_row_positions(generator, tmp_path, caplog):
+    (tmp_path / 'audio' / '1.mp3').write_bytes(b'audio')
+    (tmp_path / 'audio' / AUDIO_MANIFEST).write_text(json.dumps({'1': {'file': '1.mp3'}}))
+    with caplog.at_level(logging.WARNING, logger='backend.music_generation'):
+        _load(generator, tmp_path, pd.DataFrame({'prompt': ['rain', 'night drive']}))
+
+    assert "no 'id' column" in caplog.text
+    assert generator.static_ids == ['0', '1']
+    assert generator.find_closest_match('rain')['file_path'] == '1.mp3'
+
+def test_missing_audio_is_reported(generator, tmp_path, caplog):
+    with caplog.at_level(logging.ERROR, logger='backend.music_generation'):
+        _load(generator, tmp_path, pd.DataFrame({'id': ['a', 'b'], 'prompt': ['rain', 'night drive']}))
+    assert "None of the 2 prompts has a local audio file" in caplog.text
+    with pytest.raises(FileNotFoundError):
+        generator.get_audio(generator.find_closest_match('rain')['file_path'])
@@ -0,0 +1,46 @@
+from concurrent.futures import Future
+
+import pytest
+
+from backend.musicgen import MusicGenService, _GenerationRequest
+
+@pytest.fixture
+def service(tmp_path):
+    return MusicGenService(output_dir=str(tmp_path), max_batch_size=3, batch_window=0.01)
+
+def _request(service, prompt, seed=None, max_new_tokens=256):
+    return _GenerationRequest(service.cache_key(prompt, seed, max_new_tokens), prompt, seed, max_new_tokens, Future())
+
+def _prompts(batch):
+    return [request.prompt for request in batch]
+
+def test_unseeded_requests_of_the_same_length_are_batched(service):
+    for request in [_request(service, 'a'), _request(service, 'b', max_new_tokens=128), _request(service, 'c'),
+                    _request(service, 'd', max_new_tokens=128), _request(service, 'e')]:
+        service._queue.put(request)
+    deferred = []
+    batches = [_prompts(service._next_batch(deferred)) for _ in range(2)]
+    assert batches == [['a', 'c', 'e'], ['b', 'd']]
+    assert deferred == []
+
+def test_seeded_requests_are_generated_alone(service):
+    for request in [_request(service, 'a', seed=1), _request(service, 'b', seed=1), _request(service, 'c')]:
+        service._queue.put(request)
+    deferred = []
+    batches = [_prompts(service._next_batch(deferred)) for _ in range(3)]
+    assert batches == [['a'], ['b'], ['c']]
+
+def test_deferred_requests_keep_their_order_and_batch_size(service):
+    deferred = [_request(service, p, max_new_tokens=n) for p, n in
+                [('a', 128), ('b', 256), ('c', 128), ('d', 128), ('e', 128)]]
+    assert _prompts(service._next_batch(deferred)) == ['a', 'c', 'd']
+    assert _prompts(deferred) == ['b', 'e']
+
+def test_seeded_requests_never_share_a_generate_call(service):
+    with pytest.raises(ValueError, match="Seeded requests"):
+        service._generate_batch([_request(service, 'a'), _request(service, 'b', seed=1)])
+
+def test_cache_key_separates_seeded_and_unseeded_clips(service):
+    keys = {service.cache_key('rain', seed, 256) for seed in (None, 0, 1)}
+    assert len(keys) == 3
+    assert service.cache_key('rain  ', None, 256) == service.cache_key('rain', None, 256)
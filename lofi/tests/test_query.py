@@ -0,0 +1,98 @@
+import json
+import subprocess
+import sys
+import time
+
+import chromadb
+import pytest
+
+from backend import query
+from backend.query import AudioQueryManager
+from backend.shared import bump_catalog_version, read_catalog_version
+
+def _upsert(collection, embedder, rows):
+    prompts = [prompt for _, prompt in rows]
+    collection.upsert(
+        ids=[row_id for row_id, _ in rows],
+        embeddings=embedder.encode(prompts).tolist(),
+        metadatas=[{'prompt': prompt, 'audio_url': f'https://example.com/{row_id}.mp3'} for row_id, prompt in rows]
+    )
+
+@pytest.fixture
+def db_path(tmp_path, embedder):
+    path = str(tmp_path / 'db')
+    client = chromadb.PersistentClient(path=path)
+    _upsert(client.get_or_create_collection(name='audio'), embedder, [(f'track-{i}', f'prompt {i}') for i in range(20)])
+    client.close()
+    return path
+
+@pytest.fixture
+def manager(db_path, embedder):
+    return AudioQueryManager(db_path=db_path, search_backend='numpy', embedding_model=embedder,
+                             version_check_interval=0.0)
+
+def _wait_for_reload(manager):
+    thread = manager._reload_thread
+    if thread is not None:
+        thread.join(timeout=30)
+
+def test_in_place_upsert_is_picked_up_through_the_version_file(db_path, manager, embedder):
+    assert manager.semantic_search('prompt 3', n_results=1)[0]['id'] == 'track-3'
+
+    # Another writer rewrites a track without changing the row count
+    writer = chromadb.PersistentClient(path=db_path).get_collection(name='audio')
+    _upsert(writer, embedder, [('track-3', 'rainy night')])
+    bump_catalog_version(db_path, collection='audio')
+
+    # The old index keeps answering until the background reload swaps in
+    manager.semantic_search('rainy night', n_results=1)
+    _wait_for_reload(manager)
+    result = manager.semantic_search('rainy night', n_results=1)[0]
+    assert result['id'] == 'track-3'
+    assert result['prompt'] == 'rainy night'
+
+def test_count_change_without_version_file_reloads_in_background(db_path, manager, embedder):
+    assert read_catalog_version(db_path) is None
+    manager.semantic_search('prompt 1')
+    writer = chromadb.PersistentClient(path=db_path).get_collection(name='audio')
+    _upsert(writer, embedder, [('track-new', 'snowy cabin')])
+
+    manager.semantic_search('snowy cabin', n_results=1)
+    _wait_for_reload(manager)
+    assert manager.semantic_search('snowy cabin', n_results=1)[0]['id'] == 'track-new'
+
+def test_reload_closes_the_replaced_chroma_client(db_path, embedder, monkeypatch):
+    monkeypatch.setattr(query, 'CHROMA_RETIRE_DELAY', 0.0)
+    manager = AudioQueryManager(db_path=db_path, search_backend='numpy', embedding_model=embedder)
+    old_system = manager.chroma_client._system
+    for _ in range(3):
+        manager.reload_catalog()
+    time.sleep(0.2)
+
+    # chromadb stops a System once its last client is closed
+    assert not old_system._running
+    assert manager.chroma_client._system._running
+    # Retired path spellings are reused instead of growing with every reload
+    assert manager._chroma_slots == {manager._chroma_slot} and manager._chroma_slot <= 2
+    assert manager.semantic_search('prompt 2', n_results=1)[0]['id'] == 'track-2'
+
+def test_reload_sees_writes_from_another_process(db_path, embedder):
+    manager = AudioQueryManager(db_path=db_path, search_backend='chroma', embedding_model=embedder)
+    assert manager.semantic_search('snowy cabin', n_results=1)[0]['id'] != 'track-new'
+    script = (
+        'import json, sys, chromadb\n'
+        'collection = chromadb.PersistentClient(path=sys.argv[1]).get_collection(name="audio")\n'
+        'collection.delete(ids=["track-0", "track-1"])\n'
+        'collection.upsert(ids=["track-new"], embeddings=[json.loads(sys.argv[2])], '
+        'metadatas=[{"prompt": "snowy cabin"}])\n'
+    )
+    embedding = json.dumps(embedder.encode(['snowy cabin'])[0].tolist())
+    subprocess.run([sys.executable, '-c', script, db_path, embedding], check=True)
+
+    manager.reload_catalog()
+    assert manager.collection.count() == 19
+    assert manager.semantic_search('snowy cabin', n_results=1)[0]['id'] == 'track-new'
+
+def test_similar_tracks_tells_unknown_ids_from_unanalysed_ones(manager):
+    assert manager.similar_tracks('no-such-track') is None
+    assert manager.similar_tracks('track-1') == []
@@ -0,0 +1,55 @@
+import os
+import stat
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import pytest
+
+from backend import shared
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def _accept_one(listener):
+    def serve():
+        try:
+            with listener.accept() as connection:
+                connection.send(connection.recv())
+        except (AuthenticationError, EOFError, OSError):
+            pass
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+@pytest.fixture
+def address(tmp_path, monkeypatch):
+    monkeypatch.delenv("EMBEDDER_AUTHKEY", raising=False)
+    return str(tmp_path / 'embedder.sock')
+
+def test_embedder_socket_and_generated_key_are_owner_only(address):
+    with shared._embedder_listener(address) as listener:
+        assert _mode(address) == 0o600
+        assert _mode(shared._authkey_path(address)) == 0o600
+        thread = _accept_one(listener)
+        with Client(address, family='AF_UNIX', authkey=shared._authkey(address)) as connection:
+            connection.send('ping')
+            assert connection.recv() == 'ping'
+        thread.join(5)
+
+def test_embedder_rejects_the_wrong_key(address):
+    with shared._embedder_listener(address) as listener:
+        thread = _accept_one(listener)
+        with pytest.raises(AuthenticationError):
+            Client(address, family='AF_UNIX', authkey=b'lofi')
+        thread.join(5)
+
+def test_configured_key_is_not_written_to_disk(address, monkeypatch):
+    monkeypatch.setenv("EMBEDDER_AUTHKEY", "configured")
+    with shared._embedder_listener(address):
+        assert not os.path.exists(shared._authkey_path(address))
+    assert shared._authkey(address) == b'configured'
+
+def test_missing_key_is_reported(address):
+    with pytest.raises(RuntimeError, match="EMBEDDER_AUTHKEY"):
+        shared._authkey(address)
@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend import transcode
+from backend.transcode import (MANIFEST_FILENAME, VARIANTS, Variant, _filter_graph, build_variants, load_manifest,
+                               variant_path)
+
+MEASURED = {'input_i': -20.0, 'input_tp': -3.0, 'input_lra': 5.0, 'input_thresh': -30.0, 'target_offset': 0.5}
+
+def test_filter_graph_normalizes_once_then_splits_per_variant():
+    graph = _filter_graph(MEASURED, list(VARIANTS.values()))
+    head, *chains = graph.split(';')
+    assert head.startswith('[0:a]loudnorm=I=-14.0:TP=-1.5:LRA=11.0:measured_I=-20.0')
+    assert head.endswith('linear=true,asplit=2[s0][s1]')
+    assert chains == ['[s0]aresample=32000[o0]', '[s1]aresample=44100[o1]']
+    # Silence is split without loudnorm
+    assert _filter_graph(None, [VARIANTS['low']]) == '[0:a]asplit=1[s0];[s0]aresample=32000[o0]'
+
+def test_variant_path_and_missing_manifest(tmp_path):
+    assert variant_path('variants', 'low', 'a.mp3') == os.path.join('variants', 'low', 'a.mp3')
+    assert load_manifest(str(tmp_path)) is None
+    (tmp_path / MANIFEST_FILENAME).write_text('{truncated')
+    assert load_manifest(str(tmp_path)) is None
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """
+    Transcode in threads by writing a marker per variant instead of running ffmpeg.
+    """
+    transcoded = []
+
+    def transcode_file(path, outputs):
+        with open(path) as f:
+            content = f.read()
+        transcoded.append(os.path.basename(path))
+        if content == 'corrupt':
+            raise subprocess.CalledProcessError(1, 'ffmpeg')
+        for output, variant in outputs.items():
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'w') as f:
+                f.write(f'{content}@{variant.bitrate}')
+        return {**MEASURED, 'normalized': True}
+
+    monkeypatch.setattr(transcode, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(transcode, 'transcode_file', transcode_file)
+    return transcoded
+
+@pytest.fixture
+def audio_dir(tmp_path):
+    directory = tmp_path / 'audio'
+    directory.mkdir()
+    for name in ('a.mp3', 'b.mp3'):
+        (directory / name).write_text(name)
+    (directory / 'bad.mp3').write_text('corrupt')
+    return directory
+
+def test_build_writes_variants_and_manifest(audio_dir, fake_ffmpeg):
+    stats = build_variants(str(audio_dir))
+    output_dir = audio_dir / 'variants'
+    assert (stats['files'], stats['transcoded'], stats['reused'], stats['failed']) == (2, 2, 0, 1)
+    assert stats['bytes'] == {'original': 10, 'low': 18, 'medium': 20}
+    assert (output_dir / 'low' / 'a.mp3').read_text() == 'a.mp3@64k'
+    assert (output_dir / 'medium' / 'b.mp3').read_text() == 'b.mp3@128k'
+    assert not (output_dir / 'low' / 'bad.mp3').exists()
+
+    manifest = load_manifest(str(output_dir))
+    assert manifest['settings']['version'] == transcode.TRANSCODE_VERSION
+    assert manifest['settings']['variants']['low'] == {'bitrate': '64k', 'sample_rate': 32000, 'channels': 1}
+    assert sorted(manifest['files']) == ['a.mp3', 'b.mp3']
+    entry = manifest['files']['a.mp3']
+    assert entry['source'][0] == 5
+    assert entry['loudness']['normalized'] is True
+    assert entry['variants'] == {'low': {'size': 9}, 'medium': {'size': 10}}
+
+def test_rebuild_only_transcodes_changed_files(audio_dir, fake_ffmpeg):
+    output_dir = audio_dir / 'variants'
+    build_variants(str(audio_dir))
+    fake_ffmpeg.clear()
+
+    (audio_dir / 'b.mp3').write_text('b.mp3 v2')
+    (audio_dir / 'a.mp3').unlink()
+    (output_dir / 'low' / 'stale.mp3.part').write_text('')
+    stats = build_variants(str(audio_dir))
+    assert sorted(fake_ffmpeg) == ['b.mp3', 'bad.mp3']
+    assert (stats['files'], stats['transcoded'], stats['reused']) == (1, 1, 0)
+    assert (output_dir / 'low' / 'b.mp3').read_text() == 'b.mp3 v2@64k'
+    # Variants of deleted sources go; in-flight partial files are left alone
+    assert sorted(os.listdir(output_dir / 'low')) == ['b.mp3', 'stale.mp3.part']
+
+    fake_ffmpeg.clear()
+    (output_dir / 'medium' / 'b.mp3').unlink()
+    assert build_variants(str(audio_dir))['transcoded'] == 1
+    assert sorted(fake_ffmpeg) == ['b.mp3', 'bad.mp3']
+
+def test_changed_settings_rebuild_everything_and_drop_old_variants(audio_dir, fake_ffmpeg):
+    output_dir = audio_dir / 'variants'
+    build_variants(str(audio_dir))
+    fake_ffmpeg.clear()
+
+    variants = {'low': Variant(bitrate='48k', sample_rate=24000, channels=1)}
+    stats = build_variants(str(audio_dir), variants=variants)
+    assert sorted(fake_ffmpeg) == ['a.mp3', 'b.mp3', 'bad.mp3']
+    assert stats['bytes'] == {'original': 10, 'low': 18}
+    assert (output_dir / 'low' / 'a.mp3').read_text() == 'a.mp3@48k'
+    assert not os.listdir(output_dir / 'medium')
+    assert list(load_manifest(str(output_dir))['settings']['variants']) == ['low']
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+def test_transcode_file_with_ffmpeg(tmp_path):
+    source = str(tmp_path / 'tone.mp3')
+    subprocess.run(['ffmpeg', '-nostdin', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=3',
+                    '-c:a', 'libmp3lame', source], check=True)
+    outputs = {variant_path(str(tmp_path / 'variants'), name, 'tone.mp3'): variant for name, variant in VARIANTS.items()}
+    loudness = transcode.transcode_file(source, outputs)
+    assert loudness['normalized'] is True
+    for output in outputs:
+        assert os.path.getsize(output) > 0
+    assert not [name for name in os.listdir(tmp_path / 'variants' / 'low') if name.endswith('.part')]
@@ -0,0 +1,144 @@
+import time
+
+import pytest
+import requests
+
+from backend.benchmark import _unused_port
+from backend.download import download_audio_file
+from backend.upstream import (UPSTREAM_REJECTED, UPSTREAM_RETRIES, UPSTREAM_SECONDS, CircuitBreaker,
+                              CircuitOpenError, is_retryable)
+
+class StatusError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f'{status} from upstream')
+
+        class Response:
+            status_code = status
+            headers = {'Retry-After': retry_after} if retry_after else {}
+        self.response = Response()
+
+def _observations(upstream, operation, outcome):
+    series = UPSTREAM_SECONDS._series.get((upstream.name, operation, outcome))
+    return sum(series[0]) if series else 0
+
+def test_is_retryable():
+    assert is_retryable(StatusError(503))
+    assert is_retryable(StatusError(429))
+    assert not is_retryable(StatusError(404))
+    assert is_retryable(requests.ConnectionError())
+    assert is_retryable(requests.exceptions.ChunkedEncodingError())
+    assert is_retryable(requests.ReadTimeout())
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(ValueError())
+    # Local faults say nothing about the upstream's health
+    assert not is_retryable(OSError(28, 'No space left on device'))
+    assert not is_retryable(RuntimeError())
+
+def test_local_failures_do_not_open_the_breaker(fast_upstream):
+    upstream = fast_upstream('disk', failure_threshold=1)
+
+    def disk_full():
+        raise OSError(28, 'No space left on device')
+
+    for _ in range(3):
+        with pytest.raises(OSError):
+            upstream.call('download', disk_full)
+    assert upstream.breaker.state == 'closed'
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.15)
+    assert breaker.state == 'half_open'
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    # A failed probe opens the circuit again straight away
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    time.sleep(0.15)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    breaker.before_call()
+
+def test_call_retries_transient_failures(fast_upstream):
+    upstream = fast_upstream('retry', max_retries=3)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise StatusError(503)
+        return 'ok'
+
+    assert upstream.call('op', flaky) == 'ok'
+    assert len(attempts) == 3
+    assert UPSTREAM_RETRIES.value(upstream.name, 'op') == 2
+    assert _observations(upstream, 'op', 'error') == 2
+    assert _observations(upstream, 'op', 'ok') == 1
+    assert upstream.breaker.state == 'closed'
+
+def test_client_errors_are_not_retried_or_held_against_the_upstream(fast_upstream):
+    upstream = fast_upstream('client-error', max_retries=3, failure_threshold=1)
+    attempts = []
+
+    def not_found():
+        attempts.append(1)
+        raise StatusError(404)
+
+    with pytest.raises(StatusError):
+        upstream.call('op', not_found)
+    assert len(attempts) == 1
+    assert upstream.breaker.state == 'closed'
+    assert _observations(upstream, 'op', 'client_error') == 1
+
+def test_open_circuit_fails_fast(fast_upstream):
+    upstream = fast_upstream('fail-fast', max_retries=0, failure_threshold=2, reset_timeout=60)
+    attempts = []
+
+    def down():
+        attempts.append(1)
+        raise requests.ConnectionError('refused')
+
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            upstream.call('op', down)
+    with pytest.raises(CircuitOpenError):
+        upstream.call('op', down)
+    assert len(attempts) == 2
+    assert UPSTREAM_REJECTED.value(upstream.name, 'op') == 1
+
+def test_retry_after_sets_the_delay(fast_upstream):
+    upstream = fast_upstream('retry-after', max_retries=1, max_backoff=1.0)
+    assert 0.5 <= upstream._retry_delay(StatusError(429, retry_after='1'), 0) <= 1.5
+    assert upstream._retry_delay(StatusError(503), 0) <= 0.015
+
+def test_get_times_out_on_a_stalled_server(dataset_server, fast_upstream):
+    server = dataset_server(num_rows=1, stall_rate=1.0, stall_seconds=1.0)
+    upstream = fast_upstream('stall', read_timeout=0.2, max_retries=1)
+    start = time.perf_counter()
+    with pytest.raises(requests.Timeout):
+        upstream.get(f'{server.url}/rows', 'rows', params={'offset': 0, 'length': 1})
+    assert time.perf_counter() - start < 1.0
+    assert _observations(upstream, 'rows', 'timeout') == 2
+
+def test_download_retries_the_whole_transfer(dataset_server, fast_upstream, tmp_path):
+    server = dataset_server(num_rows=1, failure_rate=0.5, seed=3)
+    upstream = fast_upstream('audio', max_retries=10, failure_threshold=100)
+    path = download_audio_file(f'{server.url}/audio/0.mp3', output_dir=str(tmp_path), upstream=upstream)
+    assert path is not None
+    with open(path, 'rb') as f:
+        assert f.read().startswith(b'/audio/0.mp3')
+    assert not [name for name in tmp_path.iterdir() if name.suffix == '.part']
+
+def test_download_returns_none_when_the_host_is_down(fast_upstream, tmp_path):
+    upstream = fast_upstream('audio-down', max_retries=1)
+    assert download_audio_file(f'http://127.0.0.1:{_unused_port()}/a.mp3', str(tmp_path), upstream=upstream) is None
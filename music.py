@@ -1,45 +1,27 @@
 import argparse
-from transformers import pipeline, AutoProcessor, MusicgenForConditionalGeneration
-import scipy.io.wavfile
 from IPython.display import Audio
 
-def generate_audio(query):
-    # Initialize the pipeline
-    synthesiser = pipeline("text-to-audio", model="facebook/musicgen-small")
+from lofi.backend.musicgen import MusicGenService, DEFAULT_MAX_NEW_TOKENS
 
-    # Generate music
-    music = synthesiser(query, forward_params={"do_sample": True})
+# The model is loaded once per process and reused for every query
+_service = MusicGenService(output_dir="generated_audio")
 
-    # Save the audio to a file
-    scipy.io.wavfile.write("musicgen_out.wav", rate=music["sampling_rate"], data=music["audio"])
-
-    # Load the model for conditional generation
-    processor = AutoProcessor.from_pretrained("facebook/musicgen-small")
-    model = MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-small")
-
-    # Process the input text
-    inputs = processor(
-        text=[query],
-        padding=True,
-        return_tensors="pt",
-    )
-
-    # Generate audio values
-    audio_values = model.generate(**inputs, max_new_tokens=256)
-
-    # Get the sampling rate
-    sampling_rate = model.config.audio_encoder.sampling_rate
+def generate_audio(query, seed=0, max_new_tokens=DEFAULT_MAX_NEW_TOKENS):
+    # Generate (or reuse a cached) clip for the query
+    path = _service.generate(query, seed=seed, max_new_tokens=max_new_tokens)
 
     # Return the audio object
-    return Audio(audio_values[0].numpy(), rate=sampling_rate)
+    return Audio(filename=path)
 
 def main():
     parser = argparse.ArgumentParser(description="Generate audio from text query.")
     parser.add_argument("query", type=str, help="The text query to generate audio from.")
+    parser.add_argument("--seed", type=int, default=0, help="Sampling seed.")
+    parser.add_argument("--max-new-tokens", type=int, default=DEFAULT_MAX_NEW_TOKENS, help="Length of the clip in tokens.")
     args = parser.parse_args()
 
-    audio = generate_audio(args.query)
-    print("Audio generated and saved as 'musicgen_out.wav'.")
+    path = _service.generate(args.query, seed=args.seed, max_new_tokens=args.max_new_tokens)
+    print(f"Audio generated and saved as '{path}'.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()